@@ -0,0 +1,91 @@
+"""
+Benchmark the Lambda's multi-gateway fan-out end to end on one machine.
+
+Every gateway is fetched from a local fake Maio server, resampled, and scored by
+script.py's handlers serving the stand-in model through the in-process SageMaker
+endpoint of local_runtime.py, with its simulated latency and its bounded workers.
+`lambda_func.fan_out` runs once per concurrency level, with the prediction cache off.
+It reports the gateways scored per second and the median time of every phase.
+
+Usage (from src/):
+    python benchmarks/bench_fan_out.py --gateways 32 --concurrency 1,4,8 --workers 4
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+sys.path.append(".")
+sys.path.append("maio_ml/deploy/sagemaker")
+# every window reaches the endpoint
+os.environ["PREDICTION_CACHE_MAX_ENTRIES"] = "0"
+
+from benchmarks.fake_maio import MODEL_TAGS, FakeMaioClient, FakeMaioServer
+from benchmarks.stand_in import StandInHandlers
+from gateway_cache import GatewayMetadataCache
+from ingest import MaioIngestor
+from local_runtime import InProcessSagemakerClient, InProcessSagemakerRuntimeClient
+import lambda_func
+
+ENDPOINT = "anomaly"
+TOKEN = "token"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--gateways", type=int, default=32)
+    parser.add_argument("--minutes", type=int, default=256, help="Window scored per gateway.")
+    parser.add_argument("--concurrency", type=str, default="1,4,8")
+    parser.add_argument("--maio-latency", type=float, default=0.05, help="Seconds per Maio request.")
+    parser.add_argument("--latency-ms", type=float, default=20, help="Added to every endpoint invocation.")
+    parser.add_argument("--jitter-ms", type=float, default=5)
+    parser.add_argument("--workers", type=int, default=4, help="Invocations the endpoint serves at once.")
+    args = parser.parse_args()
+
+    levels = list(map(int, args.concurrency.split(",")))
+    end = datetime(2023, 5, 8, 10, 0, 0)
+    # in the format of the Lambda's event
+    window = [t.strftime("%Y-%m-%dT%H:%M:%S.%fZ") for t in (end - timedelta(minutes=args.minutes), end)]
+    defaults = dict(gateway_name=None, endpoint=ENDPOINT, start_time=window[0], end_time=window[1],
+                    input_tags=list(MODEL_TAGS), incremental=False, model_id=None, model_version=None)
+    gateways = [f"gateway-{i}" for i in range(args.gateways)]
+
+    lambda_func.FAN_OUT_CONCURRENCY = max(levels)
+    lambda_func._runtime_client = InProcessSagemakerRuntimeClient(
+        InProcessSagemakerClient({ENDPOINT: "build"}, workers=args.workers, handlers=StandInHandlers()),
+        latency=args.latency_ms / 1000, jitter=args.jitter_ms / 1000, seed=0)
+
+    rows = []
+    with FakeMaioServer(latency=args.maio_latency) as server:
+        # the ingestor the Lambda keeps per engine and token, on the fake's client
+        lambda_func._ingestors[(server.url, TOKEN, tuple(MODEL_TAGS))] = MaioIngestor(
+            server.url, TOKEN, client_factory=FakeMaioClient, max_concurrency=max(levels), tags=MODEL_TAGS,
+            metadata=GatewayMetadataCache())
+        # loads the model and warms the connections
+        with contextlib.redirect_stdout(io.StringIO()):
+            lambda_func.fan_out(server.url, TOKEN, {"gateways": gateways[:1]}, defaults, None)
+
+        for level in levels:
+            started = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                result = lambda_func.fan_out(server.url, TOKEN, {"gateways": gateways, "concurrency": level},
+                                             defaults, None)
+            elapsed = time.perf_counter() - started
+            scored = [r for r in result["results"] if "error" not in r]
+            for failure in [r for r in result["results"] if "error" in r][:1]:
+                print(f"x{level}: {failure['gateway']} failed with {failure['error']}")
+            phases = {phase: np.median([r["phases_ms"][phase] for r in scored]) if scored else float("nan")
+                      for phase in ("fetch", "preprocess", "invoke", "parse")}
+            rows.append((level, elapsed, len(scored), len(result["results"]) - len(scored), phases))
+
+    print(f"{args.gateways} gateways of {args.minutes} minutes, {args.maio_latency * 1000:.0f}ms/Maio request, "
+          f"endpoint {args.latency_ms:.0f}±{args.jitter_ms:.0f}ms with {args.workers} workers")
+    print(f"{'concurrency':>11} {'seconds':>9} {'gateways/s':>11} {'failed':>7} "
+          f"{'fetch':>8} {'prep':>8} {'invoke':>8} {'parse':>8}  (median ms)")
+    for level, elapsed, scored, failed, phases in rows:
+        print(f"{level:>11} {elapsed:>9.2f} {scored / elapsed:>11.1f} {failed:>7} "
+              f"{phases['fetch']:>8.1f} {phases['preprocess']:>8.1f} {phases['invoke']:>8.1f} {phases['parse']:>8.1f}")
@@ -0,0 +1,88 @@
+"""
+Benchmark concurrent multi-gateway ingestion against the sequential loop.
+
+Starts a local fake Maio server with a fixed per-request latency and a per-connection
+setup cost, then fetches a window for every gateway once sequentially with a new
+client per gateway (what the lambda and backfill loop do today) and once through
+`MaioIngestor` at each concurrency level. Finally compares resolving gateway metadata
+on every run with a warm metadata cache. Like the maio_python client, the fake cannot
+filter entries by tag, so every run downloads all the tags of the gateways.
+
+Usage (from src/):
+    python benchmarks/bench_ingest.py --gateways 50 --latency 0.2 --concurrency 1,4,8,16
+"""
+import argparse
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.append(".")
+sys.path.append("maio_ml/deploy/sagemaker")
+from benchmarks.fake_maio import FakeMaioClient, FakeMaioServer
+from maio_ml.deploy.sagemaker.gateway_cache import GatewayMetadataCache
+from maio_ml.deploy.sagemaker.ingest import MaioIngestor
+from maio_ml.deploy.sagemaker.preprocess import MAPPING_COLUMNS, clean_up_frame
+
+
+def sequential(server, requests):
+    frames = []
+    for gateway_name, start, end in requests:
+        client = FakeMaioClient(server.url)
+        gateway_id = client.get_gateway_id_from_name(gateway_name)
+        _, df_maio = client.get_tag_entries_for_gateway(gateway_id, start, end)
+        frames.append(clean_up_frame(df_maio))
+    return frames
+
+
+def concurrent(server, requests, max_concurrency, metadata=None):
+    # a fresh metadata cache per run unless given, so every run resolves the gateway ids
+    with MaioIngestor(server.url, None, client_factory=FakeMaioClient, max_concurrency=max_concurrency,
+                      metadata=metadata or GatewayMetadataCache()) as ingestor:
+        return ingestor.fetch_many_sync(requests)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--gateways", type=int, default=50)
+    parser.add_argument("--minutes", type=int, default=256, help="Window fetched per gateway.")
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds per request.")
+    parser.add_argument("--connect-latency", type=float, default=0.1, help="Seconds per new connection.")
+    parser.add_argument("--concurrency", type=str, default="1,4,8,16")
+    parser.add_argument("--extra-tags", type=int, default=20, help="Tags per gateway the model does not use.")
+    args = parser.parse_args()
+
+    end = datetime(2023, 5, 8, 10, 0, 0, tzinfo=timezone.utc)
+    requests = [(f"gateway-{i}", end - timedelta(minutes=args.minutes), end) for i in range(args.gateways)]
+
+    levels = list(map(int, args.concurrency.split(",")))
+    with FakeMaioServer(latency=args.latency, connect_latency=args.connect_latency,
+                        n_extra_tags=args.extra_tags) as server:
+        rows = []
+
+        def record(label, fn):
+            before = dict(server.stats)
+            started = time.perf_counter()
+            frames = fn()
+            elapsed = time.perf_counter() - started
+            failed = sum(isinstance(f, Exception) for f in frames)
+            rows.append((label, elapsed, server.stats["connections"] - before["connections"],
+                         server.stats["requests"] - before["requests"], server.stats["bytes"] - before["bytes"],
+                         failed))
+            return frames
+
+        expected = record("sequential", lambda: sequential(server, requests))
+        for level in levels:
+            frames = record(f"concurrent x{level}", lambda: concurrent(server, requests, level))
+            assert all(f.equals(e) for f, e in zip(frames, expected))
+        metadata = GatewayMetadataCache()
+        concurrent(server, requests, levels[-1], metadata=metadata)
+        frames = record(f"warm meta x{levels[-1]}", lambda: concurrent(server, requests, levels[-1], metadata=metadata))
+        assert all(f.equals(e) for f, e in zip(frames, expected))
+
+    baseline = rows[0][1]
+    print(f"{args.gateways} gateways with {len(MAPPING_COLUMNS) + args.extra_tags} tags, "
+          f"{args.latency * 1000:.0f}ms/request, {args.connect_latency * 1000:.0f}ms/connection")
+    print(f"{'mode':<16} {'seconds':>9} {'speedup':>8} {'conns':>6} {'requests':>9} {'MB':>8} {'failed':>7}")
+    for label, elapsed, connections, n_requests, n_bytes, failed in rows:
+        print(f"{label:<16} {elapsed:>9.2f} {baseline / elapsed:>7.1f}x {connections:>6} {n_requests:>9} "
+              f"{n_bytes / 1e6:>8.2f} {failed:>7}")
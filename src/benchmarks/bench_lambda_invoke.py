@@ -0,0 +1,70 @@
+"""
+Benchmark the pooled, batched Lambda invoker against a client per request.
+
+Runs against a local stub of the Lambda Invoke API. The baseline creates a boto3
+Lambda client per gateway and invokes synchronously one after the other, as
+/invoke-lambda did; the other modes share one `LambdaInvoker`.
+
+Usage (from src/):
+    python benchmarks/bench_lambda_invoke.py --gateways 100 --concurrency 8 --batch-size 10
+"""
+import argparse
+import json
+import sys
+import time
+
+sys.path.append(".")
+from benchmarks.stub_lambda import StubLambdaServer
+
+import boto3
+
+from maio_ml.deploy.aws_utils.lambda_invoker import LambdaInvoker
+
+FUNCTION_NAME = "test_func_v2"
+
+
+def client_per_request(server, payloads):
+    for payload in payloads:
+        client = boto3.client("lambda", endpoint_url=server.url)
+        client.invoke(FunctionName=FUNCTION_NAME, InvocationType="RequestResponse",
+                      Payload=str.encode(json.dumps(payload)))["Payload"].read()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--gateways", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--batch-size", type=int, default=10)
+    parser.add_argument("--invoke-latency", type=float, default=0.05, help="Seconds of overhead per invocation.")
+    parser.add_argument("--gateway-latency", type=float, default=0.02, help="Seconds per scored gateway.")
+    args = parser.parse_args()
+
+    payloads = [{"gateway_name": f"gateway-{i}", "token": "token", "endpoint": "endpoint",
+                 "start_time": "2023-05-08T10:00:00.000000Z", "end_time": "2023-05-08T11:00:00.000000Z"}
+                for i in range(args.gateways)]
+
+    rows = []
+    with StubLambdaServer(invoke_latency=args.invoke_latency, gateway_latency=args.gateway_latency) as server:
+        def record(label, fn):
+            before = dict(server.stats)
+            started = time.perf_counter()
+            fn()
+            elapsed = time.perf_counter() - started
+            rows.append((label, elapsed, server.stats["invocations"] - before["invocations"],
+                         server.stats["connections"] - before["connections"]))
+
+        record("client per request", lambda: client_per_request(server, payloads))
+        invoker = LambdaInvoker(FUNCTION_NAME, max_concurrency=args.concurrency, endpoint_url=server.url)
+        record("pooled, sequential", lambda: [invoker.invoke(p) for p in payloads])
+        record(f"pooled x{args.concurrency}", lambda: invoker.invoke_many(payloads))
+        record(f"batched {args.batch_size} x{args.concurrency}",
+               lambda: invoker.invoke_many(payloads, batch_size=args.batch_size))
+        record(f"async events x{args.concurrency}", lambda: invoker.invoke_many(payloads, asynchronous=True))
+        invoker.close()
+
+    baseline = rows[0][1]
+    print(f"{args.gateways} gateways, {args.invoke_latency * 1000:.0f}ms/invocation, "
+          f"{args.gateway_latency * 1000:.0f}ms/gateway")
+    print(f"{'mode':<22} {'seconds':>9} {'speedup':>8} {'invocations':>12} {'connections':>12}")
+    for label, elapsed, invocations, connections in rows:
+        print(f"{label:<22} {elapsed:>9.2f} {baseline / elapsed:>7.1f}x {invocations:>12} {connections:>12}")
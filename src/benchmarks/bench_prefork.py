@@ -0,0 +1,141 @@
+"""
+Benchmark memory and throughput of the prefork server against one model copy per worker.
+
+For every worker count, the app is started with `maio_ml.deploy.fastapi.prefork`, once
+with the model preloaded and shared copy-on-write and once with ``--no-preload`` (every
+worker loads its own model, like ``uvicorn --workers``). Clients then post /predict for
+`--seconds`, after which the memory of the server's processes is read from
+/proc/<pid>/smaps_rollup: RSS counts shared pages once per process, PSS splits them
+between the processes sharing them, and USS is the memory private to a process, i.e.
+what one more worker costs.
+
+Usage (from src/, Linux only):
+    MODEL_PATH=build/model.pth python benchmarks/bench_prefork.py --workers 1,2,4,8
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+
+import numpy as np
+
+sys.path.append(".")
+from benchmarks.synthetic import windows
+
+
+def children(pid):
+    with open(f"/proc/{pid}/task/{pid}/children") as f:
+        return [int(child) for child in f.read().split()]
+
+
+def memory(pid):
+    """RSS, PSS and USS of a process, in MiB."""
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                fields[parts[0].rstrip(":")] = int(parts[1]) / 1024
+    return {"rss": fields["Rss"], "pss": fields["Pss"],
+            "uss": fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0)}
+
+
+def payload(frame):
+    return json.dumps({"experiment_id": "latest", "inputs": frame.to_dict(orient="records")}).encode()
+
+
+def get(url, timeout=2.0):
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        return json.loads(response.read())
+
+
+def wait_ready(url, workers, timeout=600.0):
+    """Wait until the workers answer with a warmed up model, probing more often than there are workers."""
+    deadline = time.time() + timeout
+    ready = 0
+    while ready < 4 * workers:
+        if time.time() > deadline:
+            raise TimeoutError(f"Server at {url} not ready after {timeout}s")
+        try:
+            status = get(f"{url}/admin/model")["data"]
+            ready = ready + 1 if status["version"] and status["warmup_seconds"] is not None else 0
+        except OSError:
+            ready = 0
+            time.sleep(0.5)
+
+
+def load(url, clients, seconds):
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    deadline = time.time() + seconds
+
+    def client(seed):
+        payloads = [payload(frame) for frame in windows(16, seed=seed)]
+        sent = 0
+        while time.time() < deadline:
+            request = urllib.request.Request(f"{url}/predict", data=payloads[sent % len(payloads)],
+                                             headers={"Content-Type": "application/json"})
+            sent += 1
+            started = time.perf_counter()
+            try:
+                with urllib.request.urlopen(request, timeout=60) as response:
+                    response.read()
+                with lock:
+                    latencies.append(time.perf_counter() - started)
+            except OSError:
+                with lock:
+                    errors[0] += 1
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return len(latencies) / seconds, float(np.percentile(latencies, 99)) if latencies else None, errors[0]
+
+
+def run(workers, preload, args):
+    url = f"http://127.0.0.1:{args.port}"
+    command = [sys.executable, "-m", "maio_ml.deploy.fastapi.prefork", "--app", args.app,
+               "--host", "127.0.0.1", "--port", str(args.port), "--workers", str(workers)]
+    if not preload:
+        command.append("--no-preload")
+    # every request must reach the model
+    env = dict(os.environ, PREDICTION_CACHE_MAX_ENTRIES="0", MODEL_WATCH_INTERVAL_SECONDS="0")
+    server = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_ready(url, workers)
+        throughput, p99, errors = load(url, args.clients, args.seconds)
+        parent = memory(server.pid)
+        workers_memory = [memory(pid) for pid in children(server.pid)]
+    finally:
+        server.terminate()
+        server.wait()
+    total = {key: parent[key] + sum(m[key] for m in workers_memory) for key in parent}
+    return {"mode": "prefork" if preload else "per-worker", "workers": workers,
+            "rss_mib": total["rss"], "pss_mib": total["pss"],
+            "uss_per_worker_mib": float(np.mean([m["uss"] for m in workers_memory])),
+            "requests_per_second": throughput, "p99_seconds": p99, "errors": errors}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--app", type=str, default="main:app")
+    parser.add_argument("--workers", type=str, default="1,2,4", help="Comma separated worker counts.")
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=20.0)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    rows = [run(int(workers), preload, args) for workers in args.workers.split(",") for preload in (False, True)]
+
+    print(f"{'mode':<11} {'workers':>7} {'RSS MiB':>9} {'PSS MiB':>9} {'USS/worker':>11} {'req/s':>8} "
+          f"{'p99 ms':>8} {'errors':>7}")
+    for r in rows:
+        p99 = f"{r['p99_seconds'] * 1000:.0f}" if r["p99_seconds"] is not None else "-"
+        print(f"{r['mode']:<11} {r['workers']:>7} {r['rss_mib']:>9.0f} {r['pss_mib']:>9.0f} "
+              f"{r['uss_per_worker_mib']:>11.0f} {r['requests_per_second']:>8.1f} {p99:>8} {r['errors']:>7}")
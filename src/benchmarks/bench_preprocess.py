@@ -0,0 +1,73 @@
+"""
+Benchmark the NumPy resample-and-forward-fill against the pandas chain it replaced.
+
+Generates a month of irregular raw tag entries for every gateway with
+benchmarks/synthetic.py, runs both implementations on each gateway, checks that they
+agree and prints the timings.
+
+Usage (from src/):
+    python benchmarks/bench_preprocess.py --gateways 50 --days 30
+"""
+import argparse
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(".")
+from benchmarks.synthetic import raw_entries
+from maio_ml.deploy.sagemaker.preprocess import MAPPING_COLUMNS, clean_up_frame
+
+
+def pandas_chain(df_maio):
+    """The chain from lambda_func.clean_up_data before the NumPy rewrite."""
+    mapping_columns = dict(MAPPING_COLUMNS, timestamps="timestamp")
+    df_maio_small = df_maio[mapping_columns.keys()].rename(columns=mapping_columns)
+    df_maio_small['timestamp'] = pd.to_datetime(df_maio_small['timestamp'])
+    df_maio_small = df_maio_small.set_index('timestamp')
+    df_maio_small_resampled = df_maio_small.resample("1Min").mean()
+    df_maio_small_resampled = df_maio_small_resampled.ffill()
+    df_maio_small_resampled.reset_index(inplace=True)
+    df_maio_small_resampled.drop(columns=['timestamp'], inplace=True)
+    return df_maio_small_resampled
+
+
+def measure(fn, frames, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for frame in frames:
+            fn(frame)
+        best = min(best, time.perf_counter() - started)
+    tracemalloc.start()
+    fn(frames[0])
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--gateways", type=int, default=20)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--string-timestamps", action="store_true",
+                        help="Pass timestamps as strings so both paths include the parsing.")
+    args = parser.parse_args()
+
+    frames = [raw_entries(f"gateway-{i}", args.days, string_timestamps=args.string_timestamps)
+              for i in range(args.gateways)]
+    rows = sum(len(f) for f in frames)
+    print(f"{args.gateways} gateways x {args.days} days, {rows} raw entries")
+
+    for frame in frames[:3]:
+        expected = pandas_chain(frame).to_numpy(dtype=np.float32)
+        np.testing.assert_allclose(clean_up_frame(frame).to_numpy(), expected, rtol=1e-5, equal_nan=True)
+
+    results = {name: measure(fn, frames, args.repeat)
+               for name, fn in [("pandas", pandas_chain), ("numpy", clean_up_frame)]}
+    for name, (seconds, peak) in results.items():
+        print(f"{name:>8}: {seconds:8.3f}s  {rows / seconds:12.0f} rows/s  peak {peak / 2 ** 20:8.1f} MiB")
+    print(f" speedup: {results['pandas'][0] / results['numpy'][0]:.2f}x")
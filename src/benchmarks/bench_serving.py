@@ -0,0 +1,207 @@
+"""
+Load test of the serving stack with throughput and latency percentiles.
+
+Starts `benchmarks/stand_in.py` (the FastAPI app, or script.py's handlers behind
+/invocations) with the stand-in model, then replays five-column chiller windows at
+every concurrency level: each client keeps one connection open and sends its next
+request as soon as the previous one is answered. The endpoint receives the windows as
+split JSON and as an Arrow IPC stream; the app as the records /predict expects.
+
+Results are written to `--output` as JSON. With `--baseline`, every (target, format,
+concurrency) is compared with the stored run, and throughput drops or p95/p99 increases
+beyond `--tolerance` are flagged as regressions (exit code 1). `--save-baseline` stores
+the current run as the new baseline.
+
+Usage (from src/):
+    python benchmarks/bench_serving.py --target endpoint --formats json,arrow --concurrency 1,8,32 \\
+        --output build/bench-serving.json --baseline benchmarks/baselines/serving-endpoint.json
+"""
+import argparse
+import http.client
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import pyarrow as pa
+
+sys.path.append(".")
+from benchmarks.synthetic import windows
+
+ARROW_STREAM = "application/vnd.apache.arrow.stream"
+
+
+def encode(frame, target, fmt):
+    """``(path, content type, body)`` of one request."""
+    if target == "app":
+        return "/predict", "application/json", json.dumps(
+            {"experiment_id": "latest", "inputs": frame.to_dict(orient="records")}).encode()
+    if fmt == "arrow":
+        sink = io.BytesIO()
+        table = pa.Table.from_pandas(frame, preserve_index=False)
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return "/invocations", ARROW_STREAM, sink.getvalue()
+    return "/invocations", "application/json", frame.to_json(orient="split", index=False).encode()
+
+
+def start(target, port):
+    env = dict(os.environ, PREDICTION_CACHE_MAX_ENTRIES="0", MODEL_WATCH_INTERVAL_SECONDS="0")
+    server = subprocess.Popen([sys.executable, "benchmarks/stand_in.py", target, "--port", str(port)], env=env)
+    probe = "/admin/model" if target == "app" else "/ping"
+    deadline = time.time() + 120
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"Stand-in {target} exited with code {server.returncode}")
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=2)
+            connection.request("GET", probe)
+            if connection.getresponse().status == 200:
+                return server
+        except OSError:
+            time.sleep(0.2)
+    server.kill()
+    raise TimeoutError(f"Stand-in {target} did not start")
+
+
+def drive(port, requests, concurrency, total, warmup):
+    """
+    Send `total` requests from `concurrency` closed-loop clients after `warmup` unmeasured requests per client;
+    returns the latencies, the errors and the seconds the measured requests took.
+    """
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    counter = iter(range(total))
+    started = []
+    # the clock starts once every client has warmed its connection and the server's pools
+    measuring = threading.Barrier(concurrency, action=lambda: started.append(time.perf_counter()))
+
+    def send(connection, i):
+        path, content_type, body = requests[i % len(requests)]
+        began = time.perf_counter()
+        try:
+            connection.request("POST", path, body=body, headers={"Content-Type": content_type})
+            response = connection.getresponse()
+            response.read()
+            ok = response.status == 200
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+            ok = False
+        return connection, ok, time.perf_counter() - began
+
+    def client(offset):
+        connection = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+        for i in range(warmup):
+            connection, _, _ = send(connection, offset + i)
+        measuring.wait()
+        for i in counter:
+            connection, ok, elapsed = send(connection, i)
+            with lock:
+                if ok:
+                    latencies.append(elapsed)
+                else:
+                    errors[0] += 1
+        connection.close()
+
+    threads = [threading.Thread(target=client, args=(n * warmup,)) for n in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors[0], time.perf_counter() - started[0]
+
+
+def summarize(target, fmt, concurrency, latencies, errors, elapsed):
+    ms = np.array(latencies) * 1000
+    return {
+        "target": target, "format": fmt, "concurrency": concurrency, "requests": len(latencies), "errors": errors,
+        "requests_per_second": round(len(latencies) / elapsed, 2),
+        "p50_ms": round(float(np.percentile(ms, 50)), 2) if len(ms) else None,
+        "p95_ms": round(float(np.percentile(ms, 95)), 2) if len(ms) else None,
+        "p99_ms": round(float(np.percentile(ms, 99)), 2) if len(ms) else None,
+        "mean_ms": round(float(ms.mean()), 2) if len(ms) else None,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Regressions of `results` against `baseline`: lower throughput or higher p95/p99 beyond `tolerance`."""
+    previous = {(r["target"], r["format"], r["concurrency"]): r for r in baseline["results"]}
+    regressions = []
+    for result in results:
+        before = previous.get((result["target"], result["format"], result["concurrency"]))
+        if before is None:
+            continue
+        checks = [("requests_per_second", -1), ("p95_ms", 1), ("p99_ms", 1)]
+        for metric, direction in checks:
+            old, new = before.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            result[f"{metric}_change"] = round(change, 4)
+            if change * direction > tolerance:
+                regressions.append(f"{result['target']}/{result['format']} x{result['concurrency']}: "
+                                   f"{metric} {old} -> {new} ({change:+.1%})")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--target", choices=["app", "endpoint"], default="endpoint")
+    parser.add_argument("--formats", type=str, default="json,arrow", help="Payload formats of the endpoint.")
+    parser.add_argument("--concurrency", type=str, default="1,8,32")
+    parser.add_argument("--requests", type=int, default=500, help="Measured requests per level.")
+    parser.add_argument("--warmup", type=int, default=5, help="Unmeasured requests per client.")
+    parser.add_argument("--rows", type=int, default=256, help="Minutes per window.")
+    parser.add_argument("--windows", type=int, default=64, help="Distinct windows replayed.")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--output", type=str, default="build/bench-serving.json")
+    parser.add_argument("--baseline", type=str)
+    parser.add_argument("--save-baseline", action="store_true", help="Store this run as the baseline.")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Relative change flagged as a regression.")
+    args = parser.parse_args()
+
+    formats = ["json"] if args.target == "app" else args.formats.split(",")
+    frames = windows(args.windows, args.rows)
+    results = []
+    server = start(args.target, args.port)
+    try:
+        for fmt in formats:
+            requests = [encode(frame, args.target, fmt) for frame in frames]
+            for concurrency in map(int, args.concurrency.split(",")):
+                latencies, errors, elapsed = drive(args.port, requests, concurrency, args.requests, args.warmup)
+                results.append(summarize(args.target, fmt, concurrency, latencies, errors, elapsed))
+                print(json.dumps(results[-1]))
+    finally:
+        server.terminate()
+        server.wait()
+
+    regressions = []
+    if args.baseline and os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+
+    run = {"created_at": datetime.now(timezone.utc).isoformat(), "python": platform.python_version(),
+           "machine": platform.machine(), "cpus": os.cpu_count(), "rows": args.rows,
+           "requests": args.requests, "results": results, "regressions": regressions}
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(run, f, indent=2)
+    if args.save_baseline and args.baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(args.baseline)), exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump(run, f, indent=2)
+
+    print(f"{'format':<7} {'clients':>7} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for r in results:
+        print(f"{r['format']:<7} {r['concurrency']:>7} {r['requests_per_second']:>9.1f} {r['p50_ms'] or 0:>8.1f} "
+              f"{r['p95_ms'] or 0:>8.1f} {r['p99_ms'] or 0:>8.1f} {r['errors']:>7}")
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    sys.exit(1 if regressions else 0)
@@ -0,0 +1,164 @@
+"""
+Local stand-in for the Maio engine HTTP API.
+
+`FakeMaioServer` serves deterministic synthetic tag entries for any gateway with a
+configurable per-request latency and a per-connection setup cost standing in for
+the TLS handshake, and can fail its first entry requests to exercise retries. `FakeMaioClient` exposes the two `maio_python.Client` methods the
+pipelines use, with the same capabilities (entries of every tag of a gateway, no
+filtering by tag), and keeps one keep-alive connection per client.
+
+    with FakeMaioServer(latency=0.05) as server:
+        client = FakeMaioClient(server.url)
+        gateway_id = client.get_gateway_id_from_name("Aruba")
+        _, df = client.get_tag_entries_for_gateway(gateway_id, start, end)
+"""
+import http.client
+import json
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, urlencode, urlparse
+
+import numpy as np
+import pandas as pd
+
+MODEL_TAGS = ["CoolerTemp", "BathTemp", "CoolerSwitch", "RefridgentTemp", "CompressorCurrent"]
+
+
+def tag_catalog(n_extra_tags):
+    names = MODEL_TAGS + [f"Tag{i:03d}" for i in range(n_extra_tags)]
+    return [{"id": str(1000 + i), "label": name} for i, name in enumerate(names)]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        time.sleep(self.server.connect_latency)
+        self.server.stats["connections"] += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, payload, status=200):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.stats["requests"] += 1
+        self.server.stats["bytes"] += len(body)
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.in_flight += 1
+            self.server.stats["max_in_flight"] = max(self.server.stats["max_in_flight"], self.server.in_flight)
+        try:
+            time.sleep(self.server.latency)
+            self._get()
+        finally:
+            with self.server.lock:
+                self.server.in_flight -= 1
+
+    def _get(self):
+        url = urlparse(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        parts = url.path.strip("/").split("/")
+
+        if parts == ["gateways"]:
+            name = query.get("name", "")
+            return self._send({"id": str(zlib.crc32(name.encode()) % 100000)})
+        if len(parts) == 3 and parts[0] == "gateways" and parts[2] == "entries":
+            with self.server.lock:
+                fail, self.server.faults = self.server.faults > 0, max(self.server.faults - 1, 0)
+            if fail:
+                return self._send({"error": "unavailable"}, status=503)
+            return self._send(self.server.entries(parts[1], float(query["start"]), float(query["end"])))
+        self._send({"error": "not found"}, status=404)
+
+
+class FakeMaioServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port=0, latency=0.0, connect_latency=0.0, interval_seconds=30, n_extra_tags=20, faults=0):
+        """
+        Args:
+            port (int): port to listen on, 0 for any free port.
+            latency (float): seconds added to every request.
+            connect_latency (float): seconds added once per new connection.
+            interval_seconds (int): spacing of the generated entries.
+            n_extra_tags (int): tags on every gateway besides the five the model uses.
+            faults (int): entry requests answered with a 503 before any succeeds.
+        """
+        super().__init__(("127.0.0.1", port), _Handler)
+        self.latency = latency
+        self.connect_latency = connect_latency
+        self.interval_seconds = interval_seconds
+        self.n_extra_tags = n_extra_tags
+        self.faults = faults
+        self.stats = {"requests": 0, "connections": 0, "bytes": 0, "max_in_flight": 0}
+        self.in_flight = 0
+        self.lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def entries(self, gateway_id, start, end):
+        catalog = tag_catalog(self.n_extra_tags)
+        first = int(np.ceil(start / self.interval_seconds)) * self.interval_seconds
+        seconds = np.arange(first, end + 1e-9, self.interval_seconds, dtype=np.int64)
+        seed = zlib.crc32(str(gateway_id).encode())
+        payload = {"timestamps": [datetime.fromtimestamp(s, timezone.utc).isoformat() for s in seconds.tolist()]}
+        for i, tag in enumerate(catalog):
+            phase = (seed + int(tag["id"])) % 360
+            payload[tag["label"]] = np.round(10 + 3 * np.sin(seconds / 3600.0 + phase), 4).tolist()
+        return payload
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
+
+
+class FakeMaioClient(object):
+    """Mirrors the parts of `maio_python.Client` used by the pipelines."""
+
+    def __init__(self, base_url, token=None):
+        url = urlparse(base_url)
+        self._connection = http.client.HTTPConnection(url.hostname, url.port, timeout=30)
+        self._lock = threading.Lock()
+
+    def _get(self, path, **params):
+        query = urlencode({k: v for k, v in params.items() if v is not None})
+        with self._lock:
+            self._connection.request("GET", f"{path}?{query}" if query else path)
+            response = self._connection.getresponse()
+            body = response.read()
+        if response.status != 200:
+            raise RuntimeError(f"GET {path} failed with {response.status}")
+        return json.loads(body)
+
+    def get_gateway_id_from_name(self, gateway_name):
+        return self._get("/gateways", name=gateway_name)["id"]
+
+    def get_tag_entries_for_gateway(self, gateway_id, start_time, end_time):
+        payload = self._get(f"/gateways/{quote(str(gateway_id))}/entries",
+                            start=_epoch(start_time), end=_epoch(end_time))
+        return None, pd.DataFrame(payload)
+
+
+def _epoch(value):
+    ts = pd.Timestamp(value)
+    ts = ts.tz_localize("UTC") if ts.tzinfo is None else ts
+    return ts.timestamp()
@@ -0,0 +1,136 @@
+"""
+Serve the API or the SageMaker inference handlers locally with a stand-in model.
+
+`StandInModel` has the interface of the Merlion detector (``get_anomaly_label`` over a
+`TimeSeries`) and a comparable cost profile: every point is scored from the window of
+`sequence_length` minutes ending at it through a dense encoder. No artifact or training
+is needed, so serving changes can be benchmarked anywhere.
+
+    python benchmarks/stand_in.py app --port 8000        # main:app, the FastAPI server
+    python benchmarks/stand_in.py endpoint --port 8080   # script.py behind /ping and /invocations
+
+Run from src/, with PREDICTION_CACHE_MAX_ENTRIES=0 so that every request reaches the model.
+"""
+import argparse
+import os
+import sys
+import tempfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(".")
+
+
+class StandInModel(object):
+    def __init__(self, dim: int = 5, sequence_length: int = 32, hidden: int = 64, seed: int = 0):
+        rng = np.random.default_rng(seed)
+        self.sequence_length = sequence_length
+        self.encoder = rng.normal(0, 0.1, (sequence_length * dim, hidden)).astype(np.float32)
+        self.decoder = rng.normal(0, 0.1, (hidden, sequence_length * dim)).astype(np.float32)
+
+    def get_anomaly_label(self, time_series):
+        from merlion.utils.time_series import TimeSeries
+
+        df = time_series.to_pd()
+        values = np.nan_to_num(df.to_numpy(dtype=np.float32))
+        values = (values - values.mean(axis=0)) / (values.std(axis=0) + 1e-6)
+        length = min(self.sequence_length, len(values))
+        padded = np.concatenate([np.repeat(values[:1], self.sequence_length - length, axis=0), values]) \
+            if length < self.sequence_length else values
+        windows = np.lib.stride_tricks.sliding_window_view(padded, self.sequence_length, axis=0)
+        flat = windows.reshape(len(windows), -1)
+        error = np.square(np.tanh(flat @ self.encoder) @ self.decoder - flat).mean(axis=1)
+        scores = np.concatenate([np.full(len(values) - len(error), error[0]), error]) if len(error) else error
+        return TimeSeries.from_pd(pd.DataFrame({"anom_score": scores}, index=df.index))
+
+
+def stand_in_app():
+    """The FastAPI app of main.py, serving the stand-in model instead of MODEL_PATH."""
+    import main
+    from maio_ml.deploy.fastapi.model_store import ModelStore
+
+    artifact = os.path.join(tempfile.mkdtemp(), "stand-in.pth")
+    open(artifact, "w").close()
+    main.models = ModelStore(artifact, loader=lambda path: StandInModel())
+    return main.app
+
+
+class StandInHandlers(object):
+    """script.py's handlers with `model_fn` loading the stand-in model, for the endpoints of local_runtime.py."""
+
+    def __init__(self):
+        sys.path.append("maio_ml/deploy/sagemaker")
+        import script
+
+        # the handlers log every request at INFO, which would dominate the measurements
+        script.logger.setLevel("WARNING")
+        self.script = script
+
+    def model_fn(self, model_dir):
+        return StandInModel()
+
+    def __getattr__(self, name):
+        return getattr(self.script, name)
+
+
+class _InvocationsHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body=b"", content_type="application/json"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self._send(200 if self.path == "/ping" else 404)
+
+    def do_POST(self):
+        if self.path != "/invocations":
+            return self._send(404)
+        script = self.server.script
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        content_type = self.headers.get("Content-Type", "application/json")
+        try:
+            data = script.input_fn(body if content_type == script.ARROW_STREAM else body.decode(), content_type)
+            prediction = script.predict_fn(data, self.server.model)
+            response = script.output_fn(prediction, "application/json")
+        except Exception as e:
+            return self._send(500, str(e).encode(), "text/plain")
+        self._send(200, response.encode() if isinstance(response, str) else response)
+
+
+def serve_endpoint(host, port):
+    """script.py's input_fn / predict_fn / output_fn behind the SageMaker container contract."""
+    sys.path.append("maio_ml/deploy/sagemaker")
+    import script
+
+    # the handlers log every request at INFO, which would dominate the measurements
+    script.logger.setLevel("WARNING")
+    server = ThreadingHTTPServer((host, port), _InvocationsHandler)
+    server.daemon_threads = True
+    server.script = script
+    server.model = StandInModel()
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("target", choices=["app", "endpoint"])
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+
+    if args.target == "app":
+        import uvicorn
+
+        uvicorn.run(stand_in_app(), host=args.host, port=args.port, log_level="warning")
+    else:
+        serve_endpoint(args.host, args.port)
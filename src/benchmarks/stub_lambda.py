@@ -0,0 +1,124 @@
+"""
+Local stand-in for the AWS Lambda Invoke API.
+
+`StubLambdaServer` answers ``POST /2015-03-31/functions/<name>/invocations`` like the
+Lambda service does, so a boto3 Lambda client created with ``endpoint_url=server.url``
+(and any credentials) can be exercised without AWS. ``RequestResponse`` invocations run
+the handler and return its result; ``Event`` invocations are accepted with a 202 and
+run in the background. The default handler mimics the scoring function, including
+fan-out events with a ``gateways`` list, with a fixed overhead per invocation and a
+fixed cost per gateway.
+
+    with StubLambdaServer(invoke_latency=0.05) as server:
+        invoker = LambdaInvoker("test_func_v2", endpoint_url=server.url)
+"""
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# boto3 signs requests even for a local endpoint
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "stub")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "stub")
+os.environ.setdefault("AWS_DEFAULT_REGION", "eu-west-1")
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body=b"", headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        parts = self.path.strip("/").split("/")
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if len(parts) != 4 or parts[1] != "functions" or parts[3] != "invocations":
+            return self._send(404, b'{"message": "not found"}')
+        event = json.loads(body or b"{}")
+        server = self.server
+        server.record(parts[2], event)
+
+        if self.headers.get("X-Amz-Invocation-Type") == "Event":
+            threading.Thread(target=server.run, args=(event,), daemon=True).start()
+            return self._send(202)
+        try:
+            result = server.run(event)
+        except Exception as e:
+            return self._send(200, json.dumps({"errorMessage": str(e)}).encode(),
+                              {"X-Amz-Function-Error": "Unhandled"})
+        self._send(200, json.dumps(result).encode(), {"X-Amz-Executed-Version": "$LATEST"})
+
+
+class StubLambdaServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port=0, invoke_latency=0.05, gateway_latency=0.02, handler=None):
+        """
+        Args:
+            port (int): port to listen on, 0 for any free port.
+            invoke_latency (float): seconds of overhead per invocation.
+            gateway_latency (float): seconds per scored gateway.
+            handler (callable): ``handler(event)`` replacing the default scoring stand-in.
+        """
+        super().__init__(("127.0.0.1", port), _Handler)
+        self.invoke_latency = invoke_latency
+        self.gateway_latency = gateway_latency
+        self.handler = handler or self.score
+        self.stats = {"invocations": 0, "gateways": 0, "connections": 0, "running": 0, "peak_running": 0}
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def get_request(self):
+        request = super().get_request()
+        with self._lock:
+            self.stats["connections"] += 1
+        return request
+
+    def record(self, function_name, event):
+        with self._lock:
+            self.stats["invocations"] += 1
+            self.stats["gateways"] += len(event.get("gateways") or [event])
+
+    def run(self, event):
+        with self._lock:
+            self.stats["running"] += 1
+            self.stats["peak_running"] = max(self.stats["peak_running"], self.stats["running"])
+        try:
+            return self.handler(event)
+        finally:
+            with self._lock:
+                self.stats["running"] -= 1
+
+    def score(self, event):
+        time.sleep(self.invoke_latency)
+        if "gateways" not in event:
+            time.sleep(self.gateway_latency)
+            return {"anomaly_detected": "False", "count": 0}
+        results = []
+        for gateway in event["gateways"]:
+            time.sleep(self.gateway_latency)
+            name = gateway if isinstance(gateway, str) else gateway.get("gateway_name")
+            results.append({"gateway": name, "anomaly_detected": "False", "count": 0})
+        return {"results": results, "pending": [], "in_flight": [], "checkpoint": None}
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
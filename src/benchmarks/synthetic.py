@@ -0,0 +1,212 @@
+"""
+Synthetic chiller telemetry for benchmarks and scale tests.
+
+`chiller_frame` generates minute-level data in the five-column schema the model reads
+(`cooler_temp`, `bath_temp`, `cooler_switch`, `refridgent_temp`, `compressor_current`)
+plus a `label` column. The compressor runs in on/off cycles of random length; bath,
+cooler and refrigerant temperatures follow it with a lag, on top of a daily ambient
+swing. Anomalies are injected at a given rate per day and labelled: compressor failures
+(no current, rising temperatures), refrigerant leaks (slowly rising refrigerant
+temperature) and sensor spikes. Gaps drop whole spans of minutes, and missing values
+and timestamp jitter make the data look like what the gateways actually send.
+
+Everything is vectorized over the rows, so months of data for hundreds of gateways
+take seconds. Every gateway has its own seed, so a given (gateway, seed) always
+produces the same data.
+
+    frame = chiller_frame("gateway-7", days=30)
+    raw = raw_entries("gateway-7", days=30)      # Maio-style entries for the preprocessing
+
+    python benchmarks/synthetic.py --gateways 100 --days 90 --format parquet,csv --output build/synthetic
+
+writes ``<output>/<gateway>/data.csv`` (the training channel layout of script.py) and
+``<output>/<gateway>/data.parquet`` (with a `timestamp` column, as batch_transform.py reads).
+"""
+import argparse
+import os
+import sys
+import time
+import zlib
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(".")
+from maio_ml.deploy.sagemaker.preprocess import MAPPING_COLUMNS, TIMESTAMP_COLUMN
+
+COLUMNS = list(MAPPING_COLUMNS.values())
+LABEL_COLUMN = "label"
+START = pd.Timestamp("2023-01-01")
+MINUTES_PER_DAY = 24 * 60
+
+
+def gateway_seed(gateway, seed: int = 0) -> int:
+    return zlib.crc32(str(gateway).encode()) ^ seed
+
+
+def switch_cycles(rng, minutes: int, on_minutes: float, off_minutes: float) -> np.ndarray:
+    """Compressor state per minute: alternating on and off spans of gamma distributed lengths."""
+    n = int(minutes / (on_minutes + off_minutes) * 1.5) + 10
+    durations = np.empty(2 * n)
+    durations[0::2] = rng.gamma(4.0, on_minutes / 4.0, n)
+    durations[1::2] = rng.gamma(4.0, off_minutes / 4.0, n)
+    durations = np.maximum(np.round(durations), 1).astype(np.int64)
+    state = np.repeat(np.tile(np.array([1.0, 0.0], dtype=np.float32), n), durations)
+    # start anywhere in a cycle
+    offset = int(rng.integers(0, durations[0] + durations[1]))
+    return np.resize(state[offset:], minutes)
+
+
+def lagged(values: np.ndarray, minutes: float) -> np.ndarray:
+    """First order response to `values` with a time constant of `minutes`."""
+    return pd.Series(values).ewm(alpha=1.0 - np.exp(-1.0 / minutes), adjust=False).mean().to_numpy(np.float32)
+
+
+def inject_anomalies(rng, frame: dict, label: np.ndarray, per_day: float):
+    """Add labelled compressor failures, refrigerant leaks and sensor spikes to `frame` in place."""
+    minutes = len(label)
+    n_events = rng.poisson(per_day * minutes / MINUTES_PER_DAY)
+    kinds = rng.choice(["compressor_failure", "refrigerant_leak", "sensor_spike"], n_events, p=[0.4, 0.3, 0.3])
+    for kind in kinds:
+        duration = int(rng.integers(5, 30) if kind == "sensor_spike" else rng.integers(60, 360))
+        start = int(rng.integers(0, max(minutes - duration, 1)))
+        span = slice(start, min(start + duration, minutes))
+        ramp = np.linspace(0.0, 1.0, span.stop - span.start, dtype=np.float32)
+        if kind == "compressor_failure":
+            frame["compressor_current"][span] = rng.normal(0.2, 0.05, len(ramp))
+            frame["bath_temp"][span] += 6.0 * ramp
+            frame["cooler_temp"][span] += 8.0 * ramp
+        elif kind == "refrigerant_leak":
+            frame["refridgent_temp"][span] += 10.0 * ramp
+            frame["compressor_current"][span] *= 1.0 + 0.4 * ramp
+        else:
+            column = COLUMNS[int(rng.choice([0, 1, 3, 4]))]
+            frame[column][span] += rng.choice([-1.0, 1.0]) * 8.0 * frame[column].std()
+        label[span] = 1
+
+
+def chiller_frame(gateway="gateway-0", days: float = 30, start=START, seed: int = 0, anomalies_per_day: float = 0.2,
+                  gaps_per_day: float = 0.05, missing_rate: float = 0.01, jitter_seconds: float = 0.0,
+                  on_minutes: float = 18, off_minutes: float = 25) -> pd.DataFrame:
+    """
+    Minute-level data of one gateway.
+
+    Args:
+        gateway: name or id of the gateway, which seeds its data together with `seed`.
+        days (float): length of the history.
+        start: first timestamp.
+        anomalies_per_day (float): mean number of injected anomalies per day.
+        gaps_per_day (float): mean number of gaps per day, each dropping 10 minutes to 6 hours.
+        missing_rate (float): share of sensor values replaced by NaN.
+        jitter_seconds (float): timestamps are moved by up to this many seconds either way.
+        on_minutes (float): mean length of a compressor run.
+        off_minutes (float): mean length of a compressor pause.
+
+    Returns:
+        pd.DataFrame: the five sensor columns as float32 and the int8 label, indexed by a
+        ``timestamp`` DatetimeIndex.
+    """
+    rng = np.random.default_rng(gateway_seed(gateway, seed))
+    minutes = int(days * MINUTES_PER_DAY)
+    t = np.arange(minutes, dtype=np.float32)
+
+    ambient = 2.0 * np.sin(2 * np.pi * (t / MINUTES_PER_DAY + rng.random())).astype(np.float32)
+    switch = switch_cycles(rng, minutes, on_minutes, off_minutes)
+    cooling = lagged(switch, 8.0)
+
+    def noise(scale):
+        return rng.normal(0.0, scale, minutes).astype(np.float32)
+
+    frame = {
+        "bath_temp": 4.0 + 0.5 * ambient + 2.0 * (1.0 - lagged(switch, 30.0)) + noise(0.1),
+        "cooler_switch": switch,
+        "refridgent_temp": 18.0 - 22.0 * cooling + 0.8 * ambient + noise(0.5),
+        "compressor_current": switch * (7.5 + 0.3 * ambient) + 0.3 + noise(0.15) * (0.2 + switch),
+    }
+    frame["cooler_temp"] = frame["bath_temp"] - 3.0 * cooling + noise(0.2)
+    label = np.zeros(minutes, dtype=np.int8)
+    inject_anomalies(rng, frame, label, anomalies_per_day)
+
+    offsets = t.astype("timedelta64[m]").astype("timedelta64[ns]")
+    if jitter_seconds:
+        offsets = offsets + (rng.uniform(-jitter_seconds, jitter_seconds, minutes) * 1e9).astype("timedelta64[ns]")
+    df = pd.DataFrame({column: frame[column].astype(np.float32) for column in COLUMNS},
+                      index=pd.DatetimeIndex(pd.Timestamp(start) + offsets, name="timestamp"))
+    df[LABEL_COLUMN] = label
+
+    if missing_rate:
+        df[COLUMNS] = df[COLUMNS].mask(rng.random((minutes, len(COLUMNS))) < missing_rate)
+    keep = np.ones(minutes, dtype=bool)
+    for _ in range(rng.poisson(gaps_per_day * minutes / MINUTES_PER_DAY)):
+        gap_start = int(rng.integers(0, minutes))
+        keep[gap_start:gap_start + int(rng.integers(10, 360))] = False
+    return df[keep]
+
+
+def raw_entries(gateway="gateway-0", days: float = 30, seed: int = 0, interval_seconds: float = 40,
+                missing_rate: float = 0.2, string_timestamps: bool = False, **kwargs) -> pd.DataFrame:
+    """
+    Raw Maio entries of one gateway: the Maio tag columns at irregular timestamps roughly
+    every `interval_seconds` (with occasional long gaps), each value missing with
+    probability `missing_rate`, as `get_tag_entries_for_gateway` returns them.
+    Other keyword arguments go to `chiller_frame`.
+    """
+    minute = chiller_frame(gateway, days, seed=seed, missing_rate=0.0, gaps_per_day=0.0, **kwargs)
+    rng = np.random.default_rng(gateway_seed(gateway, seed) + 1)
+    n = int(days * MINUTES_PER_DAY * 60 / interval_seconds)
+    offsets = np.cumsum(rng.exponential(interval_seconds, n) + rng.binomial(1, 0.001, n) * rng.exponential(1800, n))
+    offsets = offsets[offsets < days * MINUTES_PER_DAY * 60]
+    rows = np.minimum((offsets // 60).astype(np.int64), len(minute) - 1)
+    df = pd.DataFrame({tag: minute[column].to_numpy()[rows] for tag, column in MAPPING_COLUMNS.items()})
+    df = df.mask(rng.random(df.shape) < missing_rate)
+    timestamps = minute.index[0] + pd.to_timedelta(offsets, unit="s")
+    df[TIMESTAMP_COLUMN] = timestamps.astype(str) if string_timestamps else timestamps
+    return df
+
+
+def windows(n: int, rows: int = 256, seed: int = 0, **kwargs):
+    """`n` distinct gap-free windows of `rows` minutes with the five model columns, as sent for scoring."""
+    kwargs = dict(dict(gaps_per_day=0.0, missing_rate=0.0), **kwargs)
+    return [chiller_frame(f"window-{i}", rows / MINUTES_PER_DAY, seed=seed, **kwargs)[COLUMNS].reset_index(drop=True)
+            for i in range(n)]
+
+
+def write(frame: pd.DataFrame, directory: str, formats):
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    if "csv" in formats:
+        paths.append(os.path.join(directory, "data.csv"))
+        frame.to_csv(paths[-1])
+    if "parquet" in formats:
+        paths.append(os.path.join(directory, "data.parquet"))
+        frame.reset_index().to_parquet(paths[-1], index=False)
+    return paths
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--gateways", type=int, default=10)
+    parser.add_argument("--days", type=float, default=30)
+    parser.add_argument("--start", type=str, default=str(START.date()))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--format", type=str, default="parquet", help="Comma separated: csv, parquet.")
+    parser.add_argument("--output", type=str, default="build/synthetic")
+    parser.add_argument("--anomalies-per-day", type=float, default=0.2)
+    parser.add_argument("--gaps-per-day", type=float, default=0.05)
+    parser.add_argument("--missing-rate", type=float, default=0.01)
+    parser.add_argument("--jitter-seconds", type=float, default=0.0)
+    args = parser.parse_args()
+
+    formats = args.format.split(",")
+    started = time.perf_counter()
+    rows = anomalies = 0
+    for i in range(args.gateways):
+        gateway = f"gateway-{i}"
+        frame = chiller_frame(gateway, args.days, start=args.start, seed=args.seed,
+                              anomalies_per_day=args.anomalies_per_day, gaps_per_day=args.gaps_per_day,
+                              missing_rate=args.missing_rate, jitter_seconds=args.jitter_seconds)
+        write(frame, os.path.join(args.output, gateway), formats)
+        rows += len(frame)
+        anomalies += int(frame[LABEL_COLUMN].sum())
+    print(f"Wrote {args.gateways} gateways x {args.days:g} days ({rows} rows, {anomalies} anomalous) "
+          f"to {args.output} in {time.perf_counter() - started:.1f}s")
@@ -0,0 +1,132 @@
+"""
+Shared, connection-pooled invocation of the scoring Lambda.
+
+One `LambdaInvoker` holds one boto3 Lambda client whose connection pool is sized to
+the dispatch concurrency, so requests reuse open connections instead of building a
+client (and a TLS session) each. Gateway payloads can be sent one by one, fired as
+asynchronous ``Event`` invocations, or grouped into fan-out events (a ``gateways``
+list handled by `lambda_func.fan_out`) and dispatched concurrently with a cap.
+"""
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from botocore.config import Config
+
+logger = logging.getLogger(__name__)
+
+# fields shared by every gateway of a fan-out event; everything else is per gateway
+SHARED_FIELDS = ("token", "base_url")
+
+
+class LambdaInvoker(object):
+    def __init__(self, function_name: str, max_concurrency: int = 8, endpoint_url: str = None, client=None):
+        """
+        Args:
+            function_name (str): name or ARN of the Lambda function.
+            max_concurrency (int): invocations in flight at once, and size of the connection pool.
+            endpoint_url (str): Lambda API endpoint, e.g. a local stub for tests.
+            client: boto3 Lambda client to use instead of creating one.
+        """
+        self.function_name = function_name
+        self.max_concurrency = max_concurrency
+        self.client = client or boto3.client("lambda", endpoint_url=endpoint_url, config=Config(
+            max_pool_connections=max_concurrency,
+            tcp_keepalive=True,
+            retries={"max_attempts": 3, "mode": "standard"},
+        ))
+        self._pool = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="lambda-invoke")
+
+    def invoke(self, payload: dict):
+        """Invoke synchronously and return the decoded response payload."""
+        response = self.client.invoke(
+            FunctionName=self.function_name,
+            InvocationType="RequestResponse",
+            Payload=json.dumps(payload).encode(),
+        )
+        body = response["Payload"].read().decode("utf-8")
+        if response.get("FunctionError"):
+            raise RuntimeError(f"{self.function_name} failed: {body}")
+        return json.loads(body) if body else None
+
+    def invoke_async(self, payload: dict) -> str:
+        """Queue an ``Event`` invocation, which returns as soon as Lambda accepted it. Returns the request id."""
+        response = self.client.invoke(
+            FunctionName=self.function_name,
+            InvocationType="Event",
+            Payload=json.dumps(payload).encode(),
+        )
+        return response.get("ResponseMetadata", {}).get("RequestId")
+
+    @staticmethod
+    def batch(payloads, batch_size: int):
+        """Group gateway payloads into fan-out events of at most `batch_size` gateways."""
+        events = []
+        for start in range(0, len(payloads), batch_size):
+            groups = {}
+            # gateways of one event must share the token and engine
+            for payload in payloads[start:start + batch_size]:
+                key = tuple(payload.get(field) for field in SHARED_FIELDS)
+                gateways = groups.setdefault(key, [])
+                gateways.append({k: v for k, v in payload.items() if k not in SHARED_FIELDS and v is not None})
+            for key, gateways in groups.items():
+                shared = {field: value for field, value in zip(SHARED_FIELDS, key) if value is not None}
+                events.append(dict(shared, gateways=gateways))
+        return events
+
+    def invoke_many(self, payloads, batch_size: int = 1, asynchronous: bool = False):
+        """
+        Invoke the function for every gateway payload, `batch_size` gateways per invocation,
+        with at most `max_concurrency` invocations in flight.
+
+        Returns:
+            list: per invocation, the response payload (or the request id when `asynchronous`)
+            or the exception it failed with.
+        """
+        events = payloads if batch_size <= 1 else self.batch(list(payloads), batch_size)
+        call = self.invoke_async if asynchronous else self.invoke
+        futures = [self._pool.submit(call, event) for event in events]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                logger.warning(f"Invocation of {self.function_name} failed: {e}")
+                results.append(e)
+        return results
+
+    def close(self):
+        self._pool.shutdown(wait=True)
+
+
+_invokers = {}
+_invokers_lock = threading.Lock()
+
+
+def get_invoker(function_name: str = None) -> LambdaInvoker:
+    """
+    Process-wide invoker of `function_name` (LAMBDA_FUNCTION_NAME by default), configured by
+    LAMBDA_MAX_CONCURRENCY and LAMBDA_ENDPOINT_URL.
+    """
+    function_name = function_name or os.environ.get("LAMBDA_FUNCTION_NAME", "test_func_v2")
+    with _invokers_lock:
+        invoker = _invokers.get(function_name)
+        if invoker is None:
+            invoker = _invokers[function_name] = LambdaInvoker(
+                function_name,
+                max_concurrency=int(os.environ.get("LAMBDA_MAX_CONCURRENCY", "8")),
+                endpoint_url=os.environ.get("LAMBDA_ENDPOINT_URL"),
+            )
+        return invoker
+
+
+def close_invokers():
+    """Close every invoker created by `get_invoker`, e.g. on shutdown of the app."""
+    with _invokers_lock:
+        invokers = list(_invokers.values())
+        _invokers.clear()
+    for invoker in invokers:
+        invoker.close()
@@ -0,0 +1,26 @@
+"""
+Access control of the API's admin endpoints, which change what the server runs.
+
+With ADMIN_TOKEN set, they only answer requests carrying that token in an
+``X-Admin-Token`` header. Without it, they only answer requests from the machine
+itself. Behind a proxy on the same machine every request looks local, so set
+ADMIN_TOKEN there.
+"""
+import hmac
+import os
+from http import HTTPStatus
+
+from fastapi import HTTPException, Request
+
+LOCAL_HOSTS = ("127.0.0.1", "::1", "localhost")
+
+
+def require_admin(request: Request):
+    """Dependency of the admin endpoints, raising a 403 for any other caller."""
+    token = os.environ.get("ADMIN_TOKEN")
+    if token:
+        if hmac.compare_digest(request.headers.get("x-admin-token", "").encode(), token.encode()):
+            return
+    elif request.client is not None and request.client.host in LOCAL_HOSTS:
+        return
+    raise HTTPException(status_code=HTTPStatus.FORBIDDEN, detail="Admin endpoints need a valid X-Admin-Token")
@@ -3,15 +3,24 @@ import sys
 
 from uvicorn import config
 
-from src.maio_ml.deploy.sagemaker import utils, predict, serve
+from src.maio_ml.deploy.fastapi import tracing
+from src.maio_ml.deploy.fastapi.admin import require_admin
+from src.maio_ml.deploy.fastapi.executor import InferenceExecutor, Saturated
+from src.maio_ml.deploy.fastapi.jobs import JobQueue
+from src.maio_ml.deploy.fastapi.model_store import ModelStore, score
+from src.maio_ml.deploy.fastapi.stream import (ARROW_STREAM, arrow_batches, is_batch, media_type,
+                                               ndjson_lines, predictions, summarize)
+from src.maio_ml.deploy.sagemaker import metrics, utils, predict, serve
+from src.maio_ml.deploy.sagemaker.prediction_cache import content_key, default_cache
 
 sys.path.append(".")
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI, HTTPException, Request
 from fastapi import Path
-from fastapi.responses import RedirectResponse
+from fastapi.responses import PlainTextResponse, RedirectResponse, StreamingResponse
+from functools import partial
 from http import HTTPStatus
-import json
 from pydantic import BaseModel
+from starlette.background import BackgroundTask
 
 app = FastAPI(
     title="text-classification",
@@ -19,6 +28,70 @@ app = FastAPI(
     version="1.0.0",
 )
 
+# Time per route, phase and model version, served by /metrics
+app.add_middleware(tracing.TracingMiddleware, routes=app.router.routes)
+
+# The model serving 'latest', loaded and warmed up at startup from MODEL_PATH and swapped
+# without downtime when a new artifact lands there (MODEL_WATCH_INTERVAL_SECONDS) or on /admin/reload.
+models = ModelStore.from_env()
+
+
+def _load_worker_model():
+    # every spawned process worker loads the artifact the server serves itself
+    try:
+        models.load()
+    except Exception:
+        config.logger.exception(f"Inference worker could not load the model from {models.path}")
+
+
+# Inference runs off the event loop on a bounded pool, see INFERENCE_EXECUTOR, INFERENCE_WORKERS
+# and INFERENCE_MAX_QUEUE; requests beyond its capacity get a 503 with Retry-After.
+inference = InferenceExecutor.from_env(initializer=_load_worker_model)
+if inference.kind == "process":
+    # process workers keep the model they loaded when they started, so a swap replaces them
+    models.on_swap(lambda model, version: inference.restart())
+
+# Identical predictions are computed once, see PREDICTION_CACHE_MAX_ENTRIES and
+# PREDICTION_CACHE_TTL_SECONDS. Keys carry the served model version, so a swap starts afresh.
+prediction_cache = default_cache("api")
+
+
+def predict_cached(experiment_id, inputs):
+    model, version = models.current()
+    if experiment_id == 'latest' and model is not None:
+        # the request keeps this model even if a reload swaps in another meanwhile
+        tracing.set_model_version(version)
+        key, compute = content_key(version, inputs), lambda: score(model, inputs)
+    else:
+        tracing.set_model_version(experiment_id)
+        key, compute = content_key(experiment_id, inputs), lambda: predict.predict(
+            experiment_id=experiment_id, inputs=inputs)
+    if prediction_cache is None:
+        return compute()
+    return prediction_cache.get_or_compute(key, compute)
+
+
+# Trainings queued by /train, persisted in TRAIN_JOB_DB and run by TRAIN_JOB_WORKERS workers
+jobs = JobQueue.from_env()
+
+
+@app.on_event("startup")
+def _start_jobs():
+    jobs.start()
+
+
+@app.on_event("startup")
+def _load_model():
+    # requests are only accepted once the model is loaded and warmed up
+    models.start()
+
+
+@app.on_event("shutdown")
+def _shutdown():
+    models.stop()
+    jobs.stop()
+    inference.shutdown()
+
 
 @utils.construct_response
 @app.get("/")
@@ -28,7 +101,7 @@ async def _index():
         'status-code': HTTPStatus.OK,
         'data': {}
     }
-    config.logger.info(json.dumps(response, indent=2))
+    config.logger.info(summarize(response))
     return response
 
 
@@ -46,15 +119,39 @@ class PredictPayload(BaseModel):
 
 @utils.construct_response
 @app.post("/predict")
-async def _predict(payload: PredictPayload):
-    prediction = predict.predict(
-        experiment_id=payload.experiment_id, inputs=payload.inputs)
+async def _predict(payload: PredictPayload, request: Request, stream: str = None, chunk_rows: int = 10000):
+    """
+    Predict `inputs`, the records of one series or a list of series. With ``?stream=ndjson|arrow``
+    or a matching Accept header, the predictions are streamed series by series, `chunk_rows` at a time.
+    """
+    tracing.mark("parse")
+    try:
+        streamed = media_type(stream, request.headers.get("accept"))
+    except ValueError as e:
+        raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail=str(e))
+    batch = payload.inputs if streamed and is_batch(payload.inputs) else [payload.inputs]
+    # the version `predict_cached` will most likely use, in case it runs in a process worker
+    model, version = models.current()
+    tracing.set_model_version(version if payload.experiment_id == 'latest' and model is not None
+                              else payload.experiment_id)
+    try:
+        prediction = await inference.run(predict_cached, payload.experiment_id, batch[0])
+    except Saturated as e:
+        raise HTTPException(status_code=HTTPStatus.SERVICE_UNAVAILABLE, detail=str(e),
+                            headers={"Retry-After": str(e.retry_after)})
+    if streamed:
+        summary = {"experiment_id": payload.experiment_id, "media_type": streamed}
+        results = predictions(inference, partial(predict_cached, payload.experiment_id), batch, prediction,
+                              max(chunk_rows, 1), summary)
+        encode = arrow_batches if streamed == ARROW_STREAM else ndjson_lines
+        return StreamingResponse(encode(results), media_type=streamed,
+                                 background=BackgroundTask(lambda: config.logger.info(f"Streamed {summary}")))
     response = {
         'message': HTTPStatus.OK.phrase,
         'status-code': HTTPStatus.OK,
         'data': {"prediction": prediction}
     }
-    config.logger.info(json.dumps(response, indent=2))
+    config.logger.info(summarize(response))
     return response
 
 
@@ -66,17 +163,58 @@ class TrainingPayload(BaseModel):
 
 
 @utils.construct_response
-@app.post("/train")
+@app.post("/train", status_code=HTTPStatus.ACCEPTED)
 async def train(payload: TrainingPayload):
-    status = serve.train(payload.training_input_path,
-                         payload.test_input_path,
-                         payload.hyperparameters,
-                         payload.output_path)
+    # trainings run in their own processes, the request only queues one
+    job_id = jobs.submit("src.maio_ml.deploy.sagemaker.serve:train", {
+        "training_input_path": payload.training_input_path,
+        "test_input_path": payload.test_input_path,
+        "hyperparameters": payload.hyperparameters,
+        "output_path": payload.output_path,
+    })
 
     response = {
+        'message': HTTPStatus.ACCEPTED.phrase,
+        'status-code': HTTPStatus.ACCEPTED,
+        'data': {"job_id": job_id, "status": "queued", "url": f"/jobs/{job_id}"}
+    }
+    config.logger.info(summarize(response))
+    return response
+
+
+@app.get("/jobs/{job_id}")
+async def _job(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail=f"Unknown job {job_id}")
+    return {
         'message': HTTPStatus.OK.phrase,
         'status-code': HTTPStatus.OK,
-        'data': {"status": status}
+        'data': job
     }
-    config.logger.info(json.dumps(response, indent=2))
-    return response
+
+
+@app.post("/admin/reload", status_code=HTTPStatus.ACCEPTED, dependencies=[Depends(require_admin)])
+async def _reload_model():
+    """Load the configured model artifact (MODEL_PATH) in the background and swap it in."""
+    started = models.reload()
+    return {
+        'message': HTTPStatus.ACCEPTED.phrase if started else "Reload already running",
+        'status-code': HTTPStatus.ACCEPTED,
+        'data': models.status()
+    }
+
+
+@app.get("/admin/model")
+async def _model_status():
+    return {
+        'message': HTTPStatus.OK.phrase,
+        'status-code': HTTPStatus.OK,
+        'data': models.status()
+    }
+
+
+@app.get("/metrics")
+async def _metrics():
+    """Counters and histograms in the Prometheus text format, of every worker under prefork."""
+    return PlainTextResponse(metrics.scrape(), media_type="text/plain; version=0.0.4")
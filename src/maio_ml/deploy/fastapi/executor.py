@@ -0,0 +1,155 @@
+"""
+Bounded off-loop execution of blocking inference calls.
+
+`InferenceExecutor.run` hands a blocking call to a thread or process pool and awaits
+it, so the event loop keeps serving other requests (and health checks) meanwhile. At
+most ``max_workers + max_queue`` calls are admitted at once; beyond that `run` fails
+fast with `Saturated`, which carries a Retry-After estimate for the 503 response.
+
+Process pool workers are spawned rather than forked, as the server's torch thread pools
+are already running by then (see prefork.py). They import the calls' modules afresh and
+set up the state those calls need, e.g. load the served model, in `initializer`.
+`restart` replaces them after that state changed in the server.
+"""
+import asyncio
+import contextvars
+import math
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from ..sagemaker import metrics
+from . import tracing
+
+IN_FLIGHT = metrics.gauge(
+    "inference_executor_in_flight", "Calls admitted and not finished, queued or running", ["executor"])
+REJECTED = metrics.counter(
+    "inference_executor_rejected", "Calls refused because the executor was saturated", ["executor"])
+QUEUE_WAIT = metrics.histogram(
+    "inference_executor_queue_wait_seconds", "Time a call waited for a free worker", ["executor"])
+COMPUTE = metrics.histogram(
+    "inference_executor_compute_seconds", "Time a call ran on its worker", ["executor"])
+
+
+class Saturated(Exception):
+    def __init__(self, retry_after: int):
+        super().__init__(f"Inference executor saturated, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+def _timed_call(fn, args, kwargs, submitted, collect=False):
+    # wall clock, as it is compared across processes for the process pool
+    started = time.time()
+    if not collect:
+        result = fn(*args, **kwargs)
+        return result, started - submitted, time.time() - started, None
+    # in a process worker, outside the request's trace
+    with tracing.collecting() as trace:
+        result = fn(*args, **kwargs)
+    return result, started - submitted, time.time() - started, trace
+
+
+class InferenceExecutor(object):
+    def __init__(self, max_workers: int = None, max_queue: int = None, kind: str = "thread",
+                 name: str = "inference", initializer=None, initargs=()):
+        """
+        Args:
+            max_workers (int): calls running at once, the CPU count by default.
+            max_queue (int): admitted calls waiting for a worker, ``2 * max_workers`` by default.
+            kind (str): "thread", or "process" for CPU-bound calls holding the GIL. Calls run in
+                a process must be picklable module-level functions.
+            name (str): label used for the exported metrics.
+            initializer (callable): module-level function run by every process worker when it starts,
+                with `initargs`.
+            initargs (tuple): arguments of `initializer`.
+        """
+        if kind not in ("thread", "process"):
+            raise ValueError(f"Unknown executor kind {kind}")
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_queue = max_queue if max_queue is not None else 2 * self.max_workers
+        self.kind = kind
+        self.name = name
+        self.initializer = initializer
+        self.initargs = initargs
+        self._pool = self._new_pool()
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+    def _new_pool(self):
+        if self.kind == "thread":
+            return ThreadPoolExecutor(max_workers=self.max_workers)
+        return ProcessPoolExecutor(max_workers=self.max_workers, mp_context=multiprocessing.get_context("spawn"),
+                                   initializer=self.initializer, initargs=self.initargs)
+
+    def restart(self):
+        """
+        Send new calls to fresh process workers, which run `initializer` again. Calls already
+        submitted finish on the previous workers. A thread pool is kept as is.
+        """
+        if self.kind == "thread":
+            return
+        with self._lock:
+            previous, self._pool = self._pool, self._new_pool()
+        previous.shutdown(wait=False)
+
+    @classmethod
+    def from_env(cls, name: str = "inference", initializer=None, initargs=()):
+        """Configured by INFERENCE_EXECUTOR (thread|process), INFERENCE_WORKERS and INFERENCE_MAX_QUEUE."""
+        max_queue = os.environ.get("INFERENCE_MAX_QUEUE")
+        return cls(max_workers=int(os.environ.get("INFERENCE_WORKERS", "0")) or None,
+                   max_queue=int(max_queue) if max_queue is not None else None,
+                   kind=os.environ.get("INFERENCE_EXECUTOR", "thread"), name=name,
+                   initializer=initializer, initargs=initargs)
+
+    def retry_after(self) -> int:
+        """Seconds until the current backlog is expected to drain, from the mean compute time."""
+        count, total = COMPUTE.summary(executor=self.name)
+        mean = total / count if count else 1.0
+        return max(1, math.ceil(mean * self._in_flight / self.max_workers))
+
+    async def run(self, fn, *args, **kwargs):
+        """Run ``fn(*args, **kwargs)`` on the pool, or raise `Saturated` when no slot is free."""
+        with self._lock:
+            if self._in_flight >= self.max_workers + self.max_queue:
+                REJECTED.inc(executor=self.name)
+                raise Saturated(self.retry_after())
+            self._in_flight += 1
+            IN_FLIGHT.set(self._in_flight, executor=self.name)
+        try:
+            loop = asyncio.get_running_loop()
+            trace = tracing.current()
+            inference = trace["phases"].get("inference") if trace is not None else None
+            call = (_timed_call, fn, args, kwargs, time.time())
+            if self.kind == "thread":
+                # phases recorded by `fn` go to the trace of the request that submitted it
+                call = (contextvars.copy_context().run,) + call
+            else:
+                # `fn` records them in a trace of its own, merged into the request's below
+                call += (trace is not None,)
+            with self._lock:
+                # submitted right away, so a concurrent `restart` cannot shut the pool down in between
+                pending = loop.run_in_executor(self._pool, *call)
+            result, queue_wait, compute, collected = await pending
+            QUEUE_WAIT.observe(max(queue_wait, 0.0), executor=self.name)
+            COMPUTE.observe(compute, executor=self.name)
+            tracing.record("queue", max(queue_wait, 0.0))
+            if collected is not None:
+                for name, seconds in collected["phases"].items():
+                    tracing.record(name, seconds)
+                if collected["model_version"]:
+                    tracing.set_model_version(collected["model_version"])
+            if trace is not None and trace["phases"].get("inference") == inference:
+                # `fn` did not break its time down
+                tracing.record("inference", compute)
+            return result
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+                IN_FLIGHT.set(self._in_flight, executor=self.name)
+
+    def shutdown(self):
+        with self._lock:
+            pool = self._pool
+        pool.shutdown(wait=True)
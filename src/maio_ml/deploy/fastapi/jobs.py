@@ -0,0 +1,246 @@
+"""
+Persistent background job queue for long running work such as training.
+
+Jobs are rows of a SQLite database, so they survive restarts of the API and can be
+submitted from several API processes. A pool of dispatcher threads claims queued jobs
+and runs each one in its own spawned process, with its own log file, an optional
+address-space limit and a timeout, so a crashing or leaking training cannot take the
+API down with it.
+
+    queue = JobQueue("build/jobs.sqlite3", workers=2)
+    queue.start()
+    job_id = queue.submit("maio_ml.deploy.sagemaker.serve:train", {"hyperparameters": {...}})
+    queue.get(job_id)["status"]  # queued -> running -> succeeded | failed
+
+Of several API processes sharing a database, only one may dispatch: the others are created
+with ``dispatch=False`` (TRAIN_JOB_DISPATCH=0) and only submit and read jobs, as `recover`
+would otherwise requeue jobs another process has just claimed.
+"""
+import importlib
+import json
+import logging
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    target TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    pid INTEGER,
+    artifact TEXT,
+    error TEXT,
+    log_path TEXT
+)
+"""
+
+
+def _run_job(target, payload, workdir, max_memory_mb):
+    """Entry point of a job process: isolate it, call `target` and record the outcome."""
+    log = os.open(os.path.join(workdir, "job.log"), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+    os.dup2(log, 1)
+    os.dup2(log, 2)
+    if max_memory_mb:
+        import resource
+        limit = max_memory_mb * 1024 ** 2
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+    outcome = {}
+    try:
+        module, function = target.split(":")
+        result = getattr(importlib.import_module(module), function)(**payload)
+        outcome["artifact"] = result if isinstance(result, str) else payload.get("output_path")
+    except BaseException as e:
+        traceback.print_exc()
+        outcome["error"] = f"{type(e).__name__}: {e}"
+    with open(os.path.join(workdir, "result.json"), "w") as f:
+        json.dump(outcome, f)
+    os._exit(1 if "error" in outcome else 0)
+
+
+def _alive(pid) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class JobQueue(object):
+    def __init__(self, db_path: str, workers: int = 1, timeout: float = None, max_memory_mb: int = None,
+                 poll_interval: float = 1.0, dispatch: bool = True):
+        """
+        Args:
+            db_path (str): SQLite database of the jobs; job logs go to a `jobs` directory next to it.
+            workers (int): jobs running at once.
+            timeout (float): seconds after which a running job is killed, unlimited when None.
+            max_memory_mb (int): address-space limit of every job process.
+            poll_interval (float): how often idle workers look for jobs submitted by other processes.
+            dispatch (bool): whether `start` runs jobs in this process, or leaves them to another one.
+        """
+        self.db_path = db_path
+        self.workers = workers
+        self.timeout = timeout
+        self.max_memory_mb = max_memory_mb
+        self.poll_interval = poll_interval
+        self.dispatch = dispatch
+        self.job_dir = os.path.join(os.path.dirname(os.path.abspath(db_path)), "jobs")
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._threads = []
+        os.makedirs(self.job_dir, exist_ok=True)
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(SCHEMA)
+
+    @classmethod
+    def from_env(cls):
+        """
+        Configured by TRAIN_JOB_DB, TRAIN_JOB_WORKERS, TRAIN_JOB_TIMEOUT_SECONDS, TRAIN_JOB_MAX_MEMORY_MB
+        and TRAIN_JOB_DISPATCH.
+        """
+        timeout = os.environ.get("TRAIN_JOB_TIMEOUT_SECONDS")
+        max_memory_mb = os.environ.get("TRAIN_JOB_MAX_MEMORY_MB")
+        return cls(os.environ.get("TRAIN_JOB_DB", "build/jobs.sqlite3"),
+                   workers=int(os.environ.get("TRAIN_JOB_WORKERS", "1")),
+                   timeout=float(timeout) if timeout else None,
+                   max_memory_mb=int(max_memory_mb) if max_memory_mb else None,
+                   dispatch=os.environ.get("TRAIN_JOB_DISPATCH", "1") != "0")
+
+    @contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        try:
+            yield db
+        finally:
+            db.close()
+
+    def submit(self, target: str, payload: dict) -> str:
+        """Queue a call of ``target`` ("module:function") with `payload` as keyword arguments."""
+        job_id = uuid.uuid4().hex
+        with self._connect() as db:
+            db.execute("INSERT INTO jobs (id, target, payload, status, created_at) VALUES (?, ?, ?, 'queued', ?)",
+                       (job_id, target, json.dumps(payload), time.time()))
+        self._wakeup.set()
+        return job_id
+
+    def get(self, job_id: str):
+        """Status, timing and artifact of a job, or None when it does not exist."""
+        with self._connect() as db:
+            row = db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        if job["started_at"]:
+            job["queued_seconds"] = round(job["started_at"] - job["created_at"], 3)
+            job["run_seconds"] = round((job["finished_at"] or time.time()) - job["started_at"], 3)
+        return job
+
+    def _claim(self):
+        with self._connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            row = db.execute("SELECT * FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1").fetchone()
+            if row is not None:
+                db.execute("UPDATE jobs SET status = 'running', started_at = ?, attempts = attempts + 1, "
+                           "log_path = ? WHERE id = ?",
+                           (time.time(), os.path.join(self.job_dir, row["id"], "job.log"), row["id"]))
+            db.execute("COMMIT")
+        return row
+
+    def _finish(self, job_id, status, artifact=None, error=None):
+        with self._connect() as db:
+            db.execute("UPDATE jobs SET status = ?, finished_at = ?, artifact = ?, error = ? WHERE id = ?",
+                       (status, time.time(), artifact, error, job_id))
+
+    def _execute(self, job):
+        workdir = os.path.join(self.job_dir, job["id"])
+        os.makedirs(workdir, exist_ok=True)
+        process = multiprocessing.get_context("spawn").Process(
+            target=_run_job, args=(job["target"], json.loads(job["payload"]), workdir, self.max_memory_mb),
+            name=f"job-{job['id'][:8]}")
+        process.start()
+        with self._connect() as db:
+            db.execute("UPDATE jobs SET pid = ? WHERE id = ?", (process.pid, job["id"]))
+        process.join(self.timeout)
+        if process.is_alive():
+            process.kill()
+            process.join()
+            return self._finish(job["id"], "failed", error=f"Timed out after {self.timeout}s")
+
+        self._record_outcome(job["id"], process.exitcode)
+
+    def _record_outcome(self, job_id, exitcode=None):
+        try:
+            with open(os.path.join(self.job_dir, job_id, "result.json")) as f:
+                outcome = json.load(f)
+        except (OSError, ValueError):
+            outcome = {"error": f"Job process exited with code {exitcode}"}
+        if "error" in outcome:
+            self._finish(job_id, "failed", error=outcome["error"])
+        else:
+            self._finish(job_id, "succeeded", artifact=outcome.get("artifact"))
+
+    def _work(self):
+        while not self._stopping.is_set():
+            job = self._claim()
+            if job is None:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+            logger.info(f"Running job {job['id']} ({job['target']})")
+            try:
+                self._execute(job)
+            except Exception as e:
+                logger.exception(f"Job {job['id']} could not be run")
+                self._finish(job["id"], "failed", error=str(e))
+
+    def recover(self):
+        """
+        Settle the jobs left running by a stopped API process: record the outcome of those
+        whose process finished and requeue those whose process died without one.
+        """
+        with self._connect() as db:
+            running = db.execute("SELECT id, pid FROM jobs WHERE status = 'running'").fetchall()
+        for job_id, pid in running:
+            if pid is not None and _alive(pid):
+                continue
+            if os.path.exists(os.path.join(self.job_dir, job_id, "result.json")):
+                self._record_outcome(job_id)
+            else:
+                logger.info(f"Requeueing interrupted job {job_id}")
+                with self._connect() as db:
+                    db.execute("UPDATE jobs SET status = 'queued', pid = NULL WHERE id = ?", (job_id,))
+
+    def start(self):
+        """Recover the jobs interrupted by the last shutdown and start the workers, if this process dispatches."""
+        if not self.dispatch:
+            logger.info(f"Jobs of {self.db_path} are run by another process")
+            return
+        self.recover()
+        self._stopping.clear()
+        self._threads = [threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+                         for i in range(self.workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        """Stop claiming jobs; running jobs finish in their own processes."""
+        self._stopping.set()
+        self._wakeup.set()
@@ -0,0 +1,222 @@
+"""
+The model served by the API, loaded at startup and hot swapped on retraining.
+
+`ModelStore.load` loads an artifact, warms it up with a dummy forward pass and only
+then swaps it in, so no request ever sees a cold or half loaded model. Requests take
+the current ``(model, version)`` once and keep using it, so a swap never affects the
+requests already in flight; the previous model is freed when the last of them ends.
+
+New artifacts at the configured path are picked up by `reload`, which loads in the
+background (e.g. from the ``/admin/reload`` endpoint), or by a watcher thread polling the artifact every
+`watch_interval` seconds. A new artifact is only loaded once it stopped changing for a
+full interval, so a training still writing it is not picked up half way. A failed load
+keeps the current model serving. Callbacks registered with `on_swap` run after every
+swap, e.g. to restart process workers that hold a copy of the previous model.
+"""
+import logging
+import os
+import threading
+import time
+
+from ..sagemaker import metrics
+from ..sagemaker.model_manager import load_artifact
+from ..sagemaker.preprocess import MAPPING_COLUMNS
+from . import tracing
+
+logger = logging.getLogger(__name__)
+
+LOAD_SECONDS = metrics.histogram(
+    "model_store_load_seconds", "Time spent loading the served model artifact")
+WARMUP_SECONDS = metrics.histogram(
+    "model_store_warmup_seconds", "Time spent on the warm-up forward pass of a loaded model")
+RELOADS = metrics.counter(
+    "model_store_reloads", "Loads of the served model by result", ["result"])
+
+
+def fingerprint(path):
+    """``(mtime_ns, size)`` of an artifact file, or of the newest file and total size of an artifact directory."""
+    if os.path.isfile(path):
+        stat = os.stat(path)
+        return stat.st_mtime_ns, stat.st_size
+    mtime, size = 0, 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            stat = os.stat(os.path.join(root, name))
+            mtime, size = max(mtime, stat.st_mtime_ns), size + stat.st_size
+    return (mtime, size) if mtime else None
+
+
+def warm_up(model, length: int = 256):
+    """Score `length` minutes of zeros, so lazy initialization and allocations happen before the first request."""
+    import numpy as np
+    import pandas as pd
+    from merlion.utils.time_series import TimeSeries
+
+    index = pd.date_range("2023-01-01", periods=length, freq="1min")
+    frame = pd.DataFrame(np.zeros((length, len(MAPPING_COLUMNS)), dtype=np.float32),
+                         index=index, columns=list(MAPPING_COLUMNS.values()))
+    model.get_anomaly_label(TimeSeries.from_pd(frame))
+
+
+def score(model, records) -> list:
+    """Anomaly labels of `records`, rows of a resampled frame with an optional ``timestamp`` column."""
+    import pandas as pd
+    from merlion.utils.time_series import TimeSeries
+
+    with tracing.phase("preprocess"):
+        frame = pd.DataFrame(records)
+        if "timestamp" in frame:
+            frame = frame.set_index(pd.to_datetime(frame.pop("timestamp")))
+        series = TimeSeries.from_pd(frame)
+    with tracing.phase("inference"):
+        labels = model.get_anomaly_label(series)
+    return labels.to_pd().iloc[:, 0].tolist()
+
+
+class ModelStore(object):
+    def __init__(self, path: str, loader=load_artifact, warmup=warm_up, watch_interval: float = 0):
+        """
+        Args:
+            path (str): artifact to serve, e.g. the ``model.pth`` written by training.
+            loader (callable): turns an artifact path into a model.
+            warmup (callable): called with a loaded model before it is swapped in, None to skip.
+            watch_interval (float): seconds between checks of `path` for a new artifact, 0 disables the watcher.
+        """
+        self.path = path
+        self.loader = loader
+        self.warmup = warmup
+        self.watch_interval = watch_interval
+        self._current = (None, None)
+        self._lock = threading.Lock()
+        self._reloading = None
+        self._stopping = threading.Event()
+        self._watcher = None
+        self._fingerprint = None
+        self._failed = None
+        self._swap_callbacks = []
+        self.loaded_at = None
+        self.load_seconds = None
+        self.warmup_seconds = None
+        self.last_error = None
+
+    @classmethod
+    def from_env(cls):
+        """Configured by MODEL_PATH and MODEL_WATCH_INTERVAL_SECONDS."""
+        return cls(os.environ.get("MODEL_PATH", "build/model.pth"),
+                   watch_interval=float(os.environ.get("MODEL_WATCH_INTERVAL_SECONDS", "30")))
+
+    def on_swap(self, callback):
+        """Call ``callback(model, version)`` after every model swapped in from now on."""
+        self._swap_callbacks.append(callback)
+
+    def current(self):
+        """The ``(model, version)`` serving new requests, ``(None, None)`` before the first load."""
+        return self._current
+
+    def load(self, warm: bool = True):
+        """
+        Load, warm up and swap in the artifact at the configured path. Without `warm`, the
+        warm-up is left to `start`, e.g. in workers forked after the load.
+
+        Returns:
+            str: the version of the model now serving, the fingerprint of its artifact.
+        """
+        path = self.path
+        version = None
+        try:
+            version = fingerprint(path)
+            if version is None:
+                raise FileNotFoundError(f"No model artifact at {path}")
+            started = time.perf_counter()
+            model = self.loader(path)
+            load_seconds = time.perf_counter() - started
+            started = time.perf_counter()
+            if warm and self.warmup is not None:
+                self.warmup(model)
+            warmup_seconds = time.perf_counter() - started if warm else None
+        except Exception as e:
+            RELOADS.inc(result="failed")
+            self.last_error = f"{type(e).__name__}: {e}"
+            self._failed = version
+            raise
+
+        LOAD_SECONDS.observe(load_seconds)
+        if warmup_seconds is not None:
+            WARMUP_SECONDS.observe(warmup_seconds)
+        RELOADS.inc(result="loaded")
+        with self._lock:
+            self._fingerprint = version
+            version = f"{os.path.basename(path)}@{version[0]}"
+            self._current = (model, version)
+            self.loaded_at = time.time()
+            self.load_seconds = round(load_seconds, 3)
+            self.warmup_seconds = round(warmup_seconds, 3) if warmup_seconds is not None else None
+            self.last_error = None
+        logger.info(f"Serving model {version} from {path}, loaded in {load_seconds:.3f}s"
+                    + (f", warmed up in {warmup_seconds:.3f}s" if warmup_seconds is not None else ""))
+        for callback in self._swap_callbacks:
+            try:
+                callback(model, version)
+            except Exception:
+                logger.exception(f"Callback {callback} failed after swapping in {version}")
+        return version
+
+    def reload(self) -> bool:
+        """Load the configured artifact in a background thread. Returns False when a reload is already running."""
+        with self._lock:
+            if self._reloading is not None and self._reloading.is_alive():
+                return False
+            self._reloading = threading.Thread(target=self._reload, name="model-reload", daemon=True)
+            self._reloading.start()
+        return True
+
+    def _reload(self):
+        try:
+            self.load()
+        except Exception:
+            logger.exception(f"Reloading the model failed, still serving {self._current[1]}")
+
+    def _watch(self):
+        seen = None
+        while not self._stopping.wait(self.watch_interval):
+            try:
+                latest = fingerprint(self.path) if os.path.exists(self.path) else None
+            except OSError:
+                # files replaced while walking the artifact, look again next time
+                continue
+            # an artifact that failed to load is only retried once it changes again
+            if latest is not None and latest == seen and latest not in (self._fingerprint, self._failed):
+                logger.info(f"New model artifact at {self.path}")
+                self.reload()
+            seen = latest
+
+    def start(self):
+        """
+        Load the configured model, unless one was loaded before (e.g. by a prefork parent, in which
+        case it is only warmed up), and start the watcher. A missing artifact is loaded once it appears.
+        """
+        model, _ = self._current
+        if model is None:
+            try:
+                self.load()
+            except Exception:
+                logger.exception(f"No model served until {self.path} can be loaded")
+        elif self.warmup is not None and self.warmup_seconds is None:
+            started = time.perf_counter()
+            self.warmup(model)
+            self.warmup_seconds = round(time.perf_counter() - started, 3)
+            WARMUP_SECONDS.observe(self.warmup_seconds)
+        if self.watch_interval > 0:
+            self._stopping.clear()
+            self._watcher = threading.Thread(target=self._watch, name="model-watcher", daemon=True)
+            self._watcher.start()
+
+    def stop(self):
+        self._stopping.set()
+
+    def status(self) -> dict:
+        with self._lock:
+            return {"path": self.path, "version": self._current[1], "loaded_at": self.loaded_at,
+                    "load_seconds": self.load_seconds, "warmup_seconds": self.warmup_seconds,
+                    "reloading": self._reloading is not None and self._reloading.is_alive(),
+                    "last_error": self.last_error}
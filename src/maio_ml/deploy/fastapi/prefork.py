@@ -0,0 +1,230 @@
+"""
+Prefork serving of the FastAPI app with the model shared copy-on-write.
+
+``uvicorn --workers N`` starts N interpreters that each import torch, Merlion and pandas
+and load their own copy of the model, so memory caps the worker count. Here the parent
+imports the app and loads the model once, then forks the workers, which inherit both:
+
+* the model's tensors are moved to shared memory (`share_memory`), so they stay one
+  copy however much the workers touch the Python objects around them;
+* everything allocated so far is frozen out of the garbage collector (``gc.freeze``),
+  so collections in the workers do not write to, and thereby copy, the parent's pages.
+
+The workers accept on one listening socket bound by the parent, which restarts any
+worker that dies. The warm-up pass runs in every worker after the fork, as the thread
+pools of torch must not be started before it. A model swapped in by a hot reload is
+private to the worker that loaded it.
+
+Every worker keeps its own metrics, and a scrape of ``/metrics`` lands on any one of
+them. So the workers share theirs through a directory of the parent (see
+`metrics.share`), and each renders those of all, labelled by ``worker`` slot.
+
+Every worker runs the app's startup hooks, but background jobs (the app's ``jobs``
+queue) must be dispatched by a single process: only the first worker, and the one
+restarted in its place, runs them; the others only queue and report them.
+
+Usage (from src/):
+    python -m maio_ml.deploy.fastapi.prefork --app main:app --workers 4 --port 8000
+    python -m maio_ml.deploy.fastapi.prefork --workers 4 --no-preload   # like uvicorn --workers
+"""
+import argparse
+import gc
+import importlib
+import logging
+import os
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import time
+
+logging.basicConfig(stream=sys.stdout, level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def share_memory(model, max_depth: int = 3):
+    """
+    Move the tensors reachable from `model` (torch modules and tensors among its attributes,
+    `max_depth` levels down) to shared memory.
+
+    Returns:
+        int: bytes of tensor storage now shared.
+    """
+    import torch
+
+    shared, seen = 0, set()
+
+    def visit(obj, depth):
+        nonlocal shared
+        if id(obj) in seen or depth > max_depth:
+            return
+        seen.add(id(obj))
+        if isinstance(obj, torch.nn.Module):
+            for tensor in list(obj.parameters()) + list(obj.buffers()):
+                visit(tensor, depth)
+        elif isinstance(obj, torch.Tensor):
+            obj.share_memory_()
+            shared += obj.element_size() * obj.nelement()
+        elif isinstance(obj, (list, tuple)):
+            for item in obj:
+                visit(item, depth + 1)
+        elif isinstance(obj, dict):
+            for item in obj.values():
+                visit(item, depth + 1)
+        elif hasattr(obj, "__dict__"):
+            for item in vars(obj).values():
+                visit(item, depth + 1)
+
+    visit(model, 0)
+    return shared
+
+
+def preload(store) -> bool:
+    """
+    Load the model of `store` (a `ModelStore`) before the fork and share its tensors. A model that
+    cannot be loaded is logged, as by `ModelStore.start`, and left to the workers to load.
+
+    Returns:
+        bool: whether a model was preloaded.
+    """
+    started = time.perf_counter()
+    try:
+        store.load(warm=False)
+    except Exception:
+        logger.exception(f"Preloading {store.path} failed, the workers load the model once it can be loaded")
+        return False
+    model, version = store.current()
+    shared = share_memory(model)
+    logger.info(f"Preloaded model {version} in {time.perf_counter() - started:.2f}s, "
+                f"{shared / 1024 ** 2:.1f} MiB of tensors in shared memory")
+    return True
+
+
+def bind(host: str, port: int, backlog: int = 2048) -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def serve_worker(app, sock, jobs=None, slot: int = 0, metrics=None, metrics_dir: str = None):
+    """
+    Entry point of a forked worker: serve `app` on the inherited socket until told to stop.
+    Worker `slot` 0 dispatches the `jobs` queue. The app's `metrics` module shares the
+    worker's metrics in `metrics_dir`.
+    """
+    import uvicorn
+
+    if jobs is not None:
+        jobs.dispatch = slot == 0
+    if metrics is not None and metrics_dir is not None:
+        metrics.share(metrics_dir, slot)
+
+    # the parent's handlers only supervise, the worker's server installs its own
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    gc.enable()
+    server = uvicorn.Server(uvicorn.Config(app, lifespan="on", log_level="info"))
+    server.run(sockets=[sock])
+    os._exit(0)
+
+
+class Supervisor(object):
+    def __init__(self, app, sock, workers: int, jobs=None, metrics=None, metrics_dir: str = None):
+        """
+        Args:
+            app: the ASGI app, loaded (and its model preloaded) before the workers fork.
+            sock (socket.socket): listening socket shared by the workers.
+            workers (int): worker processes kept running.
+            jobs (JobQueue): job queue of the app, dispatched by a single worker.
+            metrics (module): metrics module of the app, whose ``scrape`` renders all the workers'.
+            metrics_dir (str): directory the workers share their metrics in.
+        """
+        self.app = app
+        self.sock = sock
+        self.workers = workers
+        self.jobs = jobs
+        self.metrics = metrics
+        self.metrics_dir = metrics_dir
+        # slot of every worker, a restarted worker takes over the slot of the one it replaces
+        self.children = {}
+        self.stopping = False
+
+    def spawn(self, slot: int):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                serve_worker(self.app, self.sock, self.jobs, slot, self.metrics, self.metrics_dir)
+            finally:
+                os._exit(1)
+        self.children[pid] = slot
+        logger.info(f"Started worker {pid}" + (" (dispatching jobs)" if self.jobs is not None and slot == 0 else ""))
+
+    def stop(self, signum, frame):
+        self.stopping = True
+        for pid in self.children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for slot in range(self.workers):
+            self.spawn(slot)
+        while self.children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            except InterruptedError:
+                continue
+            slot = self.children.pop(pid, None)
+            if slot is None:
+                continue
+            if not self.stopping:
+                logger.warning(f"Worker {pid} exited with status {status}, restarting it")
+                # a worker crashing on start must not turn into a fork loop
+                time.sleep(1)
+                self.spawn(slot)
+        self.sock.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--app", type=str, default="main:app", help="module:attribute of the FastAPI app.")
+    parser.add_argument("--host", type=str, default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--no-preload", action="store_true",
+                        help="Load the model in every worker instead, for comparison.")
+    args = parser.parse_args(argv)
+
+    if not args.no_preload:
+        # objects created until the fork are frozen below, there is no point collecting them now
+        gc.disable()
+    module_name, attribute = args.app.split(":")
+    module = importlib.import_module(module_name)
+    app = getattr(module, attribute)
+
+    store = getattr(module, "models", None)
+    if not args.no_preload and store is not None:
+        preload(store)
+    if not args.no_preload:
+        gc.freeze()
+        logger.info(f"Froze {gc.get_freeze_count()} objects before forking {args.workers} workers")
+
+    metrics_dir = tempfile.mkdtemp(prefix="prefork-metrics-")
+    try:
+        Supervisor(app, bind(args.host, args.port), args.workers, jobs=getattr(module, "jobs", None),
+                   metrics=getattr(module, "metrics", None), metrics_dir=metrics_dir).run()
+    finally:
+        shutil.rmtree(metrics_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
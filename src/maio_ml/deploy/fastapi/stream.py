@@ -0,0 +1,123 @@
+"""
+Streamed prediction responses and compact response logging.
+
+Long windows and batches of series make large prediction results. Instead of
+building the whole response and serializing it at once, `/predict` can emit results
+chunk by chunk as they are produced:
+
+* NDJSON (``application/x-ndjson``): one JSON object per chunk,
+  ``{"series": 0, "offset": 0, "prediction": [...]}``;
+* Arrow IPC stream (``application/vnd.apache.arrow.stream``): one record batch per
+  chunk, one row per value, with the columns ``series``, ``offset`` (the position of
+  the value in its series) and ``prediction``.
+
+`summarize` replaces pretty-printing responses into the log with their shape.
+"""
+import asyncio
+import io
+import json
+
+from .executor import Saturated
+
+NDJSON = "application/x-ndjson"
+ARROW_STREAM = "application/vnd.apache.arrow.stream"
+FORMATS = {"ndjson": NDJSON, "arrow": ARROW_STREAM}
+
+
+def media_type(stream: str = None, accept: str = None):
+    """Media type of the streamed response asked for by ``?stream=`` or the Accept header, None for plain JSON."""
+    if stream:
+        if stream not in FORMATS:
+            raise ValueError(f"Unknown stream format {stream}, expected one of {', '.join(FORMATS)}")
+        return FORMATS[stream]
+    for accepted in (accept or "").split(","):
+        if accepted.split(";")[0].strip() in (NDJSON, ARROW_STREAM):
+            return accepted.split(";")[0].strip()
+    return None
+
+
+def summarize(value, depth: int = 0):
+    """Short description of a response: scalars as they are, containers by their size, two levels deep."""
+    if isinstance(value, dict):
+        if depth >= 2:
+            return f"<dict of {len(value)}>"
+        return {key: summarize(item, depth + 1) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return f"<list of {len(value)}>"
+    if isinstance(value, str) and len(value) > 80:
+        return f"<str of {len(value)}>"
+    return value
+
+
+def is_batch(inputs) -> bool:
+    """Whether `inputs` is a list of series (lists of records) rather than the records of one series."""
+    return bool(inputs) and all(isinstance(series, list) for series in inputs)
+
+
+def chunks(series_index: int, prediction, chunk_rows: int):
+    """``(series, offset, values)`` chunks of at most `chunk_rows` values of one prediction."""
+    values = prediction if isinstance(prediction, list) else [prediction]
+    for offset in range(0, max(len(values), 1), chunk_rows):
+        yield series_index, offset, values[offset:offset + chunk_rows]
+
+
+async def predictions(inference, score, batch, first, chunk_rows: int, summary: dict):
+    """
+    Score the series of `batch` one after the other on `inference` and yield the chunks
+    of their predictions as soon as each is available.
+
+    Args:
+        inference (InferenceExecutor): executor running ``score(series)``.
+        score (callable): returns the prediction of one series.
+        batch (list): the series to score.
+        first: prediction of ``batch[0]``, scored before the response started so that a
+            saturated executor could still be answered with a 503.
+        chunk_rows (int): values per chunk.
+        summary (dict): counts of the streamed series, chunks and values, for logging.
+    """
+    prediction = first
+    for index, series in enumerate(batch):
+        while index:
+            try:
+                prediction = await inference.run(score, series)
+                break
+            except Saturated as e:
+                # the response is under way, wait for a free slot instead of failing it
+                await asyncio.sleep(e.retry_after)
+        for chunk in chunks(index, prediction, chunk_rows):
+            summary["chunks"] = summary.get("chunks", 0) + 1
+            summary["values"] = summary.get("values", 0) + len(chunk[2])
+            yield chunk
+        summary["series"] = summary.get("series", 0) + 1
+
+
+async def ndjson_lines(results):
+    """Encode the ``(series, offset, values)`` chunks of an async iterator as NDJSON lines."""
+    async for series_index, offset, values in results:
+        yield json.dumps({"series": series_index, "offset": offset, "prediction": values}).encode() + b"\n"
+
+
+async def arrow_batches(results):
+    """Encode the ``(series, offset, values)`` chunks of an async iterator as an Arrow IPC stream."""
+    import pyarrow as pa
+
+    schema = pa.schema([("series", pa.int32()), ("offset", pa.int64()), ("prediction", pa.float64())])
+    sink = io.BytesIO()
+    writer = pa.ipc.new_stream(sink, schema)
+
+    def drain():
+        data = sink.getvalue()
+        sink.seek(0)
+        sink.truncate()
+        return data
+
+    async for series_index, offset, values in results:
+        n = len(values)
+        writer.write_batch(pa.record_batch([
+            pa.array([series_index] * n, pa.int32()),
+            pa.array(range(offset, offset + n), pa.int64()),
+            pa.array(values, pa.float64()),
+        ], schema=schema))
+        yield drain()
+    writer.close()
+    yield drain()
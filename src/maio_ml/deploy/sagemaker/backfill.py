@@ -0,0 +1,251 @@
+"""
+Parallel, resumable backfill of anomaly scores over a time range.
+
+Every gateway is scored over windows of `--window-minutes` ending every `--step-minutes`
+in ``[--start, --end]``. Windows are fetched through the Maio ingestor (with its retries
+and its tag cache, so overlapping windows only download new buckets), resampled and
+scored by the SageMaker endpoint on a bounded thread pool.
+
+Results are buffered and written as Parquet part files to `--output`. Only once a part
+is on disk are its windows appended to the checkpoint (``<output>/checkpoint.jsonl``),
+so a rerun after a crash skips every window already written and scores the rest. A
+crash between the two writes can leave a window in two parts; readers keep the last.
+Windows are identified by gateway, start and end, and the checkpoint starts with the
+endpoint and threshold that scored them: a rerun with another endpoint or threshold is
+refused rather than resumed, use a new `--output` for it.
+
+Usage (from src/):
+    python maio_ml/deploy/sagemaker/backfill.py --gateways Aruba,Bonaire \\
+        --start 2023-05-08T00:00 --end 2023-05-11T00:00 --output build/backfill --workers 8
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from gateway_cache import GatewayMetadataCache
+from ingest import MaioIngestor
+
+logging.basicConfig(stream=sys.stdout, level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+OUTPUT_SCHEMA = pa.schema([
+    ("gateway", pa.string()),
+    ("window_start", pa.timestamp("ns")),
+    ("window_end", pa.timestamp("ns")),
+    ("rows", pa.int32()),
+    ("anomaly_count", pa.int32()),
+    ("max_score", pa.float32()),
+    ("scores", pa.list_(pa.float32())),
+])
+
+
+def windows(gateways, start, end, step, window):
+    """``(gateway, window_start, window_end)`` for every gateway and every step in ``[start, end]``."""
+    ends = pd.date_range(start, end, freq=step)
+    return [(gateway, t2 - window, t2) for gateway in gateways for t2 in ends]
+
+
+def _naive_utc(value) -> pd.Timestamp:
+    value = pd.Timestamp(value)
+    return value.tz_convert("UTC").tz_localize(None) if value.tzinfo is not None else value
+
+
+def window_key(gateway, window_start, window_end):
+    return f"{gateway}|{_naive_utc(window_start).isoformat()}|{_naive_utc(window_end).isoformat()}"
+
+
+def parse_scores(data):
+    """Scores from the split-oriented JSON returned by the endpoint."""
+    split = json.loads(data)
+    if isinstance(split, str):
+        split = json.loads(split)
+    column = split["columns"].index("anom_score")
+    return np.array([np.nan if row[column] is None else row[column] for row in split["data"]], dtype=np.float32)
+
+
+class Backfill(object):
+    def __init__(self, ingestor, runtime_client, endpoint, output_dir, workers=8, flush_windows=200,
+                 threshold=4.5):
+        """
+        Args:
+            ingestor (MaioIngestor): source of the raw gateway entries.
+            runtime_client: SageMaker runtime client used to score the windows.
+            endpoint (str): SageMaker endpoint name.
+            output_dir (str): directory of the Parquet parts and the checkpoint.
+            workers (int): windows scored concurrently.
+            flush_windows (int): scored windows buffered before a part is written.
+            threshold (float): score above which a point counts as an anomaly.
+        """
+        self.ingestor = ingestor
+        self.runtime_client = runtime_client
+        self.endpoint = endpoint
+        self.output_dir = output_dir
+        self.workers = workers
+        self.flush_windows = flush_windows
+        self.threshold = threshold
+        self.checkpoint_path = os.path.join(output_dir, "checkpoint.jsonl")
+        os.makedirs(output_dir, exist_ok=True)
+
+    def settings(self):
+        """What the scores depend on besides the window, recorded as the first line of the checkpoint."""
+        return {"endpoint": self.endpoint, "threshold": self.threshold}
+
+    def completed(self):
+        """
+        Keys of the windows whose results are already written.
+
+        Raises:
+            ValueError: the checkpoint was written with other `settings`.
+        """
+        done = set()
+        if os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path) as f:
+                settings = json.loads(f.readline())
+                if settings != self.settings():
+                    raise ValueError(f"{self.output_dir} was scored with {settings}, not {self.settings()}; "
+                                     f"backfill into another output directory")
+                for line in f:
+                    # a line cut short by a crash is simply scored again
+                    if line.endswith("\n"):
+                        done.add(line.rstrip("\n"))
+        return done
+
+    def score_window(self, gateway, window_start, window_end):
+        df = self.ingestor.fetch(gateway, window_start.to_pydatetime(), window_end.to_pydatetime())
+        response = self.runtime_client.invoke_endpoint(
+            EndpointName=self.endpoint,
+            ContentType="application/json",
+            Accept="application/json",
+            Body=df.to_json(orient="split", index=False),
+        )
+        scores = parse_scores(response["Body"].read().decode("utf-8"))
+        return {
+            "gateway": gateway,
+            "window_start": _naive_utc(window_start),
+            "window_end": _naive_utc(window_end),
+            "rows": len(df),
+            "anomaly_count": int(np.sum(scores >= self.threshold)),
+            "max_score": float(np.nanmax(scores)) if len(scores) and not np.all(np.isnan(scores)) else None,
+            "scores": scores.tolist(),
+        }
+
+    def _flush(self, buffer):
+        if not buffer:
+            return
+        table = pa.Table.from_pylist(buffer, schema=OUTPUT_SCHEMA)
+        name = f"part-{time.time_ns()}.parquet"
+        tmp = os.path.join(self.output_dir, f".{name}.tmp")
+        pq.write_table(table, tmp)
+        os.replace(tmp, os.path.join(self.output_dir, name))
+        with open(self.checkpoint_path, "a") as f:
+            f.writelines(window_key(r["gateway"], r["window_start"], r["window_end"]) + "\n" for r in buffer)
+            f.flush()
+            os.fsync(f.fileno())
+        buffer.clear()
+
+    def run(self, todo, report_every=10.0):
+        """Score the `todo` windows that are not in the checkpoint yet and return a summary."""
+        done = self.completed()
+        if not os.path.exists(self.checkpoint_path):
+            tmp = f"{self.checkpoint_path}.tmp"
+            with open(tmp, "w") as f:
+                f.write(json.dumps(self.settings()) + "\n")
+            os.replace(tmp, self.checkpoint_path)
+        todo = [w for w in todo if window_key(*w) not in done]
+        logger.info(f"{len(done)} windows already scored, {len(todo)} to go")
+
+        started = last_report = time.perf_counter()
+        scored = failed = 0
+        buffer, failures = [], []
+        queue = list(reversed(todo))
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="backfill") as pool:
+            while queue or running:
+                while queue and len(running) < 2 * self.workers:
+                    item = queue.pop()
+                    running[pool.submit(self.score_window, *item)] = item
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    item = running.pop(future)
+                    try:
+                        buffer.append(future.result())
+                        scored += 1
+                    except Exception as e:
+                        failed += 1
+                        failures.append(window_key(*item))
+                        logger.warning(f"Window {window_key(*item)} failed: {e}")
+                if len(buffer) >= self.flush_windows:
+                    self._flush(buffer)
+
+                now = time.perf_counter()
+                if now - last_report >= report_every:
+                    last_report = now
+                    rate = scored / (now - started)
+                    remaining = len(queue) + len(running)
+                    logger.info(f"{scored}/{len(todo)} windows, {failed} failed, {rate:.1f} windows/s, "
+                                f"eta {remaining / rate if rate else float('inf'):.0f}s")
+        self._flush(buffer)
+
+        elapsed = time.perf_counter() - started
+        summary = {"scored": scored, "failed": failed, "skipped": len(done), "seconds": round(elapsed, 2),
+                   "windows_per_second": round(scored / elapsed, 2) if elapsed else None,
+                   "failures": failures}
+        logger.info(f"Scored {scored} windows in {elapsed:.1f}s ({summary['windows_per_second']} windows/s), "
+                    f"{failed} failed; rerun to retry them")
+        return summary
+
+
+def read_results(output_dir) -> pd.DataFrame:
+    """All written windows, keeping the last result of a window scored twice."""
+    parts = sorted(name for name in os.listdir(output_dir) if name.startswith("part-"))
+    if not parts:
+        return OUTPUT_SCHEMA.empty_table().to_pandas()
+    # parts are named by write time, so the last duplicate is the newest
+    df = pa.concat_tables([pq.read_table(os.path.join(output_dir, part)) for part in parts]).to_pandas()
+    df = df.drop_duplicates(["gateway", "window_start", "window_end"], keep="last")
+    return df.sort_values(["gateway", "window_end", "window_start"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("--gateways", type=str, required=True, help="Comma separated gateway names.")
+    parser.add_argument("--start", type=str, required=True, help="End of the first window (UTC).")
+    parser.add_argument("--end", type=str, required=True, help="End of the last window (UTC).")
+    parser.add_argument("--step-minutes", type=int, default=60)
+    parser.add_argument("--window-minutes", type=int, default=256)
+    parser.add_argument("--output", type=str, default="build/backfill")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--flush-windows", type=int, default=200)
+    parser.add_argument("--endpoint", type=str, help="SageMaker endpoint, the configured model by default.")
+    parser.add_argument("--base-url", type=str, default="https://engine.heineken.maio.io")
+    parser.add_argument("--token", type=str, default=os.environ.get("MAIO_TOKEN"))
+    parser.add_argument("--tag-cache", type=str, default="build/tag-cache")
+
+    args = parser.parse_args()
+
+    from deploy_env import DeployEnv
+
+    env = DeployEnv()
+    todo = windows(args.gateways.split(","), pd.Timestamp(args.start, tz="UTC"), pd.Timestamp(args.end, tz="UTC"),
+                   timedelta(minutes=args.step_minutes), timedelta(minutes=args.window_minutes))
+
+    with MaioIngestor(args.base_url, args.token, max_concurrency=args.workers, cache_dir=args.tag_cache,
+                      metadata=GatewayMetadataCache(path="build/gateway-cache.json")) as ingestor:
+        backfill = Backfill(ingestor, env.runtime_client(), args.endpoint or env.setting("model_name"), args.output,
+                            workers=args.workers, flush_windows=args.flush_windows)
+        summary = backfill.run(todo)
+
+    print(json.dumps({k: v for k, v in summary.items() if k != "failures"}, indent=2))
+    sys.exit(1 if summary["failed"] else 0)
@@ -0,0 +1,166 @@
+"""
+Out-of-core batch scoring of a long sensor history.
+
+The history (CSV or Parquet) is read in chunks of `--chunk-rows` rows. Each chunk is
+scored together with the ``sequence_length - 1`` rows before and after it, so every
+emitted point sees exactly the windows it would see when scoring the whole history at
+once. Chunks are scored in a process pool with a bounded number of chunks in flight
+and the scores are streamed, in order, to a Parquet file. A history shorter than one
+window of the model cannot be scored: it is skipped with a warning, an empty output
+and the reason in the returned figures.
+
+Usage:
+    python batch_transform.py --input history.parquet --model build/model.pth \\
+        --output scores.parquet --workers 1,2,4
+"""
+import argparse
+import itertools
+import json
+import logging
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import scoring
+from model_manager import load_artifact
+
+logging.basicConfig(stream=sys.stdout, level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+COLUMNS = ["cooler_temp", "bath_temp", "cooler_switch", "refridgent_temp", "compressor_current"]
+OUTPUT_SCHEMA = pa.schema([("timestamp", pa.timestamp("ns")), ("anom_score", pa.float32())])
+
+_model = None
+
+
+def _init_worker(model_path):
+    global _model
+    _model = load_artifact(model_path)
+
+
+def _score_chunk(timestamps, values, emit_start, emit_stop):
+    """Score one chunk with its context rows and return the scores of the emitted rows only."""
+    from merlion.utils.time_series import TimeSeries
+
+    frame = pd.DataFrame(values, index=pd.DatetimeIndex(timestamps), columns=COLUMNS[:values.shape[1]])
+    normalized = scoring.normalize(_model, TimeSeries.from_pd(frame)).values
+    windows = scoring.sliding_windows(normalized, scoring.sequence_length(_model))
+    scores = scoring.lattice_mean(scoring.window_scores(_model, windows), len(frame))[emit_start:emit_stop]
+    calibrated = scoring.calibrate(_model, scoring.to_score_series(scores, frame.index[emit_start:emit_stop]))
+    return timestamps[emit_start:emit_stop], calibrated.to_pd().values[:, 0].astype(np.float32)
+
+
+def read_chunks(path, chunk_rows, timestamp_column, columns):
+    """Yield ``(timestamps, values)`` numpy chunks of the history without loading all of it."""
+    if path.endswith(".parquet"):
+        reader = pq.ParquetFile(path).iter_batches(batch_size=chunk_rows, columns=[timestamp_column] + columns)
+        frames = (batch.to_pandas() for batch in reader)
+    else:
+        frames = pd.read_csv(path, chunksize=chunk_rows, usecols=[timestamp_column] + columns)
+    for frame in frames:
+        timestamps = pd.to_datetime(frame[timestamp_column]).values.astype("datetime64[ns]")
+        yield timestamps, frame[columns].to_numpy(dtype=np.float32)
+
+
+def with_context(chunks, context):
+    """
+    Attach `context` rows of the previous and next chunk to every chunk.
+    Yields ``(timestamps, values, emit_start, emit_stop)``.
+    """
+    previous = None
+    current = next(chunks, None)
+    while current is not None:
+        following = next(chunks, None)
+        parts = [current]
+        emit_start = 0
+        if previous is not None:
+            parts.insert(0, (previous[0][-context:], previous[1][-context:]))
+            emit_start = len(parts[0][0])
+        if following is not None:
+            parts.append((following[0][:context], following[1][:context]))
+        timestamps = np.concatenate([p[0] for p in parts])
+        values = np.concatenate([p[1] for p in parts])
+        yield timestamps, values, emit_start, emit_start + len(current[0])
+        previous, current = current, following
+
+
+def run(input_path, model_path, output_path, workers, chunk_rows, timestamp_column="timestamp", columns=COLUMNS):
+    context = load_artifact(model_path).sequence_length - 1
+    if chunk_rows <= context:
+        raise ValueError(f"chunk_rows must be larger than the sequence context ({context})")
+
+    started = time.perf_counter()
+    chunks = read_chunks(input_path, chunk_rows, timestamp_column, columns)
+    head, history_rows = [], 0
+    for chunk in chunks:
+        head.append(chunk)
+        history_rows += len(chunk[0])
+        if history_rows > context:
+            break
+    if history_rows <= context:
+        reason = f"{history_rows} rows, fewer than the {context + 1} of one window of the model"
+        logger.warning(f"Skipped {input_path}: {reason}")
+        pq.write_table(OUTPUT_SCHEMA.empty_table(), output_path)
+        return {"workers": workers, "rows": 0, "seconds": round(time.perf_counter() - started, 3),
+                "rows_per_second": None, "skipped": reason}
+    chunks = itertools.chain(head, chunks)
+
+    rows = 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(model_path,)) as pool, \
+            pq.ParquetWriter(output_path, OUTPUT_SCHEMA) as writer:
+        in_flight = deque()
+
+        def drain_one():
+            timestamps, scores = in_flight.popleft().result()
+            writer.write_table(pa.table({"timestamp": timestamps, "anom_score": scores}, schema=OUTPUT_SCHEMA))
+            return len(scores)
+
+        for chunk in with_context(chunks, context):
+            if len(in_flight) >= 2 * workers:
+                rows += drain_one()
+            in_flight.append(pool.submit(_score_chunk, *chunk))
+        while in_flight:
+            rows += drain_one()
+
+    elapsed = time.perf_counter() - started
+    result = {"workers": workers, "rows": rows, "seconds": round(elapsed, 3),
+              "rows_per_second": round(rows / elapsed, 1) if elapsed else None}
+    logger.info(f"Scored {rows} rows with {workers} worker(s) in {elapsed:.2f}s ({result['rows_per_second']} rows/s)")
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("--input", type=str, required=True, help="CSV or Parquet history.")
+    parser.add_argument("--model", type=str, required=True, help="Path to the saved model.pth artifact.")
+    parser.add_argument("--output", type=str, required=True, help="Parquet file for the scores.")
+    parser.add_argument("--workers", type=str, default=str(os.cpu_count()),
+                        help="Worker count, or a comma separated list to compare throughput.")
+    parser.add_argument("--chunk-rows", type=int, default=50000)
+    parser.add_argument("--timestamp-column", type=str, default="timestamp")
+    parser.add_argument("--report", type=str, help="Write the throughput figures to this JSON file.")
+
+    args = parser.parse_args()
+
+    report = [
+        run(args.input, args.model, args.output, int(workers), args.chunk_rows, args.timestamp_column)
+        for workers in args.workers.split(",")
+    ]
+
+    print(f"{'workers':>8} {'rows':>12} {'seconds':>10} {'rows/s':>12}")
+    for r in report:
+        print(f"{r['workers']:>8} {r['rows']:>12} {r['seconds']:>10} {r['rows_per_second']:>12}"
+              + (f"  skipped: {r['skipped']}" if "skipped" in r else ""))
+
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
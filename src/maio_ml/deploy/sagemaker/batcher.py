@@ -0,0 +1,113 @@
+"""
+Dynamic micro-batching of concurrent inference requests.
+
+Requests submitted from several threads are collected until either `max_batch_size`
+requests are waiting or `max_wait_ms` has passed since the first one arrived. The
+whole batch is then handed to `score_batch` in one call and each caller gets its own
+slice of the result back.
+"""
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+QUEUE_DEPTH = metrics.gauge(
+    "inference_batcher_queue_depth", "Requests waiting to be batched", ["batcher"])
+BATCH_SIZE = metrics.histogram(
+    "inference_batcher_batch_size", "Requests per forward pass", ["batcher"],
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+BATCH_WAIT = metrics.histogram(
+    "inference_batcher_wait_seconds", "Time a request spent waiting for its batch", ["batcher"])
+BATCH_LATENCY = metrics.histogram(
+    "inference_batcher_batch_seconds", "Time spent scoring one batch", ["batcher"])
+
+
+class InferenceBatcher(object):
+    def __init__(self, score_batch, max_batch_size: int = 32, max_wait_ms: float = 5.0, name: str = "default"):
+        """
+        Args:
+            score_batch (callable): takes a list of inputs and returns a list of results of
+                the same length. A result that is an `Exception` is raised to that caller only.
+            max_batch_size (int): upper bound on requests per batch.
+            max_wait_ms (float): how long the first request of a batch waits for company.
+            name (str): label used for the exported metrics.
+        """
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+        self.score_batch = score_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.name = name
+        self._queue = queue.Queue()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name=f"batcher-{name}", daemon=True)
+        self._thread.start()
+
+    def submit(self, item, timeout: float = None):
+        """Queue `item` and block until its batch has been scored."""
+        return self.submit_async(item).result(timeout)
+
+    def submit_async(self, item) -> Future:
+        if self._closed:
+            raise RuntimeError(f"Batcher {self.name} is closed")
+        future = Future()
+        self._queue.put((item, future, time.perf_counter()))
+        QUEUE_DEPTH.set(self._queue.qsize(), batcher=self.name)
+        return future
+
+    def close(self):
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+
+    def _collect(self, first):
+        batch = [first]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                entry = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if entry is None:
+                self._queue.put(None)
+                break
+            batch.append(entry)
+        return batch
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch = self._collect(first)
+            QUEUE_DEPTH.set(self._queue.qsize(), batcher=self.name)
+            self._dispatch(batch)
+
+    def _dispatch(self, batch):
+        started = time.perf_counter()
+        for _, _, enqueued in batch:
+            BATCH_WAIT.observe(started - enqueued, batcher=self.name)
+        BATCH_SIZE.observe(len(batch), batcher=self.name)
+
+        try:
+            results = self.score_batch([item for item, _, _ in batch])
+        except Exception as e:
+            logger.exception(f"Batch of {len(batch)} failed")
+            results = [e] * len(batch)
+
+        BATCH_LATENCY.observe(time.perf_counter() - started, batcher=self.name)
+        logger.debug(f"Scored batch of {len(batch)} in {time.perf_counter() - started:.4f}s")
+
+        for (_, future, _), result in zip(batch, results):
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
@@ -0,0 +1,213 @@
+"""
+Append-only Parquet store of resampled one-minute gateway data.
+
+Frames are partitioned by gateway and UTC day in the hive layout, so both training
+and scoring read the same preprocessed data and a reader only opens the partitions
+it asks for:
+
+    <root>/gateway=<name>/date=<YYYY-MM-DD>/part-<seq>-<uuid>.parquet
+
+Every append writes new part files and never touches existing ones. Rows carry the
+``_seq`` of the write that produced them; when windows overlap, the last written row
+of a (gateway, timestamp) wins on read. Appends leave small files behind, so once a
+partition holds `compact_after` parts it is rewritten into one in the background.
+"""
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+logger = logging.getLogger(__name__)
+
+TIMESTAMP_COLUMN = "timestamp"
+SEQ_COLUMN = "_seq"
+PARTITIONING = ds.partitioning(pa.schema([("gateway", pa.string()), ("date", pa.string())]), flavor="hive")
+
+
+def _day(value) -> str:
+    return pd.Timestamp(value).strftime("%Y-%m-%d")
+
+
+def _naive_utc(value) -> pd.Timestamp:
+    ts = pd.Timestamp(value)
+    return ts.tz_convert("UTC").tz_localize(None) if ts.tzinfo is not None else ts
+
+
+def _concat_promoting(tables):
+    """Concatenate tables whose columns differ, with nulls for the columns a table lacks.
+
+    Equivalent to ``concat_tables(promote=True)``, which pyarrow 14 renamed, on every pyarrow version.
+    """
+    schema = pa.unify_schemas([table.schema for table in tables])
+    aligned = []
+    for table in tables:
+        for field in schema:
+            if field.name not in table.column_names:
+                table = table.append_column(field, pa.nulls(len(table), field.type))
+        aligned.append(table.select(schema.names).cast(schema))
+    return pa.concat_tables(aligned)
+
+
+class SensorDataLake(object):
+    def __init__(self, root: str, compact_after: int = 16):
+        """
+        Args:
+            root (str): directory of the store.
+            compact_after (int): part files in a partition that trigger a background compaction,
+                0 to only compact on `compact()`.
+        """
+        self.root = root
+        self.compact_after = compact_after
+        self._compactor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="compact")
+        self._pending = set()
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def _partition_dir(self, gateway, day):
+        return os.path.join(self.root, f"gateway={quote(str(gateway), safe='')}", f"date={day}")
+
+    @staticmethod
+    def _parts(path):
+        try:
+            return sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith(".parquet"))
+        except FileNotFoundError:
+            return []
+
+    @staticmethod
+    def _write_part(path, table, seq):
+        os.makedirs(path, exist_ok=True)
+        target = os.path.join(path, f"part-{seq:020d}-{uuid.uuid4().hex[:8]}.parquet")
+        tmp = os.path.join(path, f".{os.path.basename(target)}.tmp")
+        pq.write_table(table, tmp)
+        os.replace(tmp, target)
+        return target
+
+    def append(self, gateway, frame: pd.DataFrame):
+        """
+        Append the resampled `frame` of `gateway`: a naive UTC ``timestamp`` column and one
+        float column per tag.
+        """
+        if frame.empty:
+            return
+        seq = time.time_ns()
+        timestamps = pd.to_datetime(frame[TIMESTAMP_COLUMN]).to_numpy(dtype="datetime64[ns]")
+        order = np.argsort(timestamps, kind="stable")
+        timestamps = timestamps[order]
+        days = timestamps.astype("datetime64[D]")
+        bounds = np.flatnonzero(days[1:] != days[:-1]) + 1
+
+        # fixed types so that every part of the store shares one schema
+        columns = {TIMESTAMP_COLUMN: pa.array(timestamps, pa.timestamp("ns"))}
+        for column in frame.columns.drop(TIMESTAMP_COLUMN):
+            columns[column] = pa.array(frame[column].to_numpy(dtype=np.float32)[order])
+        columns[SEQ_COLUMN] = pa.array(np.full(len(frame), seq, dtype=np.int64))
+        table = pa.table(columns)
+
+        for lo, hi in zip(np.r_[0, bounds], np.r_[bounds, len(frame)]):
+            day = str(days[lo])
+            path = self._partition_dir(gateway, day)
+            self._write_part(path, table.slice(lo, hi - lo), seq)
+            if self.compact_after and len(self._parts(path)) >= self.compact_after:
+                self._schedule_compaction(path)
+
+    def dataset(self):
+        return ds.dataset(self.root, format="parquet", partitioning=PARTITIONING)
+
+    def read(self, gateways=None, start=None, end=None, columns=None) -> pd.DataFrame:
+        """
+        Read the rows of `gateways` (all when None) with ``start <= timestamp <= end``.
+
+        Only the partitions of the requested gateways and days are opened, and only the
+        requested tag `columns` (all when None) are decoded.
+
+        Returns:
+            pd.DataFrame: ``gateway``, ``timestamp`` and the tag columns, sorted by gateway and time.
+        """
+        condition = None
+
+        def both(expression):
+            return expression if condition is None else condition & expression
+
+        if gateways is not None:
+            condition = both(ds.field("gateway").isin([str(g) for g in gateways]))
+        if start is not None:
+            start = _naive_utc(start)
+            condition = both((ds.field("date") >= _day(start)) & (ds.field(TIMESTAMP_COLUMN) >= start.to_datetime64()))
+        if end is not None:
+            end = _naive_utc(end)
+            condition = both((ds.field("date") <= _day(end)) & (ds.field(TIMESTAMP_COLUMN) <= end.to_datetime64()))
+
+        dataset = self.dataset()
+        if not dataset.files:
+            # nothing appended yet, so the dataset has no schema to filter on
+            return pd.DataFrame(columns=["gateway", TIMESTAMP_COLUMN] + list(columns or []))
+        if columns is None:
+            columns = [c for c in dataset.schema.names if c not in ("gateway", "date", TIMESTAMP_COLUMN, SEQ_COLUMN)]
+        table = dataset.to_table(columns=["gateway", TIMESTAMP_COLUMN, SEQ_COLUMN] + list(columns), filter=condition)
+
+        df = table.to_pandas()
+        df = df.sort_values(["gateway", TIMESTAMP_COLUMN, SEQ_COLUMN], kind="stable")
+        df = df.drop_duplicates(["gateway", TIMESTAMP_COLUMN], keep="last")
+        return df.drop(columns=[SEQ_COLUMN]).reset_index(drop=True)
+
+    def read_gateway(self, gateway, start=None, end=None, columns=None) -> pd.DataFrame:
+        """Rows of a single gateway indexed by timestamp, as used for training."""
+        df = self.read([gateway], start, end, columns)
+        return df.drop(columns=["gateway"]).set_index(TIMESTAMP_COLUMN)
+
+    def _schedule_compaction(self, path):
+        with self._lock:
+            if path in self._pending:
+                return
+            self._pending.add(path)
+        self._compactor.submit(self._compact_background, path)
+
+    def _compact_background(self, path):
+        try:
+            self.compact_partition(path)
+        except Exception:
+            logger.exception(f"Compaction of {path} failed")
+        finally:
+            with self._lock:
+                self._pending.discard(path)
+
+    def compact_partition(self, path):
+        """Rewrite the parts of one partition into a single deduplicated part."""
+        parts = self._parts(path)
+        if len(parts) < 2:
+            return
+        table = _concat_promoting([pq.read_table(part) for part in parts])
+        df = table.to_pandas()
+        df = df.sort_values([TIMESTAMP_COLUMN, SEQ_COLUMN], kind="stable")
+        df = df.drop_duplicates([TIMESTAMP_COLUMN], keep="last")
+        # named after the newest part it replaces, so it still sorts after every older part
+        seq = int(os.path.basename(parts[-1]).split("-")[1])
+        self._write_part(path, pa.Table.from_pandas(df, schema=table.schema, preserve_index=False), seq)
+        for part in parts:
+            os.remove(part)
+        logger.info(f"Compacted {len(parts)} parts of {path} into 1")
+
+    def compact(self):
+        """Compact every partition with more than one part, in the calling thread."""
+        for gateway in sorted(os.listdir(self.root)):
+            for day in sorted(os.listdir(os.path.join(self.root, gateway))):
+                self.compact_partition(os.path.join(self.root, gateway, day))
+
+    def close(self):
+        """Wait for the background compactions."""
+        self._compactor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -22,7 +22,7 @@ def s3_bucket_from_url(s3_url):
 
 
 def upload_model_data(env: DeployEnv):
-    if env.isLocal():
+    if env.isLocal() or env.isInProcess():
         return
     bucket_name = s3_bucket_from_url(env.setting("model_data_path"))
     logger.info("Uploading model.tar.gz to S3 bucket=%s..." % (bucket_name))
@@ -86,6 +86,17 @@ def deploy(env: DeployEnv, source_dir: str):
     # Upload the model to S3 if not local
     upload_model_data(env)
 
+    if env.isInProcess():
+        # served by script.py's handlers in this process, see local_runtime.py
+        if env.isDeployed():
+            delete_endpoint_and_config(env)
+        env.client().create_endpoint_config(EndpointConfigName=env.setting("model_name"),
+                                            ModelDataUrl=env.setting("model_data_path"))
+        env.client().create_endpoint(EndpointName=env.setting("model_name"),
+                                     EndpointConfigName=env.setting("model_name"))
+        logger.info("\t...DONE.")
+        return
+
     pytorch_model = PyTorchModel(
         entry_point="script_with_maio.py",
         source_dir=source_dir,  # "chequers-rookley/code/src/",
@@ -193,6 +204,12 @@ def create_layer(env: DeployEnv):
 def update_lambda_function(env: DeployEnv, source_dir, zip_file_name):
     with zipfile.ZipFile(zip_file_name, 'w') as zipf:
         zipf.write(f"{source_dir}/lambda_func.py", arcname=os.path.basename("lambda_func.py"))
+        zipf.write(f"{source_dir}/preprocess.py", arcname=os.path.basename("preprocess.py"))
+        zipf.write(f"{source_dir}/tag_cache.py", arcname=os.path.basename("tag_cache.py"))
+        zipf.write(f"{source_dir}/ingest.py", arcname=os.path.basename("ingest.py"))
+        zipf.write(f"{source_dir}/gateway_cache.py", arcname=os.path.basename("gateway_cache.py"))
+        zipf.write(f"{source_dir}/prediction_cache.py", arcname=os.path.basename("prediction_cache.py"))
+        zipf.write(f"{source_dir}/metrics.py", arcname=os.path.basename("metrics.py"))
 
     with open(zip_file_name, 'rb') as f:
         zipped_code = f.read()
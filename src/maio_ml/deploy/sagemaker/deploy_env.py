@@ -6,7 +6,12 @@ import botocore
 
 
 class DeployEnv(object):
-    def __init__(self):
+    def __init__(self, handlers=None):
+        """
+        Args:
+            handlers: handlers served by the ``inprocess`` endpoints, script.py by default (see local_runtime.py).
+        """
+        self.handlers = handlers
         self._client = None
         self._runtime_client = None
         self._lambda_client = None
@@ -39,7 +44,13 @@ class DeployEnv(object):
         if self._runtime_client:
             return self._runtime_client
 
-        if self.isLocal():
+        if self.isInProcess():
+            self._runtime_client = self._local_runtime().InProcessSagemakerRuntimeClient(
+                self.client(),
+                latency=self.setting("simulated_latency_ms") / 1000,
+                jitter=self.setting("simulated_jitter_ms") / 1000,
+            )
+        elif self.isLocal():
             self._runtime_client = sagemaker.local.LocalSagemakerRuntimeClient()
         else:
             self._runtime_client = boto3.client("sagemaker-runtime")
@@ -58,7 +69,15 @@ class DeployEnv(object):
         if self._client:
             return self._client
 
-        if self.isLocal():
+        if self.isInProcess():
+            # the configured endpoint is deployed from the start, as the model data is already in place
+            local_runtime = self._local_runtime()
+            self._client = local_runtime.InProcessSagemakerClient(
+                {self.setting("model_name"): local_runtime.model_dir_from_url(self.setting("model_data_path"))},
+                workers=self.setting("workers"),
+                handlers=self.handlers,
+            )
+        elif self.isLocal():
             self._client = sagemaker.local.LocalSagemakerClient()
         else:
             self._client = boto3.client("sagemaker")
@@ -68,9 +87,20 @@ class DeployEnv(object):
     def isLocal(self):
         return self.current_env() == "local"
 
+    def isInProcess(self):
+        """Endpoints served by the script.py handlers in this process, see local_runtime.py."""
+        return self.current_env() == "inprocess"
+
     def isProduction(self):
         return self.current_env() == "production"
 
+    def _local_runtime(self):
+        try:
+            import local_runtime
+        except ImportError:
+            from . import local_runtime
+        return local_runtime
+
     def _set_config_filename(self):
         config_dirname = os.path.dirname(__file__)
         config_filename = os.path.join(config_dirname, "config.yml")
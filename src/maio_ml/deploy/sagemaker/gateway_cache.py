@@ -0,0 +1,131 @@
+"""
+Process-wide TTL cache of Maio gateway metadata.
+
+Gateway ids and tag catalogs practically never change, yet every scoring request used
+to resolve them with an extra round trip. `GatewayMetadataCache` keeps them in memory
+for `ttl` seconds and, with a `path`, in a small JSON file so that cold Lambda
+containers and separate backfill runs start warm. Entries are keyed by engine URL so
+one cache can serve several Maio engines.
+
+    cache = default_cache()
+    gateway_id = cache.gateway_id(base_url, "Aruba", client.get_gateway_id_from_name)
+
+The process-wide instance is configured by ``GATEWAY_CACHE_PATH`` and
+``GATEWAY_CACHE_TTL_SECONDS``.
+"""
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL_SECONDS = 6 * 60 * 60
+
+
+class GatewayMetadataCache(object):
+    def __init__(self, ttl: float = DEFAULT_TTL_SECONDS, path: str = None, clock=time.time):
+        """
+        Args:
+            ttl (float): seconds an entry is served before it is resolved again.
+            path (str): JSON file persisting the entries across processes. In memory only when None.
+            clock (callable): returns the current time in seconds, for tests.
+        """
+        self.ttl = ttl
+        self.path = path
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+        if path:
+            self._entries = self._load()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(self._entries, f)
+        os.replace(tmp, self.path)
+
+    def get(self, key: str, resolve):
+        """Return the value cached under `key`, calling ``resolve()`` when it is missing or expired."""
+        now = self.clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry["expires"] > now:
+                self.hits += 1
+                return entry["value"]
+            self.misses += 1
+
+        value = resolve()
+        if value is None:
+            # unknown gateways are not cached so that they resolve as soon as they exist
+            return None
+        with self._lock:
+            self._entries[key] = {"value": value, "expires": now + self.ttl}
+            if self.path:
+                self._save()
+        return value
+
+    def gateway_id(self, base_url, gateway_name, resolve):
+        """Id of `gateway_name`; ``resolve(gateway_name)`` is e.g. `Client.get_gateway_id_from_name`."""
+        return self.get(f"gateway_id|{base_url}|{gateway_name}", lambda: resolve(gateway_name))
+
+    def tag_catalog(self, base_url, gateway_id, resolve):
+        """``{label: tag id}`` of `gateway_id`; ``resolve(gateway_id)`` returns the gateway's tags."""
+        return self.get(f"tags|{base_url}|{gateway_id}",
+                        lambda: {tag["label"]: tag["id"] for tag in resolve(gateway_id)})
+
+    def invalidate(self, base_url=None, key=None):
+        """
+        Drop cached entries: all of them, those of one engine, or those whose gateway
+        name or id equals `key` (on one engine when `base_url` is given).
+        """
+        with self._lock:
+            for cached in list(self._entries):
+                _, url, name = cached.split("|", 2)
+                if (base_url is None or url == base_url) and (key is None or name == str(key)):
+                    del self._entries[cached]
+            if self.path:
+                self._save()
+
+    def invalidate_gateway(self, base_url, gateway_name, gateway_id=None):
+        """
+        Drop the cached id of `gateway_name` and the tag catalog of that id, e.g. after the
+        gateway was renamed or its tags changed. `gateway_id` names the catalog to drop when
+        the name is no longer cached.
+        """
+        with self._lock:
+            entry = self._entries.pop(f"gateway_id|{base_url}|{gateway_name}", None)
+            ids = {str(gateway_id)} if gateway_id is not None else set()
+            if entry is not None:
+                ids.add(str(entry["value"]))
+            for cached_id in ids:
+                self._entries.pop(f"tags|{base_url}|{cached_id}", None)
+            if self.path:
+                self._save()
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def default_cache() -> GatewayMetadataCache:
+    """The process-wide cache shared by the Lambda, the ingestion layer and the backfill tools."""
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = GatewayMetadataCache(
+                ttl=float(os.environ.get("GATEWAY_CACHE_TTL_SECONDS", DEFAULT_TTL_SECONDS)),
+                path=os.environ.get("GATEWAY_CACHE_PATH"),
+            )
+        return _default
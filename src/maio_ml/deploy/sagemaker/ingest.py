@@ -0,0 +1,152 @@
+"""
+Concurrent ingestion of gateway data from Maio.
+
+`MaioIngestor` fetches many (gateway, time range) requests concurrently with asyncio,
+capped at `max_concurrency` requests in flight. The blocking Maio client runs on a
+dedicated thread pool and every worker thread reuses its own client, so a scoring run
+pays at most `max_concurrency` connection setups instead of one per gateway. Failed
+requests are retried with exponential backoff, and each raw frame goes straight into
+`preprocess.clean_up_frame`.
+
+Only the tags the model reads (its signature's input tags) are kept. The maio_python
+client cannot filter entries by tag (as of 0.5.1), so every tag is downloaded and the
+others are dropped before anything else touches or caches the frame.
+"""
+import asyncio
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from gateway_cache import default_cache
+from preprocess import MAPPING_COLUMNS, TIMESTAMP_COLUMN, clean_up_frame
+from tag_cache import TagEntryCache
+
+logger = logging.getLogger(__name__)
+
+
+def _maio_client(base_url, token):
+    from maio_python import Client
+    return Client(base_url, token=token)
+
+
+class MaioIngestor(object):
+    def __init__(self, base_url, token, client_factory=_maio_client, max_concurrency: int = 8,
+                 retries: int = 3, backoff: float = 0.5, cache_dir: str = None, tags=tuple(MAPPING_COLUMNS),
+                 metadata=None):
+        """
+        Args:
+            base_url (str): Maio engine URL.
+            token (str): Maio API token.
+            client_factory (callable): ``client_factory(base_url, token)`` returning a client with
+                `get_gateway_id_from_name` and `get_tag_entries_for_gateway`.
+            max_concurrency (int): requests in flight, and size of the client pool.
+            retries (int): extra attempts per request after a failure.
+            backoff (float): base delay in seconds, doubled after every failed attempt.
+            cache_dir (str): read raw entries through a `TagEntryCache` in this directory.
+            tags (list): labels of the tags to fetch, the model signature's input tags. None fetches all tags.
+            metadata (GatewayMetadataCache): cache of gateway ids, the process-wide one by default.
+        """
+        self.base_url = base_url
+        self.token = token
+        self.client_factory = client_factory
+        self.max_concurrency = max_concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.tags = list(tags) if tags is not None else None
+        self.cache = TagEntryCache(cache_dir, self._fetch_entries) if cache_dir else None
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="maio")
+        self._local = threading.local()
+        self.metadata = metadata if metadata is not None else default_cache()
+
+    def client(self):
+        """Return the client of the current worker thread, creating it on first use."""
+        client = getattr(self._local, "client", None)
+        if client is None:
+            client = self._local.client = self.client_factory(self.base_url, self.token)
+        return client
+
+    def close(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _gateway_id(self, gateway_name):
+        gateway_id = self.metadata.gateway_id(self.base_url, gateway_name, self.client().get_gateway_id_from_name)
+        if gateway_id is None:
+            raise ValueError(f"Unknown gateway {gateway_name}")
+        return gateway_id
+
+    def _fetch_entries(self, gateway_id, start, end, tags=None):
+        _, df_maio = self.client().get_tag_entries_for_gateway(gateway_id, start, end)
+        if tags is not None:
+            df_maio = df_maio.reindex(columns=[TIMESTAMP_COLUMN] + tags)
+        return df_maio
+
+    def fetch_raw(self, gateway_name, start, end):
+        """Blocking fetch of the raw entries of one gateway, run on the worker threads."""
+        gateway_id = self._gateway_id(gateway_name)
+        if self.cache is not None:
+            return self.cache.get(gateway_id, start, end, self.tags)
+        return self._fetch_entries(gateway_id, start, end, self.tags)
+
+    def _fetch_resampled(self, gateway_name, start, end, keep_timestamp):
+        return clean_up_frame(self.fetch_raw(gateway_name, start, end), keep_timestamp=keep_timestamp,
+                              tags=self.tags)
+
+    def _delay(self, attempt):
+        return self.backoff * 2 ** attempt * (0.5 + random.random())
+
+    def fetch(self, gateway_name, start, end, keep_timestamp=False):
+        """
+        Blocking fetch and resampling of one gateway in the calling thread, retried like
+        `fetch_many`, for callers running their own thread pool.
+        """
+        for attempt in range(self.retries + 1):
+            try:
+                return self._fetch_resampled(gateway_name, start, end, keep_timestamp)
+            except Exception as e:
+                if attempt == self.retries:
+                    raise
+                logger.warning(f"Attempt {attempt + 1} of fetch({gateway_name!r}) failed: {e}")
+            time.sleep(self._delay(attempt))
+
+    async def _with_retries(self, semaphore, fn, *args):
+        loop = asyncio.get_running_loop()
+        for attempt in range(self.retries + 1):
+            async with semaphore:
+                try:
+                    return await loop.run_in_executor(self._executor, fn, *args)
+                except Exception as e:
+                    if attempt == self.retries:
+                        raise
+                    logger.warning(f"Attempt {attempt + 1} of {fn.__name__}{args[:1]} failed: {e}")
+            await asyncio.sleep(self._delay(attempt))
+
+    async def fetch_many(self, requests, keep_timestamp=False):
+        """
+        Fetch and resample ``(gateway_name, start, end)`` requests concurrently.
+
+        Returns:
+            list: one resampled DataFrame per request, in order, or the exception that
+            request failed with after all retries.
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        started = time.perf_counter()
+        results = await asyncio.gather(
+            *[self._with_retries(semaphore, self._fetch_resampled, gateway_name, start, end, keep_timestamp)
+              for gateway_name, start, end in requests],
+            return_exceptions=True,
+        )
+        failed = sum(isinstance(r, Exception) for r in results)
+        logger.info(f"Fetched {len(results) - failed}/{len(results)} gateway windows "
+                    f"in {time.perf_counter() - started:.2f}s")
+        return results
+
+    def fetch_many_sync(self, requests, keep_timestamp=False):
+        return asyncio.run(self.fetch_many(requests, keep_timestamp))
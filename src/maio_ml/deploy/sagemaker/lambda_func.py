@@ -1,58 +1,197 @@
+import time
+
+_INIT_STARTED = time.perf_counter()
+
+import hashlib
 import json
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
 from datetime import timezone, datetime, timedelta
 
 import boto3
-import pandas as pd
-from maio_python import Client
-
-
-def fetch_data_from_maio(base_url, token, gateway_name, start_time, end_time):
-    # Creating MAIO client
-    maio_client = Client(base_url, token=token)
-    # Get gateway Id
-    gateway_id = maio_client.get_gateway_id_from_name(gateway_name)
+from botocore.config import Config
+
+from gateway_cache import default_cache
+from prediction_cache import content_key, default_cache as default_prediction_cache
+
+# Maio tags read by the default model, see preprocess.MAPPING_COLUMNS
+DEFAULT_INPUT_TAGS = ("CoolerTemp", "BathTemp", "CoolerSwitch", "RefridgentTemp", "CompressorCurrent")
+
+# Created once per container and reused by warm invocations, keeping their connections open
+_runtime_client = None
+_sagemaker_client = None
+_s3_client = None
+_fan_out_pool = None
+
+# Jobs still running when a fan-out returned, by `job_key`, with their futures. Their threads
+# resume when the container is invoked again, and the next fan-out collects them instead of
+# scoring the gateways a second time.
+_in_flight = {}
+
+# Fan-out invocations: gateways scored at once, time kept back for the checkpoint, and the
+# budget used when there is no Lambda context. Unfinished gateways are checkpointed in S3,
+# under CHECKPOINT_PREFIX and a key per set of gateways and endpoint (see `checkpoint_key`).
+FAN_OUT_CONCURRENCY = int(os.environ.get('FAN_OUT_CONCURRENCY', '8'))
+FAN_OUT_SAFETY_SECONDS = float(os.environ.get('FAN_OUT_SAFETY_SECONDS', '10'))
+FAN_OUT_BUDGET_SECONDS = float(os.environ.get('FAN_OUT_BUDGET_SECONDS', '840'))
+CHECKPOINT_BUCKET = os.environ.get('CHECKPOINT_BUCKET')
+CHECKPOINT_PREFIX = os.environ.get('CHECKPOINT_PREFIX', 'lambda-fan-out')
+
+# Raw entries are cached here across warm invocations when set, e.g. /tmp/maio-tag-cache
+TAG_CACHE_DIR = os.environ.get('TAG_CACHE_DIR')
+# Gateway ids and tag catalogs are cached in memory, and in GATEWAY_CACHE_PATH when set (see gateway_cache.py)
+
+# One ingestor, and so one pool of open Maio connections, per engine and token across warm invocations.
+# Tokens rotate, so only the MAX_INGESTORS most recently used are kept.
+MAX_INGESTORS = int(os.environ.get('MAX_INGESTORS', '4'))
+_ingestors = OrderedDict()
+_ingestors_lock = threading.Lock()
+
+# Endpoint responses keyed by endpoint, model and request body, shared by warm invocations and
+# by the gateways of one fan-out (see prediction_cache.py); None when PREDICTION_CACHE_MAX_ENTRIES is 0
+_prediction_cache = default_prediction_cache("lambda")
+
+# Deployment behind each endpoint name, part of the cache key of requests without a model_version so
+# that a redeploy under the same name is not served the previous model's results. Described at most
+# every ENDPOINT_IDENTITY_TTL_SECONDS per container, which bounds how long that can still happen.
+# Needs sagemaker:DescribeEndpoint; predictions are not cached for endpoints that cannot be described.
+ENDPOINT_IDENTITY_TTL_SECONDS = float(os.environ.get('ENDPOINT_IDENTITY_TTL_SECONDS', '60'))
+_endpoint_identities = {}
+
+
+def get_runtime_client():
+    global _runtime_client
+    if _runtime_client is None and os.environ.get('DEPLOY_ENV') == 'inprocess':
+        # endpoints served in this process by script.py's handlers, see local_runtime.py
+        from local_runtime import InProcessSagemakerRuntimeClient
+
+        _runtime_client = InProcessSagemakerRuntimeClient.from_env()
+    elif _runtime_client is None:
+        _runtime_client = boto3.client('sagemaker-runtime', config=Config(
+            tcp_keepalive=True,
+            max_pool_connections=int(os.environ.get('RUNTIME_MAX_POOL_CONNECTIONS', '10')),
+            retries={'max_attempts': 3, 'mode': 'standard'},
+        ))
+    return _runtime_client
+
+
+def get_sagemaker_client():
+    global _sagemaker_client
+    if _sagemaker_client is None:
+        runtime_client = get_runtime_client()
+        if hasattr(runtime_client, 'sagemaker_client'):
+            # the in-process runtime describes the endpoints it serves itself
+            _sagemaker_client = runtime_client.sagemaker_client
+        else:
+            _sagemaker_client = boto3.client('sagemaker', config=Config(tcp_keepalive=True))
+    return _sagemaker_client
+
+
+def endpoint_identity(endpoint):
+    """
+    The deployment serving `endpoint`: its endpoint config and last modification, or None
+    when the endpoint cannot be described.
+    """
+    now = time.monotonic()
+    cached = _endpoint_identities.get(endpoint)
+    if cached is not None and now - cached[1] < ENDPOINT_IDENTITY_TTL_SECONDS:
+        return cached[0]
+    try:
+        described = get_sagemaker_client().describe_endpoint(EndpointName=endpoint)
+        identity = f"{described['EndpointConfigName']}@{described['LastModifiedTime']}"
+    except Exception as e:
+        print(f'Cannot describe endpoint {endpoint}, not caching its predictions: {type(e).__name__}: {e}')
+        identity = None
+    _endpoint_identities[endpoint] = (identity, now)
+    return identity
+
+
+def get_fan_out_pool():
+    # kept across warm invocations so that its threads keep their Maio clients
+    global _fan_out_pool
+    if _fan_out_pool is None:
+        _fan_out_pool = ThreadPoolExecutor(max_workers=FAN_OUT_CONCURRENCY, thread_name_prefix='fan-out')
+    return _fan_out_pool
+
+
+def get_s3_client():
+    global _s3_client
+    if _s3_client is None:
+        _s3_client = boto3.client('s3', config=Config(tcp_keepalive=True))
+    return _s3_client
+
+
+def get_ingestor(base_url, token, input_tags=DEFAULT_INPUT_TAGS):
+    key = (base_url, token, tuple(input_tags))
+    evicted = []
+    with _ingestors_lock:
+        ingestor = _ingestors.get(key)
+        if ingestor is None:
+            # pandas and the Maio client are only imported once data is actually fetched
+            from ingest import MaioIngestor
+            ingestor = _ingestors[key] = MaioIngestor(base_url, token, cache_dir=TAG_CACHE_DIR, tags=input_tags)
+            while len(_ingestors) > max(MAX_INGESTORS, 1):
+                evicted.append(_ingestors.popitem(last=False)[1])
+        else:
+            _ingestors.move_to_end(key)
+    for old in evicted:
+        # fetches still running on it finish, its clients go with the last reference to it
+        old.close(wait=False)
+    return ingestor
 
-    assert gateway_id is not None
 
+def fetch_data_from_maio(base_url, token, gateway_name, start_time, end_time, input_tags=DEFAULT_INPUT_TAGS):
     # convert start_time and end_time to datetime objects
     start_time = datetime.strptime(start_time, '%Y-%m-%dT%H:%M:%S.%fZ')
     end_time = datetime.strptime(end_time, '%Y-%m-%dT%H:%M:%S.%fZ')
 
-    _, df_maio = maio_client.get_tag_entries_for_gateway(gateway_id, start_time, end_time)
+    # Only the model's input tags are downloaded
+    return get_ingestor(base_url, token, input_tags).fetch_raw(gateway_name, start_time, end_time)
 
-    return df_maio
 
+def clean_up_data(base_url, token, gateway_name, start_time, end_time, keep_timestamp=False,
+                  input_tags=DEFAULT_INPUT_TAGS):
+    from preprocess import clean_up_frame
 
-def clean_up_data(base_url, token, gateway_name, start_time, end_time):
     # Get data from MAIO
-    df_maio = fetch_data_from_maio(base_url, token, gateway_name, start_time, end_time)
-
-    mapping_columns = {"CoolerTemp": "cooler_temp", "BathTemp": "bath_temp", "CoolerSwitch": "cooler_switch",
-                       "RefridgentTemp": "refridgent_temp", "CompressorCurrent": "compressor_current",
-                       "timestamps": "timestamp"}
+    df_maio = fetch_data_from_maio(base_url, token, gateway_name, start_time, end_time, input_tags)
 
-    df_maio_small = df_maio[mapping_columns.keys()].rename(columns=mapping_columns)
+    # Resample to 1 minute and fill missing values with the previous value
+    return clean_up_frame(df_maio, keep_timestamp=keep_timestamp, tags=input_tags)
 
-    df_maio_small['timestamp'] = pd.to_datetime(df_maio_small['timestamp'])
-    df_maio_small = df_maio_small.set_index('timestamp')
 
-    # Resample the dataframe to 1 minute
-    df_maio_small_resampled = df_maio_small.resample("1Min").mean()
+def count_anomalies(data, threshold=4.5):
+    """Count the scores above `threshold` in the split-oriented JSON returned by the endpoint."""
+    split = json.loads(data)
+    if isinstance(split, str):
+        split = json.loads(split)
+    column = split['columns'].index('anom_score')
+    return sum(1 for row in split['data'] if row[column] is not None and row[column] >= threshold)
 
-    # Fill missing values with the previous value
-    df_maio_small_resampled = df_maio_small_resampled.fillna(method="ffill")
 
-    df_maio_small_resampled.reset_index(inplace=True)
+@contextmanager
+def timed(timings, phase):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[phase] = round((time.perf_counter() - started) * 1000, 2)
 
-    # # Reset the index
-    # df_maio_small_resampled.set_index(inplace=True)
 
-    # Drop the timestamp column
-    df_maio_small_resampled.drop(columns=['timestamp'], axis=1, inplace=True)
-    return df_maio_small_resampled
+def log_timings(**fields):
+    # one JSON line per invocation, queryable with CloudWatch Logs Insights
+    print(json.dumps(dict(fields, message='lambda_timings')))
 
 
 def lambda_handler(event, context):
+    global _cold_start
+    timings = {}
+    handler_started = time.perf_counter()
+    cold_start, _cold_start = _cold_start, False
+
     # Retrieve the payload from the API Gateway request
     base_url = "https://engine.heineken.maio.io"
     gateway_name = 'Aruba'
@@ -94,26 +233,241 @@ def lambda_handler(event, context):
     if 'endpoint' in event:
         endpoint = event['endpoint']
 
-    df_maio_small_resampled = clean_up_data(base_url, token, gateway_name, start_time, end_time)
-    # base_endpoint = 'pytorch-anomaly-classification-2023-05-21-06-50-14-925'
+    # Input tags of the model signature, as a list or a comma separated string
+    input_tags = event.get('input_tags') or list(DEFAULT_INPUT_TAGS)
+    if isinstance(input_tags, str):
+        input_tags = input_tags.split(',')
 
-    # Invoke the SM endpoint
-    runtime_client = boto3.client('sagemaker-runtime')
-    response = runtime_client.invoke_endpoint(
-        EndpointName=endpoint,
-        ContentType="application/json",
-        Accept="application/json",
-        Body=df_maio_small_resampled.to_json(orient='split', index=False)
-    )
+    # Drop the cached id and tag catalog of the gateway, e.g. after it was renamed or its tags changed
+    if str(event.get('invalidate_gateway_cache', 'false')).lower() == 'true':
+        default_cache().invalidate_gateway(base_url, gateway_name)
+
+    # Incremental scoring lets the endpoint skip the points it already scored for this gateway
+    incremental = str(event.get('incremental', 'false')).lower() == 'true'
 
-    # Transform the response to a string
-    data = response['Body'].read().decode("utf-8")
+    defaults = dict(gateway_name=gateway_name, endpoint=endpoint, start_time=start_time, end_time=end_time,
+                    input_tags=input_tags, incremental=incremental,
+                    model_id=event.get('model_id'), model_version=event.get('model_version'))
 
-    anom_score = pd.read_json(json.loads(data), orient='split')
+    # Several gateways (and endpoints) scored by one invocation, e.g. from the scheduler
+    if 'gateways' in event or event.get('resume'):
+        return fan_out(base_url, token, event, defaults, context, cold_start)
+
+    result, timings, rows = score_gateway(base_url, token, defaults)
+
+    log_timings(gateway=gateway_name, endpoint=endpoint, rows=rows, cold_start=cold_start,
+                init_ms=INIT_MS if cold_start else None, phases_ms=timings,
+                prediction_cache=_prediction_cache.stats() if _prediction_cache else None,
+                total_ms=round((time.perf_counter() - handler_started) * 1000, 2))
+
+    return result
+
+
+def score_gateway(base_url, token, job):
+    """
+    Fetch, resample and score the window of one gateway.
+
+    Returns:
+        (dict, dict, int): the result, the duration of every phase in ms and the number of scored rows.
+    """
+    timings = {}
+    gateway_name = job['gateway_name']
+
+    with timed(timings, 'fetch'):
+        df_maio = fetch_data_from_maio(base_url, token, gateway_name, job['start_time'], job['end_time'],
+                                       job['input_tags'])
+
+    with timed(timings, 'preprocess'):
+        from preprocess import clean_up_frame
+
+        # Resample to 1 minute and fill missing values with the previous value
+        df_maio_small_resampled = clean_up_frame(df_maio, keep_timestamp=job['incremental'],
+                                                 tags=job['input_tags'])
+        # base_endpoint = 'pytorch-anomaly-classification-2023-05-21-06-50-14-925'
+
+        body = df_maio_small_resampled.to_json(orient='split', index=False, date_format='iso')
+        # Route to a per-gateway model when the endpoint serves several
+        if job['incremental'] or job['model_id'] is not None or job['model_version'] is not None:
+            body = json.dumps({
+                'model_id': job['model_id'],
+                'model_version': job['model_version'],
+                'gateway': gateway_name if job['incremental'] else None,
+                'data': json.loads(body),
+            })
+
+    def invoke():
+        response = get_runtime_client().invoke_endpoint(
+            EndpointName=job['endpoint'],
+            ContentType="application/json",
+            Accept="application/json",
+            Body=body
+        )
+
+        # Transform the response to a string
+        return response['Body'].read().decode("utf-8")
+
+    # Invoke the SM endpoint, unless the same window was already scored by the same model.
+    # Incremental requests depend on the endpoint's per-gateway state and always go through.
+    with timed(timings, 'invoke'):
+        if _prediction_cache is None or job['incremental']:
+            deployment = None
+        else:
+            deployment = job['model_version'] or endpoint_identity(job['endpoint'])
+        if deployment is None:
+            data = invoke()
+        else:
+            model_version = f"{job['endpoint']}/{job['model_id']}/{deployment}"
+            data = _prediction_cache.get_or_compute(content_key(model_version, body), invoke)
+
+    with timed(timings, 'parse'):
+        count = count_anomalies(data)
 
     result = dict(
-        anomaly_detected=str(anom_score.ge(4.5).any()['anom_score']),
-        count=int(anom_score.ge(4.5).sum()['anom_score'])
+        anomaly_detected=str(count > 0),
+        count=count
     )
+    return result, timings, len(df_maio_small_resampled)
+
+
+def fan_out_gateways(event):
+    """``event['gateways']`` as a list, given as one or a comma separated string in a query string."""
+    gateways = event.get('gateways') or []
+    if isinstance(gateways, str):
+        gateways = gateways.split(',')
+    return gateways
+
+
+def fan_out_jobs(event, defaults):
+    """
+    One job per entry of ``event['gateways']``: a gateway name, or a dict overriding any of
+    gateway_name, endpoint, start_time, end_time, input_tags, incremental, model_id and model_version.
+    """
+    jobs = []
+    for entry in fan_out_gateways(event):
+        job = dict(defaults)
+        job.update({'gateway_name': entry} if isinstance(entry, str) else entry)
+        if isinstance(job['input_tags'], str):
+            job['input_tags'] = job['input_tags'].split(',')
+        jobs.append(job)
+    return jobs
+
+
+def job_key(job):
+    return json.dumps(job, sort_keys=True)
+
+
+def checkpoint_key(event, defaults):
+    """
+    The S3 key of the checkpoint of a fan-out: ``event['checkpoint_key']`` when given, else a hash of
+    the requested gateways and the default endpoint, so that the rules scoring different gateways
+    keep separate checkpoints and an invocation resumes only what the same rule left over.
+    """
+    if event.get('checkpoint_key'):
+        return event['checkpoint_key']
+    rule = json.dumps([fan_out_gateways(event), defaults['endpoint']], sort_keys=True)
+    return f"{CHECKPOINT_PREFIX}/{hashlib.sha256(rule.encode()).hexdigest()[:16]}.json"
+
+
+def load_checkpoint(key):
+    """The jobs left pending and those left in flight by the previous invocation."""
+    if not CHECKPOINT_BUCKET:
+        return []
+    try:
+        response = get_s3_client().get_object(Bucket=CHECKPOINT_BUCKET, Key=key)
+    except get_s3_client().exceptions.NoSuchKey:
+        return []
+    checkpoint = json.loads(response['Body'].read())
+    return checkpoint.get('in_flight', []) + checkpoint['pending']
+
+
+def save_checkpoint(key, pending, in_flight=()):
+    if not CHECKPOINT_BUCKET:
+        return None
+    get_s3_client().put_object(Bucket=CHECKPOINT_BUCKET, Key=key,
+                               Body=json.dumps({'pending': pending, 'in_flight': list(in_flight),
+                                                'saved_at': datetime.now(timezone.utc).isoformat()}))
+    return f's3://{CHECKPOINT_BUCKET}/{key}'
+
+
+def fan_out(base_url, token, event, defaults, context, cold_start=False):
+    """
+    Score many gateways concurrently within the time left to the invocation.
+
+    Jobs left over by the previous invocation of the same rule (see `checkpoint_key`) run first,
+    and a requested job already among them is not queued again. No job is started once the
+    remaining time drops below the slowest job seen so far plus a safety margin. Jobs not started by the deadline are reported as pending, jobs still running
+    then as in flight: they cannot be interrupted, so they keep their thread. Both are
+    checkpointed to S3 when CHECKPOINT_BUCKET is set and always returned, so the next
+    invocation, or the caller, can resume them. An in-flight job resumed by the same warm
+    container is collected rather than started again; any other container scores it anew.
+    """
+    started = time.perf_counter()
+    if context is not None:
+        deadline = started + context.get_remaining_time_in_millis() / 1000 - FAN_OUT_SAFETY_SECONDS
+    else:
+        deadline = started + FAN_OUT_BUDGET_SECONDS
+    key = checkpoint_key(event, defaults)
+    jobs, queued = [], set()
+    for job in load_checkpoint(key) + fan_out_jobs(event, defaults):
+        if job_key(job) not in queued:
+            queued.add(job_key(job))
+            jobs.append(job)
+    concurrency = min(int(event.get('concurrency', FAN_OUT_CONCURRENCY)), FAN_OUT_CONCURRENCY)
+
+    results, slowest = [], 0.0
+    queue, running = [], {}
+    for job in jobs:
+        future = _in_flight.pop(job_key(job), None)
+        if future is not None:
+            running[future] = (job, time.perf_counter())
+        else:
+            queue.append(job)
+    # in-flight jobs no longer requested are dropped once they finish
+    for key, future in list(_in_flight.items()):
+        if future.done():
+            del _in_flight[key]
+    pool = get_fan_out_pool()
+    while queue or running:
+        while queue and len(running) < concurrency and time.perf_counter() + slowest < deadline:
+            job = queue.pop(0)
+            running[pool.submit(score_gateway, base_url, token, job)] = (job, time.perf_counter())
+        if not running:
+            break
+        done, _ = wait(running, timeout=max(deadline - time.perf_counter(), 0), return_when=FIRST_COMPLETED)
+        if not done:
+            break
+        for future in done:
+            job, job_started = running.pop(future)
+            slowest = max(slowest, time.perf_counter() - job_started)
+            entry = {'gateway': job['gateway_name'], 'endpoint': job['endpoint']}
+            try:
+                result, timings, rows = future.result()
+                entry.update(result, rows=rows, phases_ms=timings)
+            except Exception as e:
+                entry['error'] = f'{type(e).__name__}: {e}'
+            results.append(entry)
+
+    # jobs still running at the deadline are not waited for, the next invocation collects them
+    in_flight = []
+    for future, (job, _) in running.items():
+        if future.cancel():
+            queue.insert(0, job)
+        else:
+            _in_flight[job_key(job)] = future
+            in_flight.append(job)
+    pending = queue
 
-    return result
+    checkpoint = save_checkpoint(key, pending, in_flight)
+    log_timings(gateways=len(jobs), scored=sum('error' not in r for r in results),
+                failed=sum('error' in r for r in results), pending=len(pending), in_flight=len(in_flight),
+                concurrency=concurrency,
+                cold_start=cold_start, init_ms=INIT_MS if cold_start else None,
+                prediction_cache=_prediction_cache.stats() if _prediction_cache else None,
+                total_ms=round((time.perf_counter() - started) * 1000, 2))
+
+    return dict(results=results, pending=pending, in_flight=in_flight, checkpoint=checkpoint)
+
+
+# Module import time, reported with the first invocation of the container
+INIT_MS = round((time.perf_counter() - _INIT_STARTED) * 1000, 2)
+_cold_start = True
@@ -0,0 +1,234 @@
+"""
+In-process stand-ins for the SageMaker clients.
+
+SageMaker local mode (``LocalSagemakerClient`` / ``LocalSagemakerRuntimeClient``) builds
+and runs the serving container in Docker. These fakes serve endpoints in the calling
+process instead, by calling the ``model_fn`` / ``input_fn`` / ``predict_fn`` /
+``output_fn`` handlers of script.py directly, so deploy.py, predict.py, backfill.py and
+lambda_func.py can run end to end on one machine without Docker:
+
+    client = InProcessSagemakerClient({"anomaly": "build"}, workers=2)
+    runtime = InProcessSagemakerRuntimeClient(client, latency=0.02, jitter=0.005)
+    runtime.invoke_endpoint(EndpointName="anomaly", ContentType="application/json", Body=body)
+
+An endpoint loads its model on its first invocation, like a container starting up, and
+serves at most `workers` invocations at once. The runtime client adds `latency` ± `jitter`
+seconds to every invocation to stand for the network and the SageMaker front end.
+Unknown endpoints and failing handlers raise the `ClientError` boto3 would.
+
+``DEPLOY_ENV=inprocess`` selects them in `DeployEnv` (see config.yml) and in lambda_func.py,
+which configures them with ``LOCAL_RUNTIME_MODEL_DIR``, ``LOCAL_RUNTIME_LATENCY_MS``,
+``LOCAL_RUNTIME_JITTER_MS`` and ``LOCAL_RUNTIME_WORKERS``.
+"""
+import importlib
+import io
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger(__name__)
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def load_handlers(source_dir: str = HERE, entry_point: str = "script"):
+    """The handlers module `entry_point` of `source_dir`, which is put on the path for its sibling imports."""
+    if source_dir not in sys.path:
+        sys.path.append(source_dir)
+    return importlib.import_module(entry_point)
+
+
+def model_dir_from_url(url: str) -> str:
+    """Local directory of a ``model_data_path`` setting such as ``file://build/``."""
+    return url[len("file://"):] if url.startswith("file://") else url
+
+
+def _error(code: str, message: str, operation: str):
+    return ClientError({"Error": {"Code": code, "Message": message},
+                        "ResponseMetadata": {"HTTPStatusCode": 424 if code == "ModelError" else 400}}, operation)
+
+
+class _Endpoint(object):
+    def __init__(self, name, config_name, model_dir, workers):
+        self.name = name
+        self.config_name = config_name
+        self.model_dir = model_dir
+        self.created = self.modified = datetime.now(timezone.utc)
+        self.model = None
+        self.invocations = 0
+        self._load_lock = threading.Lock()
+        self._workers = threading.BoundedSemaphore(workers) if workers else None
+
+    def get_model(self, handlers):
+        with self._load_lock:
+            if self.model is None:
+                started = time.perf_counter()
+                self.model = handlers.model_fn(self.model_dir)
+                logger.info(f"Endpoint {self.name}: loaded {self.model_dir} in {time.perf_counter() - started:.2f}s")
+            return self.model
+
+    def invoke(self, handlers, body, content_type, accept):
+        model = self.get_model(handlers)
+        if self._workers is not None:
+            self._workers.acquire()
+        try:
+            self.invocations += 1
+            data = handlers.input_fn(body, content_type)
+            prediction = handlers.predict_fn(data, model)
+            response = handlers.output_fn(prediction, accept)
+        finally:
+            if self._workers is not None:
+                self._workers.release()
+        return response.encode() if isinstance(response, str) else response
+
+
+class InProcessSagemakerClient(object):
+    def __init__(self, endpoints: dict = None, default_model_dir: str = None, workers: int = None, handlers=None):
+        """
+        Args:
+            endpoints (dict): model directory of every endpoint (and endpoint config) deployed from the start.
+            default_model_dir (str): model directory of endpoints invoked without being deployed,
+                None to reject them as SageMaker does.
+            workers (int): invocations served at once per endpoint, unbounded when None.
+            handlers: module or object with the script.py handlers, script.py itself by default.
+        """
+        self.default_model_dir = default_model_dir
+        self.workers = workers
+        self._handlers = handlers
+        self._configs = dict(endpoints or {})
+        self._endpoints = {}
+        self._lock = threading.Lock()
+        for name, model_dir in self._configs.items():
+            self._endpoints[name] = _Endpoint(name, name, model_dir, workers)
+
+    @property
+    def handlers(self):
+        if self._handlers is None:
+            self._handlers = load_handlers()
+        return self._handlers
+
+    def create_endpoint_config(self, EndpointConfigName, ModelDataUrl, **kwargs):
+        """Unlike SageMaker's, takes the model data of the config directly instead of a model name."""
+        with self._lock:
+            if EndpointConfigName in self._configs:
+                raise _error("ValidationException",
+                             f"Cannot create already existing endpoint configuration {EndpointConfigName}.",
+                             "CreateEndpointConfig")
+            self._configs[EndpointConfigName] = model_dir_from_url(ModelDataUrl)
+        return {"EndpointConfigArn": f"arn:aws:sagemaker:local:000000000000:endpoint-config/{EndpointConfigName}"}
+
+    def delete_endpoint_config(self, EndpointConfigName):
+        with self._lock:
+            if self._configs.pop(EndpointConfigName, None) is None:
+                raise _error("ValidationException", f"Could not find endpoint configuration {EndpointConfigName}.",
+                             "DeleteEndpointConfig")
+
+    def _config(self, name, operation):
+        model_dir = self._configs.get(name)
+        if model_dir is None:
+            raise _error("ValidationException", f"Could not find endpoint configuration {name}.", operation)
+        return model_dir
+
+    def create_endpoint(self, EndpointName, EndpointConfigName, **kwargs):
+        with self._lock:
+            if EndpointName in self._endpoints:
+                raise _error("ValidationException", f"Cannot create already existing endpoint {EndpointName}.",
+                             "CreateEndpoint")
+            model_dir = self._config(EndpointConfigName, "CreateEndpoint")
+            self._endpoints[EndpointName] = _Endpoint(EndpointName, EndpointConfigName, model_dir, self.workers)
+        return {"EndpointArn": f"arn:aws:sagemaker:local:000000000000:endpoint/{EndpointName}"}
+
+    def update_endpoint(self, EndpointName, EndpointConfigName, **kwargs):
+        """Switch the endpoint to the config's model data; the model is reloaded on the next invocation."""
+        with self._lock:
+            model_dir = self._config(EndpointConfigName, "UpdateEndpoint")
+            previous = self._endpoints.get(EndpointName)
+            if previous is None:
+                raise _error("ValidationException", f"Could not find endpoint {EndpointName}.", "UpdateEndpoint")
+            # in-flight invocations finish with the model they started with
+            endpoint = self._endpoints[EndpointName] = _Endpoint(EndpointName, EndpointConfigName, model_dir,
+                                                                 self.workers)
+            endpoint.created = previous.created
+        return {"EndpointArn": f"arn:aws:sagemaker:local:000000000000:endpoint/{EndpointName}"}
+
+    def delete_endpoint(self, EndpointName):
+        with self._lock:
+            if self._endpoints.pop(EndpointName, None) is None:
+                raise _error("ValidationException", f"Could not find endpoint {EndpointName}.", "DeleteEndpoint")
+
+    def describe_endpoint(self, EndpointName):
+        endpoint = self.endpoint(EndpointName, "DescribeEndpoint", create=False)
+        return {
+            "EndpointName": endpoint.name,
+            "EndpointArn": f"arn:aws:sagemaker:local:000000000000:endpoint/{endpoint.name}",
+            "EndpointConfigName": endpoint.config_name,
+            "EndpointStatus": "InService",
+            "CreationTime": endpoint.created,
+            "LastModifiedTime": endpoint.modified,
+            "ProductionVariants": [{"VariantName": "AllTraffic", "CurrentInstanceCount": 1,
+                                    "ModelDataUrl": endpoint.model_dir, "ModelLoaded": endpoint.model is not None,
+                                    "Invocations": endpoint.invocations}],
+        }
+
+    def endpoint(self, name, operation="InvokeEndpoint", create=True):
+        with self._lock:
+            endpoint = self._endpoints.get(name)
+            if endpoint is None and create and self.default_model_dir is not None:
+                endpoint = self._endpoints[name] = _Endpoint(name, name, self.default_model_dir, self.workers)
+        if endpoint is None:
+            raise _error("ValidationException", f"Could not find endpoint {name}.", operation)
+        return endpoint
+
+
+class InProcessSagemakerRuntimeClient(object):
+    def __init__(self, sagemaker_client: InProcessSagemakerClient = None, latency: float = 0.0,
+                 jitter: float = 0.0, seed: int = None):
+        """
+        Args:
+            sagemaker_client (InProcessSagemakerClient): endpoints served, by default every endpoint
+                name served from ``build``.
+            latency (float): seconds added to every invocation.
+            jitter (float): maximum seconds randomly added to or removed from `latency`.
+            seed (int): seed of the jitter.
+        """
+        self.sagemaker_client = sagemaker_client or InProcessSagemakerClient(default_model_dir="build")
+        self.latency = latency
+        self.jitter = jitter
+        self._random = random.Random(seed)
+
+    @classmethod
+    def from_env(cls):
+        workers = int(os.environ.get("LOCAL_RUNTIME_WORKERS", "0"))
+        return cls(
+            InProcessSagemakerClient(default_model_dir=os.environ.get("LOCAL_RUNTIME_MODEL_DIR", "build"),
+                                     workers=workers or None),
+            latency=float(os.environ.get("LOCAL_RUNTIME_LATENCY_MS", "0")) / 1000,
+            jitter=float(os.environ.get("LOCAL_RUNTIME_JITTER_MS", "0")) / 1000,
+        )
+
+    def invoke_endpoint(self, EndpointName, Body, ContentType="application/json", Accept="application/json",
+                        **kwargs):
+        endpoint = self.sagemaker_client.endpoint(EndpointName)
+        delay = self.latency + (self._random.uniform(-self.jitter, self.jitter) if self.jitter else 0.0)
+        if delay > 0:
+            time.sleep(delay)
+        body = Body.encode() if isinstance(Body, str) else Body.read() if hasattr(Body, "read") else Body
+        try:
+            data = endpoint.invoke(self.sagemaker_client.handlers, body, ContentType, Accept)
+        except ClientError:
+            raise
+        except Exception as e:
+            logger.exception(f"Endpoint {EndpointName} failed")
+            raise _error("ModelError", f"Received server error (500) from model: {e}", "InvokeEndpoint") from e
+        return {
+            "Body": io.BytesIO(data),
+            "ContentType": Accept,
+            "InvokedProductionVariant": "AllTraffic",
+            "ResponseMetadata": {"HTTPStatusCode": 200},
+        }
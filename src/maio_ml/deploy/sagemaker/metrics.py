@@ -0,0 +1,315 @@
+"""
+In-process counters, gauges and histograms.
+
+Kept dependency free so it can ship inside the SageMaker bundle, the scoring Lambda
+and the FastAPI app alike. `render()` produces the Prometheus text exposition format;
+processes without a scrape endpoint, such as the SageMaker model server, write it to
+their log every few seconds with `log_periodically`.
+
+Processes serving one endpoint together, such as prefork workers, each `share` their
+metrics through a directory; `scrape()` in any of them renders those of all, told apart
+by a ``worker`` label.
+"""
+import bisect
+import json
+import logging
+import os
+import threading
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    body = ",".join('{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in pairs)
+    return "{" + body + "}"
+
+
+class _Metric(object):
+    kind = None
+    # appended to the name of the exposed family, e.g. "_total" for counters
+    family_suffix = ""
+
+    def __init__(self, name, documentation="", labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _samples(self):
+        raise NotImplementedError
+
+    def _copy(self, value):
+        return value
+
+    def snapshot(self):
+        """The metric and its values as JSON-serializable data, see `merge`."""
+        with self._lock:
+            values = [[list(key), self._copy(value)] for key, value in self._values.items()]
+        return {"kind": self.kind, "documentation": self.documentation, "labelnames": list(self.labelnames),
+                "values": values}
+
+    @property
+    def family(self):
+        """Name of the metric as exposed, under which its HELP, TYPE and samples appear."""
+        if self.name.endswith(self.family_suffix):
+            return self.name
+        return self.name + self.family_suffix
+
+    def render(self):
+        family = self.family
+        lines = [f"# HELP {family} {self.documentation}", f"# TYPE {family} {self.kind}"]
+        for suffix, labels, extra, value in self._samples():
+            lines.append(f"{family}{suffix}{_format_labels(self.labelnames, labels, extra)} {value:g}")
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    kind = "counter"
+    family_suffix = "_total"
+
+    def inc(self, amount=1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self):
+        with self._lock:
+            return [("", key, None, value) for key, value in self._values.items()]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def inc(self, amount=1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount=1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self):
+        with self._lock:
+            return [("", key, None, value) for key, value in self._values.items()]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation="", labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def _copy(self, value):
+        counts, total, count = value
+        return [list(counts), total, count]
+
+    def snapshot(self):
+        return dict(super().snapshot(), buckets=list(self.buckets))
+
+    def summary(self, **labels):
+        """Return ``(count, sum)`` for one label set."""
+        state = self._values.get(self._key(labels))
+        return (0, 0.0) if state is None else (state[2], state[1])
+
+    def _samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, total, count) in self._values.items():
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += bucket_count
+                    le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                    samples.append(("_bucket", key, ("le", le), cumulative))
+                samples.append(("_sum", key, None, total))
+                samples.append(("_count", key, None, count))
+        return samples
+
+
+class Registry(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def _get_or_create(self, cls, name, documentation, labelnames, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, documentation, labelnames, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Metric {name} is already registered as a {metric.kind}")
+            return metric
+
+    def counter(self, name, documentation="", labelnames=()):
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation="", labelnames=()):
+        return self._get_or_create(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name, documentation="", labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._get_or_create(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def render(self, prefix: str = ""):
+        """Exposition of the metrics whose name starts with `prefix`."""
+        with self._lock:
+            metrics = [metric for name, metric in self._metrics.items() if name.startswith(prefix)]
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+    def snapshot(self):
+        """The snapshot of every metric by name."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {metric.name: metric.snapshot() for metric in metrics}
+
+
+REGISTRY = Registry()
+_KINDS = {cls.kind: cls for cls in (Counter, Gauge, Histogram)}
+# directory and worker name this process shares its metrics under, see `share`
+_shared = None
+
+
+def counter(name, documentation="", labelnames=()):
+    return REGISTRY.counter(name, documentation, labelnames)
+
+
+def gauge(name, documentation="", labelnames=()):
+    return REGISTRY.gauge(name, documentation, labelnames)
+
+
+def histogram(name, documentation="", labelnames=(), buckets=DEFAULT_BUCKETS):
+    return REGISTRY.histogram(name, documentation, labelnames, buckets)
+
+
+def render(prefix: str = ""):
+    return REGISTRY.render(prefix)
+
+
+def merge(snapshots: dict, label: str = "worker") -> Registry:
+    """
+    Combine the registry snapshots of several processes.
+
+    Args:
+        snapshots (dict): registry snapshots by the name of the process they were taken in.
+        label (str): label added to every metric, set to the name of the process.
+
+    Returns:
+        Registry: holding the values of all the processes.
+    """
+    registry = Registry()
+    for worker, snapshot in sorted(snapshots.items()):
+        for name, data in snapshot.items():
+            kwargs = {"buckets": data["buckets"]} if data["kind"] == "histogram" else {}
+            metric = registry._get_or_create(_KINDS[data["kind"]], name, data["documentation"],
+                                             data["labelnames"] + [label], **kwargs)
+            for key, value in data["values"]:
+                metric._values[tuple(key) + (str(worker),)] = value
+    return registry
+
+
+def _write_snapshot():
+    directory, worker = _shared
+    path = os.path.join(directory, f"{worker}.json")
+    with open(f"{path}.{os.getpid()}.tmp", "w") as f:
+        json.dump(REGISTRY.snapshot(), f)
+    # readers never see a partial file
+    os.replace(f"{path}.{os.getpid()}.tmp", path)
+
+
+def share(directory: str, worker, interval: float = 5.0) -> threading.Event:
+    """
+    Write the metrics of this process to ``<directory>/<worker>.json`` every `interval` seconds
+    from a daemon thread, for `scrape` in any process sharing `directory`. A process taking over
+    the name of one that died takes over its file, and restarts its counters.
+
+    Returns:
+        threading.Event: set it to stop writing.
+    """
+    global _shared
+    _shared = (directory, str(worker))
+    _write_snapshot()
+    stop = threading.Event()
+
+    def run():
+        while not stop.wait(interval):
+            try:
+                _write_snapshot()
+            except OSError:
+                logging.getLogger(__name__).exception(f"Could not share the metrics in {directory}")
+
+    threading.Thread(target=run, name="metrics-share", daemon=True).start()
+    return stop
+
+
+def scrape(prefix: str = "") -> str:
+    """
+    Exposition of the metrics starting with `prefix` of every process sharing this one's directory,
+    up to their `share` interval old, or `render(prefix)` for a process not sharing its metrics.
+    """
+    if _shared is None:
+        return render(prefix)
+    directory = _shared[0]
+    # this process's own metrics are current
+    _write_snapshot()
+    snapshots = {}
+    for name in os.listdir(directory):
+        if not name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(directory, name)) as f:
+                snapshots[name[:-len(".json")]] = json.load(f)
+        except (OSError, ValueError):
+            # removed since listed
+            continue
+    return merge(snapshots).render(prefix)
+
+
+def log_periodically(interval: float, log: logging.Logger = None, prefix: str = "") -> threading.Event:
+    """
+    Log the rendered metrics (those starting with `prefix`) every `interval` seconds from a
+    daemon thread, for processes nothing scrapes.
+
+    Returns:
+        threading.Event: set it to stop logging.
+    """
+    log = log or logging.getLogger(__name__)
+    stop = threading.Event()
+
+    def run():
+        while not stop.wait(interval):
+            log.info(f"Metrics of process {os.getpid()}:\n{render(prefix)}")
+
+    threading.Thread(target=run, name="metrics-log", daemon=True).start()
+    return stop
@@ -0,0 +1,191 @@
+"""
+Lazy loading of several models behind one endpoint.
+
+Artifacts are looked up under the model directory as
+
+    <model_dir>/model.pth                            default model
+    <model_dir>/<model_id>/model.pth                 per-gateway model
+    <model_dir>/<model_id>/<version>/model.pth       versioned per-gateway model
+
+Loaded models are kept in an LRU bounded by the size of their artifacts on disk.
+Concurrent first requests for the same model share a single load. A model is identified
+by its key and the mtime of its artifact, so an artifact replaced in place (e.g. by a
+retraining) is loaded again on the next lookup, and `lookup` returns that identity as
+the model's version, e.g. for prediction cache keys.
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from merlion.models.factory import ModelFactory
+
+try:
+    import metrics
+except ImportError:
+    # imported as part of the package, e.g. by the FastAPI model store
+    from . import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ALGORITHM = os.environ.get("MODEL_ALGORITHM", "LSTMED")
+ARTIFACT_NAME = "model.pth"
+
+LOAD_SECONDS = metrics.histogram(
+    "model_manager_load_seconds", "Time spent loading a model artifact", ["model"])
+LOOKUPS = metrics.counter(
+    "model_manager_lookups", "Model lookups by cache result", ["result"])
+LOADED_BYTES = metrics.gauge(
+    "model_manager_loaded_bytes", "Artifact bytes of the models currently loaded")
+EVICTIONS = metrics.counter(
+    "model_manager_evictions", "Models evicted from the LRU")
+
+
+class ModelNotFound(Exception):
+    pass
+
+
+def artifact_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            size += os.path.getsize(os.path.join(root, name))
+    return size
+
+
+def load_artifact(path):
+    """Load a saved Merlion model. An `algorithm` file next to the artifact overrides the default."""
+    algorithm = DEFAULT_ALGORITHM
+    algorithm_file = os.path.join(os.path.dirname(path), "algorithm")
+    if os.path.exists(algorithm_file):
+        with open(algorithm_file) as f:
+            algorithm = f.read().strip()
+    logger.info(f"Loading algorithm: {algorithm} from {path}")
+    return ModelFactory.load(algorithm, path)
+
+
+class ModelManager(object):
+    def __init__(self, model_dir: str, max_bytes: int = 2 * 1024 ** 3, loader=load_artifact, on_evict=None):
+        """
+        Args:
+            model_dir (str): root directory holding the model artifacts.
+            max_bytes (int): bound on the summed artifact size of the loaded models.
+            loader (callable): turns an artifact path into a model.
+            on_evict (callable): called with each evicted model, e.g. to release its batcher.
+        """
+        self.model_dir = model_dir
+        self.max_bytes = max_bytes
+        self.loader = loader
+        self.on_evict = on_evict
+        self._lock = threading.Lock()
+        self._models = OrderedDict()
+        self._loading = {}
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def resolve(self, model_id: str = None, version: str = None):
+        """Return the ``(key, artifact path)`` for a model id and optional version."""
+        if model_id is None:
+            path = os.path.join(self.model_dir, ARTIFACT_NAME)
+            if not os.path.exists(path):
+                raise ModelNotFound(f"No default model in {self.model_dir}")
+            return "default", path
+
+        model_root = os.path.join(self.model_dir, os.path.basename(str(model_id)))
+        if version is None:
+            versions = [v for v in os.listdir(model_root) if os.path.exists(os.path.join(model_root, v, ARTIFACT_NAME))] \
+                if os.path.isdir(model_root) else []
+            if versions:
+                version = max(versions, key=lambda v: (not v.isdigit(), int(v) if v.isdigit() else v))
+        if version is None:
+            path = os.path.join(model_root, ARTIFACT_NAME)
+            key = str(model_id)
+        else:
+            path = os.path.join(model_root, os.path.basename(str(version)), ARTIFACT_NAME)
+            key = f"{model_id}/{version}"
+        if not os.path.exists(path):
+            raise ModelNotFound(f"No artifact for model {key} in {self.model_dir}")
+        return key, path
+
+    def get(self, model_id: str = None, version: str = None):
+        return self.lookup(model_id, version)[0]
+
+    def lookup(self, model_id: str = None, version: str = None):
+        """
+        Returns:
+            (model, str): the model and its version, ``<key>@<artifact mtime in ns>``.
+        """
+        key, path = self.resolve(model_id, version)
+        mtime = os.stat(path).st_mtime_ns
+        identity = f"{key}@{mtime}"
+        with self._lock:
+            entry = self._models.get(key)
+            if entry is not None and entry[2] == mtime:
+                self._models.move_to_end(key)
+                self.hits += 1
+                LOOKUPS.inc(result="hit")
+                return entry[0], identity
+            self.misses += 1
+            LOOKUPS.inc(result="miss" if entry is None else "stale")
+            future = self._loading.get(identity)
+            owner = future is None
+            if owner:
+                future = self._loading[identity] = Future()
+
+        if not owner:
+            return future.result(), identity
+
+        try:
+            started = time.perf_counter()
+            model = self.loader(path)
+            elapsed = time.perf_counter() - started
+            LOAD_SECONDS.observe(elapsed, model=key)
+            logger.info(f"Loaded model {identity} in {elapsed:.3f}s")
+            self._insert(key, model, artifact_size(path), mtime)
+            future.set_result(model)
+            return model, identity
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._loading.pop(identity, None)
+
+    def _insert(self, key, model, size, mtime):
+        evicted = []
+        with self._lock:
+            replaced = self._models.get(key)
+            if replaced is not None and replaced[2] > mtime:
+                # a newer artifact was loaded meanwhile
+                return
+            self._models.pop(key, None)
+            if replaced is not None:
+                # the model of an artifact replaced in place
+                self._bytes -= replaced[1]
+                evicted.append((key, replaced[0]))
+            self._models[key] = (model, size, mtime)
+            self._bytes += size
+            while self._bytes > self.max_bytes and len(self._models) > 1:
+                old_key, (old_model, old_size, _) = self._models.popitem(last=False)
+                self._bytes -= old_size
+                evicted.append((old_key, old_model))
+            LOADED_BYTES.set(self._bytes)
+
+        for old_key, old_model in evicted:
+            EVICTIONS.inc()
+            logger.info(f"Evicted model {old_key}")
+            if self.on_evict is not None:
+                self.on_evict(old_model)
+
+    def loaded(self):
+        with self._lock:
+            return list(self._models)
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
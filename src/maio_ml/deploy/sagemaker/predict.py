@@ -1,6 +1,10 @@
 import sys
 
+from .datalake import SensorDataLake
 from .deploy_env import DeployEnv
+from .gateway_cache import GatewayMetadataCache
+from .preprocess import MAPPING_COLUMNS, TIMESTAMP_COLUMN, clean_up_frame
+from .tag_cache import TagEntryCache
 
 sys.path.append(".")
 import argparse
@@ -23,40 +27,32 @@ if __name__ == '__main__':
 
     t0 = datetime(2023, 5, 8, 10, 0, 0, tzinfo=timezone.utc)
 
-    gateway_id = maio_client.get_gateway_id_from_name("Aruba")
+    # persisted so that reruns of the backfill skip the lookup
+    metadata = GatewayMetadataCache(path="build/gateway-cache.json")
+    gateway_id = metadata.gateway_id("https://engine.heineken.maio.io", "Aruba", maio_client.get_gateway_id_from_name)
     assert gateway_id is not None
 
+    # consecutive windows overlap by 196 minutes, only the new buckets are downloaded
+    cache = TagEntryCache("build/tag-cache",
+                          lambda g, t1, t2, tags: maio_client.get_tag_entries_for_gateway(g, t1, t2)[1][
+                              [TIMESTAMP_COLUMN] + tags])
+
+    # the resampled windows are kept for training; overlapping minutes are deduplicated on read
+    lake = SensorDataLake("build/datalake")
+
     # every 15 minutes for 6 hours
     for dt_ in range(0, 60 * 24 * 3, 60):
         t2 = t0 + timedelta(minutes=dt_)
         t1 = t2 - timedelta(minutes=256)
 
-        _, df_maio = maio_client.get_tag_entries_for_gateway(gateway_id, t1, t2)
-
-        mapping_columns = {"CoolerTemp": "cooler_temp", "BathTemp": "bath_temp", "CoolerSwitch": "cooler_switch",
-                           "RefridgentTemp": "refridgent_temp", "CompressorCurrent": "compressor_current",
-                           "timestamps": "timestamp"}
-
-        df_maio_small = df_maio[mapping_columns.keys()].rename(columns=mapping_columns)
-
-        df_maio_small['timestamp'] = pd.to_datetime(df_maio_small['timestamp'])
-        df_maio_small = df_maio_small.set_index('timestamp')
+        df_maio = cache.get(gateway_id, t1, t2, list(MAPPING_COLUMNS))
 
-        print(f"{df_maio_small.shape[0]} over 257")
+        print(f"{df_maio.shape[0]} over 257")
 
-        # Resample the dataframe to 1 minute
-        df_maio_small_resampled = df_maio_small.resample("1Min").mean()
-
-        # Fill missing values with the previous value
-        df_maio_small_resampled = df_maio_small_resampled.fillna(method="ffill")
-
-        df_maio_small_resampled.reset_index(inplace=True)
-
-        # # Reset the index
-        # df_maio_small_resampled.set_index(inplace=True)
-
-        # Drop the timestamp column
-        df_maio_small_resampled.drop(columns=['timestamp'], axis=1, inplace=True)
+        # Resample to 1 minute and fill missing values with the previous value
+        df_maio_small_resampled = clean_up_frame(df_maio, keep_timestamp=True)
+        lake.append("Aruba", df_maio_small_resampled)
+        df_maio_small_resampled = df_maio_small_resampled.drop(columns=['timestamp'])
 
         # Invoke the SM endpoint
         response = env.runtime_client().invoke_endpoint(
@@ -73,3 +69,5 @@ if __name__ == '__main__':
 
         print(
             f"time: {t2} - anomaly detected: {anom_score.ge(4.5).any()['anom_score']} - {anom_score.ge(4.5).sum()['anom_score']}")
+
+    lake.close()
@@ -0,0 +1,196 @@
+"""
+Content-addressed cache of prediction results.
+
+Dashboards, the scheduler and ad-hoc users often score the very same window with the
+very same model. Results are keyed by the model version and a hash of the preprocessed
+input (`content_key`), so such a window is only scored once whoever asks for it.
+Entries expire after `ttl` seconds and the least recently used ones are evicted beyond
+`max_entries`. Concurrent requests for a key that is being computed wait for that
+computation instead of starting their own (single flight).
+
+    cache = default_cache()
+    key = content_key(model_version, series)
+    prediction = cache.get_or_compute(key, lambda: model.get_anomaly_label(series))
+
+Lookups by result and the model time saved by hits are exported through `metrics`.
+The process-wide instance is configured by ``PREDICTION_CACHE_MAX_ENTRIES`` (0 disables
+it) and ``PREDICTION_CACHE_TTL_SECONDS``.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+try:
+    import metrics
+except ImportError:
+    from . import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_ENTRIES = 1024
+DEFAULT_TTL_SECONDS = 15 * 60
+
+LOOKUPS = metrics.counter(
+    "prediction_cache_lookups", "Prediction lookups by result: hit, coalesced or miss", ["cache", "result"])
+HIT_RATIO = metrics.gauge(
+    "prediction_cache_hit_ratio", "Share of lookups served without calling the model", ["cache"])
+SAVED_SECONDS = metrics.counter(
+    "prediction_cache_saved_seconds", "Model time saved by hits and coalesced lookups", ["cache"])
+ENTRIES = metrics.gauge(
+    "prediction_cache_entries", "Predictions currently cached", ["cache"])
+
+
+def _digest(part) -> bytes:
+    if isinstance(part, bytes):
+        return part
+    if isinstance(part, str):
+        return part.encode()
+    if hasattr(part, "to_pd"):
+        # Merlion TimeSeries
+        part = part.to_pd()
+    if hasattr(part, "columns") and hasattr(part, "index"):
+        import pandas as pd
+
+        frame = part.to_frame() if hasattr(part, "to_frame") else part
+        header = json.dumps([str(c) for c in frame.columns] + [str(t) for t in frame.dtypes]).encode()
+        return header + pd.util.hash_pandas_object(frame, index=True).values.tobytes()
+    return json.dumps(part, sort_keys=True, default=str).encode()
+
+
+def content_key(model_version, *parts) -> str:
+    """
+    Key of the prediction of `model_version` for an input made of `parts`: strings, bytes,
+    pandas frames or series, Merlion time series, or anything JSON serializable.
+    """
+    sha = hashlib.sha256(str(model_version).encode())
+    for part in parts:
+        sha.update(b"\0")
+        sha.update(_digest(part))
+    return f"{model_version}|{sha.hexdigest()}"
+
+
+class PredictionCache(object):
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES, ttl: float = DEFAULT_TTL_SECONDS,
+                 name: str = "default", clock=time.monotonic):
+        """
+        Args:
+            max_entries (int): predictions kept, least recently used ones are evicted beyond.
+            ttl (float): seconds a prediction is served before it is computed again.
+            name (str): label used for the exported metrics.
+            clock (callable): returns the current time in seconds, for tests.
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.name = name
+        self.clock = clock
+        self.hits = 0
+        self.coalesced = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+        self._entries = OrderedDict()
+        self._computing = {}
+        self._lock = threading.Lock()
+
+    def _record(self, result, saved=0.0):
+        # called with the lock held
+        if result == "hit":
+            self.hits += 1
+        elif result == "coalesced":
+            self.coalesced += 1
+        else:
+            self.misses += 1
+        self.saved_seconds += saved
+        LOOKUPS.inc(cache=self.name, result=result)
+        HIT_RATIO.set(self.hit_ratio(), cache=self.name)
+        if saved:
+            SAVED_SECONDS.inc(saved, cache=self.name)
+
+    def get_or_compute(self, key: str, compute):
+        """Return the prediction cached under `key`, calling ``compute()`` once when it is missing or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, seconds, expires = entry
+                if expires > self.clock():
+                    self._entries.move_to_end(key)
+                    self._record("hit", seconds)
+                    return value
+                del self._entries[key]
+            future = self._computing.get(key)
+            owner = future is None
+            if owner:
+                future = self._computing[key] = Future()
+                self._record("miss")
+
+        if not owner:
+            value, seconds = future.result()
+            with self._lock:
+                self._record("coalesced", seconds)
+            return value
+
+        try:
+            started = time.perf_counter()
+            value = compute()
+            seconds = time.perf_counter() - started
+        except BaseException as e:
+            # failures are not cached, the waiting requests fail with the same error
+            with self._lock:
+                self._computing.pop(key, None)
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            self._entries[key] = (value, seconds, self.clock() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._computing.pop(key, None)
+            ENTRIES.set(len(self._entries), cache=self.name)
+        future.set_result((value, seconds))
+        return value
+
+    def invalidate(self, model_version=None):
+        """Drop all cached predictions, or those of one model version."""
+        with self._lock:
+            for key in list(self._entries):
+                if model_version is None or key.rsplit("|", 1)[0] == str(model_version):
+                    del self._entries[key]
+            ENTRIES.set(len(self._entries), cache=self.name)
+
+    def hit_ratio(self) -> float:
+        lookups = self.hits + self.coalesced + self.misses
+        return (self.hits + self.coalesced) / lookups if lookups else 0.0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "coalesced": self.coalesced, "misses": self.misses,
+                    "entries": len(self._entries), "hit_ratio": round(self.hit_ratio(), 4),
+                    "saved_seconds": round(self.saved_seconds, 3)}
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def default_cache(name: str = "default"):
+    """
+    The process-wide cache, or None when PREDICTION_CACHE_MAX_ENTRIES is 0.
+    `name` labels its metrics and is only used by the first call.
+    """
+    global _default
+    with _default_lock:
+        if _default is None:
+            max_entries = int(os.environ.get("PREDICTION_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES))
+            if max_entries <= 0:
+                return None
+            _default = PredictionCache(
+                max_entries=max_entries,
+                ttl=float(os.environ.get("PREDICTION_CACHE_TTL_SECONDS", DEFAULT_TTL_SECONDS)),
+                name=name,
+            )
+        return _default
@@ -0,0 +1,93 @@
+"""
+Resampling of raw Maio gateway entries onto the one-minute grid the model expects.
+
+Replaces the select/rename -> to_datetime -> set_index -> resample("1Min").mean()
+-> ffill -> reset_index -> drop chain with NumPy: timestamps are binned onto a
+preallocated grid, and the per-bin mean and the forward fill are computed column by
+column straight into a float32 matrix. Only the final frame is built with pandas.
+"""
+import numpy as np
+import pandas as pd
+
+# Maio tag name -> model column
+MAPPING_COLUMNS = {"CoolerTemp": "cooler_temp", "BathTemp": "bath_temp", "CoolerSwitch": "cooler_switch",
+                   "RefridgentTemp": "refridgent_temp", "CompressorCurrent": "compressor_current"}
+TIMESTAMP_COLUMN = "timestamps"
+
+ONE_MINUTE_NS = 60 * 10 ** 9
+
+
+def column_name(tag: str) -> str:
+    """Model column of a Maio tag: its name in the default signature, the tag label for other tags."""
+    return MAPPING_COLUMNS.get(tag, tag)
+
+
+def resample_ffill(timestamps, columns, step_ns: int = ONE_MINUTE_NS):
+    """
+    Average `columns` per `step_ns` bin and forward fill the empty bins.
+
+    Args:
+        timestamps: array-like of datetime64 values, one per raw entry (any order).
+        columns: sequence of 1-d arrays aligned with `timestamps`; NaN marks a missing value.
+        step_ns (int): bin width in nanoseconds.
+
+    Returns:
+        (np.ndarray, np.ndarray): the ``datetime64[ns]`` bin starts, from the bin of the
+        earliest entry to the bin of the latest one, and the ``(n_bins, n_columns)``
+        float32 matrix of values. Bins before the first value of a column stay NaN.
+    """
+    ticks = np.asarray(timestamps, dtype="datetime64[ns]").view(np.int64)
+    if ticks.size == 0:
+        return np.empty(0, dtype="datetime64[ns]"), np.empty((0, len(columns)), dtype=np.float32)
+
+    bins = ticks // step_ns
+    first = bins.min()
+    n_bins = int(bins.max() - first) + 1
+    bins = bins - first
+
+    out = np.empty((n_bins, len(columns)), dtype=np.float32)
+    positions = np.arange(n_bins)
+    for j, column in enumerate(columns):
+        column = np.asarray(column, dtype=np.float64)
+        valid = ~np.isnan(column)
+        sums = np.bincount(bins, weights=np.where(valid, column, 0.0), minlength=n_bins)
+        counts = np.bincount(bins, weights=valid, minlength=n_bins)
+
+        # index of the last bin with a value at or before every bin
+        occupied = counts > 0
+        means = np.divide(sums, counts, out=np.full(n_bins, np.nan), where=occupied)
+        last = np.where(occupied, positions, -1)
+        np.maximum.accumulate(last, out=last)
+        out[:, j] = means[last]
+        out[last < 0, j] = np.nan
+
+    grid = ((first + positions) * step_ns).astype("datetime64[ns]")
+    return grid, out
+
+
+def clean_up_frame(df_maio: pd.DataFrame, keep_timestamp: bool = False, tags=None) -> pd.DataFrame:
+    """
+    Turn the wide tag-entry frame returned by `get_tag_entries_for_gateway` into the
+    one-minute model input, optionally keeping a leading ``timestamp`` column.
+
+    Args:
+        df_maio (pd.DataFrame): raw entries, a timestamp column and one column per tag label.
+        keep_timestamp (bool): keep the one-minute grid as a leading ``timestamp`` column.
+        tags (list): labels of the model's input tags, in signature order; the five default
+            tags when None. Columns are named by `column_name`.
+    """
+    tags = list(tags) if tags is not None else list(MAPPING_COLUMNS)
+    timestamps = df_maio[TIMESTAMP_COLUMN]
+    if not pd.api.types.is_datetime64_any_dtype(timestamps):
+        timestamps = pd.to_datetime(timestamps, cache=False)
+    if getattr(timestamps.dt, "tz", None) is not None:
+        timestamps = timestamps.dt.tz_convert("UTC").dt.tz_localize(None)
+    columns = [df_maio[tag] for tag in tags]
+    grid, values = resample_ffill(timestamps.to_numpy(), [
+        c.to_numpy() if pd.api.types.is_numeric_dtype(c) else pd.to_numeric(c, errors="coerce").to_numpy()
+        for c in columns])
+
+    df = pd.DataFrame(values, columns=[column_name(tag) for tag in tags], copy=False)
+    if keep_timestamp:
+        df.insert(0, "timestamp", grid)
+    return df
@@ -0,0 +1,229 @@
+"""
+Cost of the phases of a training run.
+
+    profile = TrainingProfile(profiler="sampling", output_dir=model_dir)
+    with profile.phase("load") as phase:
+        df = pd.read_csv(path)
+        phase["samples"] = len(df)
+    ...
+    profile.write(model_dir)
+
+Every phase records its wall and CPU time, the peak resident memory while it ran and,
+given the number of samples it processed, its throughput. With ``profiler="cprofile"``
+each phase is also run under cProfile, with ``profiler="sampling"`` the stack of the
+training thread is sampled every `interval` seconds instead, which costs little enough
+for long `model.train` calls. The profiles are written next to the report
+(``profile-<phase>.prof``, or ``profile-<phase>.folded`` stacks for flame graphs) and
+their top functions are included in it.
+
+The report is a JSON document, ``training-report.json`` by default, written into the
+model directory so that it ships with the model it describes.
+"""
+import cProfile
+import json
+import logging
+import os
+import platform
+import pstats
+import resource
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+PROFILERS = ("none", "cprofile", "sampling")
+REPORT_NAME = "training-report.json"
+TOP_FUNCTIONS = 20
+
+
+def _read_status_mib(field):
+    """A ``VmRSS`` / ``VmHWM`` line of /proc/self/status in MiB, None where there is no procfs."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def _reset_peak_rss():
+    """Reset the resident memory high-water mark of the process (Linux), returns whether it could."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss_mib():
+    peak = _read_status_mib("VmHWM")
+    if peak is None:
+        # kilobytes on Linux, bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+    return peak
+
+
+class StackSampler(object):
+    def __init__(self, interval: float = 0.01, thread_id: int = None):
+        """
+        Args:
+            interval (float): seconds between two samples.
+            thread_id (int): thread sampled, the calling one by default.
+        """
+        self.interval = interval
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def write(self, path):
+        """Collapsed stacks, one ``frame;frame;frame count`` line per stack, as read by flamegraph.pl or speedscope."""
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+    def top(self, n: int = TOP_FUNCTIONS):
+        """Functions by the share of samples they were running in, themselves or their callees."""
+        total = sum(self.stacks.values())
+        inclusive = Counter()
+        for stack, count in self.stacks.items():
+            for function in set(stack.split(";")):
+                inclusive[function] += count
+        return [{"function": function, "samples": count, "share": round(count / total, 4)}
+                for function, count in inclusive.most_common(n)]
+
+
+def _cprofile_top(profiler, n: int = TOP_FUNCTIONS):
+    stats = pstats.Stats(profiler)
+    rows = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:n]
+    return [{"function": f"{os.path.basename(file)}:{line}({name})", "calls": calls,
+             "own_seconds": round(own, 4), "cumulative_seconds": round(cumulative, 4)}
+            for (file, line, name), (_, calls, own, cumulative, _) in rows]
+
+
+class TrainingProfile(object):
+    def __init__(self, profiler: str = "none", output_dir: str = None, interval: float = 0.01):
+        """
+        Args:
+            profiler (str): "none", "cprofile" or "sampling".
+            output_dir (str): directory of the profile files, none are written when None.
+            interval (float): seconds between two samples of the sampling profiler.
+        """
+        if profiler not in PROFILERS:
+            raise ValueError(f"Unknown profiler {profiler}, expected one of {', '.join(PROFILERS)}")
+        self.profiler = profiler
+        self.output_dir = output_dir
+        self.interval = interval
+        self.phases = {}
+        self.context = {}
+        self.created_at = datetime.now(timezone.utc)
+        self._started = time.perf_counter()
+
+    @contextmanager
+    def phase(self, name: str, samples: int = None, epochs: int = None):
+        """
+        Measure the block as phase `name`. The yielded dict is part of the phase's entry in
+        the report; ``samples`` and ``epochs`` set there (or passed here) add its throughput.
+        """
+        entry = {"samples": samples, "epochs": epochs}
+        scoped_peak = _reset_peak_rss()
+        rss_before = _read_status_mib("VmRSS")
+        profiler = sampler = None
+        if self.profiler == "cprofile":
+            profiler = cProfile.Profile()
+            profiler.enable()
+        elif self.profiler == "sampling":
+            sampler = StackSampler(self.interval)
+            sampler.start()
+        started, cpu_started = time.perf_counter(), time.process_time()
+        try:
+            yield entry
+        finally:
+            seconds, cpu_seconds = time.perf_counter() - started, time.process_time() - cpu_started
+            if profiler is not None:
+                profiler.disable()
+            if sampler is not None:
+                sampler.stop()
+            rss_after = _read_status_mib("VmRSS")
+            entry.update(
+                seconds=round(seconds, 4),
+                cpu_seconds=round(cpu_seconds, 4),
+                peak_rss_mib=round(_peak_rss_mib(), 1),
+                # without a resettable high-water mark the peak is that of the whole run so far
+                peak_rss_scope="phase" if scoped_peak else "process",
+                rss_delta_mib=round(rss_after - rss_before, 1) if rss_before is not None else None,
+            )
+            self._throughput(entry)
+            if profiler is not None:
+                entry["profile"] = _cprofile_top(profiler)
+                if self.output_dir:
+                    entry["profile_file"] = self._profile_path(name, "prof")
+                    profiler.dump_stats(entry["profile_file"])
+            if sampler is not None:
+                entry["profile"] = sampler.top()
+                if self.output_dir:
+                    entry["profile_file"] = self._profile_path(name, "folded")
+                    sampler.write(entry["profile_file"])
+            self.phases[name] = {key: value for key, value in entry.items() if value is not None}
+            logger.info(f"Phase {name}: {seconds:.2f}s ({cpu_seconds:.2f}s CPU), "
+                        f"peak RSS {entry['peak_rss_mib']:.0f} MiB")
+
+    @staticmethod
+    def _throughput(entry):
+        samples, epochs, seconds = entry.get("samples"), entry.get("epochs"), entry["seconds"]
+        if not samples or not seconds:
+            return
+        entry["samples_per_second"] = round(samples * (epochs or 1) / seconds, 1)
+        if epochs:
+            entry["seconds_per_epoch"] = round(seconds / epochs, 4)
+
+    def _profile_path(self, name, extension):
+        os.makedirs(self.output_dir, exist_ok=True)
+        return os.path.join(self.output_dir, f"profile-{name}.{extension}")
+
+    def report(self) -> dict:
+        return {
+            "created_at": self.created_at.isoformat(),
+            "seconds": round(time.perf_counter() - self._started, 4),
+            "peak_rss_mib": round(max((p["peak_rss_mib"] for p in self.phases.values()), default=0), 1),
+            "profiler": self.profiler,
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            **self.context,
+            "phases": self.phases,
+        }
+
+    def write(self, directory: str, name: str = REPORT_NAME) -> str:
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, name)
+        with open(path, "w") as f:
+            # e.g. the types and enums of the model's parameters
+            json.dump(self.report(), f, indent=2, default=str)
+        logger.info(f"Training report written to {path}")
+        return path
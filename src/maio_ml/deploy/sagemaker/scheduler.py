@@ -84,6 +84,8 @@ if __name__ == "__main__":
     parser.add_argument("--disabled", type=str, help="Use to disable cloudwatch event.")
     parser.add_argument("--name", type=str, help="rule name.")
     parser.add_argument("--interval", type=int, help="schedule interval in seconds.")
+    parser.add_argument("--gateways", type=str,
+                        help="comma separated gateways scored by every invocation, instead of one rule per gateway.")
 
     args = parser.parse_args()
 
@@ -95,6 +97,11 @@ if __name__ == "__main__":
         "end_time": "2023-05-08T11:00:00.000000Z"
     }
 
+    if args.gateways:
+        # one fan-out invocation scores all gateways and resumes what the previous one left pending
+        payload["gateways"] = args.gateways.split(",")
+        payload["resume"] = True
+
     if args.enabled:
         update_rule('ENABLED', args.name)
 
@@ -0,0 +1,126 @@
+"""
+Window-level scoring for Merlion's LSTMED detector.
+
+Reproduces `LSTMED._get_anomaly_score` on plain numpy arrays so that the windows of
+several requests (or several chunks of one long history) can go through the network
+in a single forward pass and be split back afterwards.
+"""
+import numpy as np
+import pandas as pd
+import torch
+from merlion.utils.time_series import TimeSeries, UnivariateTimeSeries
+
+
+def sequence_length(model):
+    return model.sequence_length
+
+
+def normalize(model, time_series: TimeSeries) -> pd.DataFrame:
+    """Apply the model's pre-processing transform (identity + mean/var normalization)."""
+    return model.transform(time_series).to_pd()
+
+
+def sliding_windows(values: np.ndarray, length: int) -> np.ndarray:
+    """Return the ``(n - length + 1, length, dim)`` rolling windows of ``values``."""
+    if len(values) < length:
+        raise ValueError(f"Need at least {length} points to score, got {len(values)}")
+    windows = np.lib.stride_tricks.sliding_window_view(values, length, axis=0)
+    return np.ascontiguousarray(windows.transpose(0, 2, 1), dtype=np.float32)
+
+
+def window_scores(model, windows: np.ndarray, max_windows: int = None) -> np.ndarray:
+    """
+    Run the encoder-decoder over ``windows`` and return the per-step reconstruction
+    error, averaged over features, with shape ``(n_windows, length)``.
+
+    Args:
+        model: a trained Merlion LSTMED model.
+        windows: float32 array shaped ``(n_windows, length, dim)``.
+        max_windows: split the forward pass into chunks of at most this many windows.
+    """
+    n_windows = len(windows)
+    if n_windows == 0:
+        return np.empty((0, sequence_length(model)), dtype=np.float32)
+    step = max_windows or n_windows
+    network = model.lstmed
+    network.eval()
+    scores = []
+    with torch.no_grad():
+        for start in range(0, n_windows, step):
+            batch = torch.from_numpy(windows[start:start + step]).to(model.device)
+            output = network(batch)
+            scores.append(torch.abs(output - batch).mean(dim=2).cpu().numpy())
+    return np.concatenate(scores)
+
+
+def accumulate(scores: np.ndarray, n_points: int, total: np.ndarray = None, count: np.ndarray = None):
+    """
+    Add window scores onto the points they cover. Window ``i`` covers points
+    ``i .. i + length - 1``; returns the running ``(total, count)`` per point.
+    """
+    n_windows, length = scores.shape
+    if total is None:
+        total = np.zeros(n_points, dtype=np.float64)
+        count = np.zeros(n_points, dtype=np.float64)
+    for step in range(length):
+        total[step:step + n_windows] += scores[:, step]
+        count[step:step + n_windows] += 1
+    return total, count
+
+
+def lattice_mean(scores: np.ndarray, n_points: int) -> np.ndarray:
+    """Average the window scores of every point, as LSTMED's score lattice does."""
+    total, count = accumulate(scores, n_points)
+    return total / count
+
+
+def to_score_series(scores: np.ndarray, index: pd.Index) -> TimeSeries:
+    frame = pd.DataFrame(scores, index=index)
+    return UnivariateTimeSeries.from_pd(frame, name="anom_score").to_ts()
+
+
+def calibrate(model, scores: TimeSeries) -> TimeSeries:
+    """Apply only the (pointwise) calibrator part of the model's post rule."""
+    config = model.config
+    if getattr(config, "enable_calibrator", False) and getattr(config, "calibrator", None) is not None:
+        return config.calibrator(scores)
+    return scores
+
+
+def threshold(model, scores: TimeSeries) -> TimeSeries:
+    """Apply only the alarm threshold part of the model's post rule to calibrated scores."""
+    config = model.config
+    if getattr(config, "enable_threshold", False) and getattr(config, "threshold", None) is not None:
+        return config.threshold(scores)
+    return scores
+
+
+def anomaly_labels(model, series: list, max_windows: int = None) -> list:
+    """
+    Score several time series with one forward pass through the network.
+
+    Returns one entry per input: the post-processed anomaly label `TimeSeries`, or the
+    exception raised while preparing that input so the caller can report it per request.
+    """
+    length = sequence_length(model)
+    frames, windows, results = [], [], []
+    for time_series in series:
+        try:
+            frame = normalize(model, time_series)
+            windows.append(sliding_windows(frame.values, length))
+            frames.append(frame)
+            results.append(None)
+        except Exception as e:
+            results.append(e)
+
+    if windows:
+        counts = np.cumsum([len(w) for w in windows])[:-1]
+        parts = np.split(window_scores(model, np.concatenate(windows), max_windows), counts)
+        prepared = iter(zip(frames, parts))
+        for i, result in enumerate(results):
+            if result is not None:
+                continue
+            frame, part = next(prepared)
+            scores = to_score_series(lattice_mean(part, len(frame)), frame.index)
+            results[i] = model.post_rule(scores) if model.post_rule is not None else scores
+    return results
@@ -4,7 +4,8 @@ import json
 import logging
 import os
 import sys
-from collections import OrderedDict
+import threading
+from collections import OrderedDict, namedtuple
 from enum import Enum
 
 import pandas as pd
@@ -21,10 +22,48 @@ from sagemaker_inference import (
     errors,
 )
 
+import metrics
+import scoring
+from batcher import InferenceBatcher
+from model_manager import ModelManager
+from prediction_cache import content_key, default_cache
+from profiling import PROFILERS, TrainingProfile
+from streaming import StreamingScorer
+
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 logger.addHandler(logging.StreamHandler(sys.stdout))
 
+# Micro-batching of concurrent predict_fn calls, disabled when the max batch size is 1.
+BATCH_MAX_SIZE = int(os.environ.get("INFERENCE_BATCH_MAX_SIZE", "1"))
+BATCH_MAX_WAIT_MS = float(os.environ.get("INFERENCE_BATCH_MAX_WAIT_MS", "5"))
+
+_batchers = {}
+_batchers_lock = threading.Lock()
+
+# The model server exposes no metrics endpoint: the batcher, model cache and prediction
+# cache metrics of every worker are logged every METRICS_LOG_INTERVAL_SECONDS, 0 disables it.
+METRICS_LOG_INTERVAL_SECONDS = float(os.environ.get("METRICS_LOG_INTERVAL_SECONDS", "60"))
+_metrics_log = None
+
+# Incremental scorers keyed by model, holding the per-gateway context.
+_scorers = {}
+
+# Upper bound on the artifact bytes of the models kept loaded by the ModelManager.
+MODEL_CACHE_MAX_BYTES = int(os.environ.get("MODEL_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))
+
+# Predictions keyed by model version and input window, see PREDICTION_CACHE_MAX_ENTRIES
+# and PREDICTION_CACHE_TTL_SECONDS; None when disabled.
+prediction_cache = default_cache("endpoint")
+
+# Content type of frames sent as an Arrow IPC stream instead of split JSON.
+ARROW_STREAM = "application/vnd.apache.arrow.stream"
+
+# Parsed request: the series to score, which model should score it (None for the default)
+# and, for incremental scoring, the gateway whose stream the points extend.
+ScoringRequest = namedtuple("ScoringRequest", ["series", "model_id", "model_version", "gateway", "provisional"],
+                            defaults=(None, None, None, False))
+
 
 def is_enum(t):
     return isinstance(t, type) and issubclass(t, Enum)
@@ -67,10 +106,6 @@ def train(args):
     if use_cuda:
         torch.cuda.manual_seed(args.seed)
 
-    logger.debug(f"Loading data from {args.data_dir}/data.csv")
-
-    df = pd.read_csv(f"{args.data_dir}/data.csv", index_col=0, parse_dates=True)
-
     label_column = ["label"]
     columns = [
         "cooler_temp",
@@ -79,12 +114,34 @@ def train(args):
         "refridgent_temp",
         "compressor_current",
     ]
+
+    # timings, peak memory and optionally profiles of every phase, written next to the model
+    profile = TrainingProfile(args.profile, args.model_dir, args.profile_interval_ms / 1000)
+
+    with profile.phase("load") as phase:
+        if args.lake_dir:
+            # the resampled frames the scoring path stored, read for one gateway, time range and tag set;
+            # imported here as pyarrow is not a dependency of the serving container
+            from datalake import SensorDataLake
+
+            logger.debug(f"Loading {args.lake_gateway} from the data lake {args.lake_dir}")
+            df = SensorDataLake(args.lake_dir).read_gateway(args.lake_gateway, args.lake_start, args.lake_end,
+                                                            columns)
+            if df.empty:
+                raise ValueError(f"No rows of {args.lake_gateway} between {args.lake_start} and {args.lake_end} "
+                                 f"in the data lake {args.lake_dir}")
+            label_column = None
+        else:
+            logger.debug(f"Loading data from {args.data_dir}/data.csv")
+            df = pd.read_csv(f"{args.data_dir}/data.csv", index_col=0, parse_dates=True)
+        phase["samples"] = len(df)
     train_percentage = 70
 
-    n = int(int(train_percentage) * len(df) / 100)
+    with profile.phase("split", samples=len(df)):
+        n = int(int(train_percentage) * len(df) / 100)
 
-    train_df = df.iloc[:n]
-    test_df = df.iloc[n:]
+        train_df = df.iloc[:n]
+        test_df = df.iloc[n:]
 
     logger.debug(f"Loading algorithm: {args.algorithm}")
 
@@ -107,10 +164,6 @@ def train(args):
             value = value.name if isinstance(value, Enum) else value
             param_info[name] = {"type": param.annotation, "default": value}
 
-    logger.debug(param_info)
-
-    logger.debug(init_method)
-
     model = model_class(model_class.config_class())
     model = ModelFactory.create(
         args.algorithm,
@@ -122,58 +175,76 @@ def train(args):
         ),
     )
 
-    train_ts, train_labels = TimeSeries.from_pd(train_df[columns]), None
-    test_ts, test_labels = TimeSeries.from_pd(test_df[columns]), None
-
-    logger.debug(train_ts)
+    with profile.phase("from_pd", samples=len(df)):
+        train_ts, train_labels = TimeSeries.from_pd(train_df[columns]), None
+        test_ts, test_labels = TimeSeries.from_pd(test_df[columns]), None
 
-    if label_column is not None and label_column != "":
-        train_labels = TimeSeries.from_pd(train_df[label_column])
-        test_labels = TimeSeries.from_pd(test_df[label_column])
+        if label_column is not None and label_column != "":
+            train_labels = TimeSeries.from_pd(train_df[label_column])
+            test_labels = TimeSeries.from_pd(test_df[label_column])
 
     logger.debug(f"Training dataset size: {len(train_df)}")
     logger.debug(f"Test dataset size: {len(test_df)}")
 
-    scores = model.train(train_data=train_ts)
+    # the epochs of the models trained by gradient descent, e.g. LSTMED
+    epochs = getattr(model.config, "num_epochs", None)
+    with profile.phase("train", samples=len(train_df), epochs=epochs):
+        scores = model.train(train_data=train_ts)
 
-    logger.debug(f"Scores: {scores}")
+    logger.debug(f"Scores: {scores.dim} series of {len(scores.time_stamps)} points")
     logger.debug(f"Post Rules: {model.post_rule}")
 
-    train_pred = model.post_rule(scores) if model.post_rule else scores
-
-    train_metrics = {}
-    if train_labels is not None:
-        for metric in [
-            TSADMetric.Precision,
-            TSADMetric.Recall,
-            TSADMetric.F1,
-            TSADMetric.MeanTimeToDetect,
-        ]:
-            m = metric.value(ground_truth=test_labels, predict=train_pred)
-            train_metrics[metric.name] = (
-                round(m, 5) if metric.name != "MeanTimeToDetect" else str(m)
-            )
+    with profile.phase("post_rule", samples=len(train_df)):
+        train_pred = model.post_rule(scores) if model.post_rule else scores
+
+    with profile.phase("train_metrics", samples=len(train_df)):
+        train_metrics = {}
+        if train_labels is not None:
+            for metric in [
+                TSADMetric.Precision,
+                TSADMetric.Recall,
+                TSADMetric.F1,
+                TSADMetric.MeanTimeToDetect,
+            ]:
+                m = metric.value(ground_truth=test_labels, predict=train_pred)
+                train_metrics[metric.name] = (
+                    round(m, 5) if metric.name != "MeanTimeToDetect" else str(m)
+                )
 
     logger.debug(f"Train Metrics: {train_metrics}")
 
-    test_pred = model.get_anomaly_label(test_ts)
-
-    test_metrics = {}
-    if test_labels is not None:
-        for metric in [
-            TSADMetric.Precision,
-            TSADMetric.Recall,
-            TSADMetric.F1,
-            TSADMetric.MeanTimeToDetect,
-        ]:
-            m = metric.value(ground_truth=test_labels, predict=test_pred)
-            test_metrics[metric.name] = (
-                round(m, 5) if metric.name != "MeanTimeToDetect" else str(m)
-            )
+    with profile.phase("test_predict", samples=len(test_df)):
+        test_pred = model.get_anomaly_label(test_ts)
+
+    with profile.phase("test_metrics", samples=len(test_df)):
+        test_metrics = {}
+        if test_labels is not None:
+            for metric in [
+                TSADMetric.Precision,
+                TSADMetric.Recall,
+                TSADMetric.F1,
+                TSADMetric.MeanTimeToDetect,
+            ]:
+                m = metric.value(ground_truth=test_labels, predict=test_pred)
+                test_metrics[metric.name] = (
+                    round(m, 5) if metric.name != "MeanTimeToDetect" else str(m)
+                )
 
     logger.debug(f"Test Metrics: {test_metrics}")
 
-    save_model(model, args.model_dir)
+    with profile.phase("save"):
+        save_model(model, args.model_dir)
+
+    profile.context.update(
+        algorithm=args.algorithm,
+        parameters=model.config.to_dict(),
+        columns=columns,
+        train_samples=len(train_df),
+        test_samples=len(test_df),
+        train_metrics=train_metrics,
+        test_metrics=test_metrics,
+    )
+    profile.write(args.model_dir)
 
 
 def test(model, test_loader, device):
@@ -206,20 +277,18 @@ def test(model, test_loader, device):
 
 def model_fn(model_dir):
     """
-    Load the PyTorch model from the `model_dir` directory.
+    Create the ModelManager serving the artifacts under the `model_dir` directory.
+    The default `model.pth` is loaded eagerly, per-gateway models on first use.
     Args:
-        model_dir (str): path to the directory containing the saved PyTorch model.
+        model_dir (str): path to the directory containing the saved PyTorch model(s).
     """
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    # model = torch.nn.DataParallel(Net())
-    # with open(os.path.join(model_dir, "model.pth"), "rb") as f:
-    #     model.load_state_dict(torch.load(f))
-
-    algorithm = "LSTMED"
-    logger.info(f"Loading algorithm: {algorithm} from {model_dir}")
-    model = ModelFactory.load(algorithm, model_dir+"/model.pth")
-
-    return model
+    global _metrics_log
+    if METRICS_LOG_INTERVAL_SECONDS > 0 and _metrics_log is None:
+        _metrics_log = metrics.log_periodically(METRICS_LOG_INTERVAL_SECONDS, logger)
+    manager = ModelManager(model_dir, max_bytes=MODEL_CACHE_MAX_BYTES, on_evict=release_batcher)
+    if os.path.exists(os.path.join(model_dir, "model.pth")):
+        manager.get()
+    return manager
 
 # From docs:
 # Default json deserialization requires request_body contain a single json list.
@@ -235,23 +304,94 @@ def input_fn(request_body, request_content_type):
         _type_: _description_
     """
     logger.info(f"input_f (request body): {type(request_body)}")
+    if request_content_type == ARROW_STREAM:
+        # binary frame, optionally routed by the model_id / model_version of its schema metadata
+        import pyarrow as pa
+
+        table = pa.ipc.open_stream(pa.py_buffer(request_body)).read_all()
+        routing = {k.decode(): v.decode() for k, v in (table.schema.metadata or {}).items()}
+        df = table.to_pandas()
+        logger.info(f"Dataframe shape: {df.shape}")
+        return ScoringRequest(TimeSeries.from_pd(df), routing.get("model_id"), routing.get("model_version"))
     # data = json.loads(request_body)
     # model_input = [{"text": features[0]} for features in data]
-    df = pd.read_json(request_body, orient='split')
+    body = json.loads(request_body)
+    envelope = {}
+    if "data" in body and isinstance(body["data"], dict):
+        # {"model_id": ..., "model_version": ..., "gateway": ..., "provisional": ..., "data": <split frame>}
+        envelope, body = body, body["data"]
+    df = pd.DataFrame(body["data"], columns=body["columns"], index=body.get("index"))
+    if envelope.get("gateway") is not None:
+        # incremental requests carry their timestamps so already scored points can be skipped
+        df = df.set_index(pd.to_datetime(df.pop("timestamp")))
     logger.info(f"Dataframe shape: {df.shape}\n{df.head()}")
     model_input = TimeSeries.from_pd(df)
     # logger.info(f"Model input: {model_input}")
-    return model_input
+    return ScoringRequest(model_input, envelope.get("model_id"), envelope.get("model_version"),
+                          envelope.get("gateway"), bool(envelope.get("provisional", False)))
+
+def get_batcher(model):
+    """Return the batcher collecting concurrent requests for `model`, creating it on first use."""
+    with _batchers_lock:
+        batcher = _batchers.get(id(model))
+        if batcher is None:
+            batcher = InferenceBatcher(
+                lambda series: scoring.anomaly_labels(model, series),
+                max_batch_size=BATCH_MAX_SIZE,
+                max_wait_ms=BATCH_MAX_WAIT_MS,
+                name=type(model).__name__,
+            )
+            _batchers[id(model)] = batcher
+        return batcher
+
+
+def get_streaming_scorer(model):
+    with _batchers_lock:
+        scorer = _scorers.get(id(model))
+        if scorer is None:
+            scorer = _scorers[id(model)] = StreamingScorer(model)
+        return scorer
+
+
+def release_batcher(model):
+    with _batchers_lock:
+        batcher = _batchers.pop(id(model), None)
+        _scorers.pop(id(model), None)
+    if batcher is not None:
+        batcher.close()
+
+
+def anomaly_label(model, series):
+    if BATCH_MAX_SIZE > 1:
+        return get_batcher(model).submit(series)
+    return model.get_anomaly_label(series)
+
 
 def predict_fn(input_data, model):
     logger.info(f"Calling predict on model with input data\n {type(input_data)}")
+    request = input_data if isinstance(input_data, ScoringRequest) else ScoringRequest(input_data)
+    input_data = request.series
+    model_version = f"{type(model).__name__}@{id(model)}"
+    if isinstance(model, ModelManager):
+        # the version tells a model retrained in place apart from the one it replaced
+        model, model_version = model.lookup(request.model_id, request.model_version)
     logger.info(f"Model type: {type(model)}")
-    prediction = model.get_anomaly_label(input_data)
+    if request.gateway is not None:
+        # incremental scores depend on the gateway's stream state and are never cached
+        prediction = get_streaming_scorer(model).update(request.gateway, input_data.to_pd(), request.provisional)
+    elif prediction_cache is not None:
+        prediction = prediction_cache.get_or_compute(content_key(model_version, input_data),
+                                                     lambda: anomaly_label(model, input_data))
+    else:
+        prediction = anomaly_label(model, input_data)
     # experiment_id='latest', inputs=input_data)
     logger.info(f"Prediction: {type(prediction)}")
     return prediction
 
 def output_fn(prediction, content_type):
+    if isinstance(prediction, pd.DataFrame):
+        # incremental scores keep their timestamps
+        return encoder.encode(prediction.to_json(orient='split', date_format='iso'), content_type)
     logger.info(f"Prediction: {type(prediction.to_pd())}")
     serie = prediction.to_pd()
     res = serie.to_json(orient='split', index=False) # [{"probabilities": result["probabilities"], "top_n_grams": result["top_n_grams"]} for result in prediction]
@@ -306,4 +446,17 @@ if __name__ == "__main__":
     )
     parser.add_argument("--num-gpus", type=int, default=os.environ["SM_NUM_GPUS"])
 
-    train(parser.parse_args())
+    # train on the partitioned data lake instead of data.csv
+    parser.add_argument("--lake-dir", type=str, default=os.environ.get("SM_CHANNEL_LAKE"))
+    parser.add_argument("--lake-gateway", type=str)
+    parser.add_argument("--lake-start", type=str)
+    parser.add_argument("--lake-end", type=str)
+
+    # per-phase profiles in the training report, see profiling.py
+    parser.add_argument("--profile", type=str, choices=PROFILERS, default=os.environ.get("TRAINING_PROFILE", "none"))
+    parser.add_argument("--profile-interval-ms", type=float, default=10)
+
+    args = parser.parse_args()
+    if args.lake_dir and not args.lake_gateway:
+        parser.error("--lake-gateway is required when training on the data lake (--lake-dir or SM_CHANNEL_LAKE)")
+    train(args)
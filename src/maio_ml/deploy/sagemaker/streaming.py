@@ -0,0 +1,175 @@
+"""
+Incremental LSTMED scoring per gateway.
+
+The scheduled scoring sends overlapping windows, so most of every request has been
+scored before. `StreamingScorer` keeps, per gateway, the last ``sequence_length - 1``
+normalized points together with the partial window sums of the points that are still
+covered by future windows. Each update only runs the windows that contain new points.
+
+A point's score is final once every window covering it has been seen, i.e.
+``sequence_length - 1`` points later; final scores are identical to scoring the full
+history in one go. The trailing points can optionally be returned as provisional
+scores, which equal what a full-window score of the data seen so far would give.
+Scores go through the model's post rule like `get_anomaly_label`'s: the calibrator,
+then the alarm threshold, which sees the gateway's preceding final scores so that
+alarm windows and suppression span updates.
+
+The context is only valid for the minute right after it. When the first new point of
+an update does not follow the last one seen (a data gap, a restart, or windows served
+by another instance meanwhile), the gateway starts over from that update.
+"""
+import logging
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+from merlion.utils.time_series import TimeSeries
+
+import metrics
+import scoring
+
+logger = logging.getLogger(__name__)
+
+NEW_POINTS = metrics.counter(
+    "streaming_scorer_new_points", "Points scored incrementally")
+SKIPPED_POINTS = metrics.counter(
+    "streaming_scorer_skipped_points", "Points dropped because they were already scored")
+RESETS = metrics.counter(
+    "streaming_scorer_resets", "Gateway streams restarted because an update did not follow the previous one")
+
+
+class GatewayState(object):
+    def __init__(self, dim):
+        self.values = np.empty((0, dim), dtype=np.float32)
+        self.index = pd.DatetimeIndex([])
+        self.total = np.empty(0, dtype=np.float64)
+        self.count = np.empty(0, dtype=np.float64)
+        self.last_timestamp = None
+        # calibrated final scores of the last alarm window, the threshold's context
+        self.recent = pd.Series(dtype=float, index=pd.DatetimeIndex([]))
+        self.lock = threading.Lock()
+
+    def clear(self):
+        self.values = self.values[:0]
+        self.index = self.index[:0]
+        self.total = self.total[:0]
+        self.count = self.count[:0]
+        self.last_timestamp = None
+        self.recent = self.recent[:0]
+
+
+class StreamingScorer(object):
+    def __init__(self, model, max_gateways: int = 10000, step: pd.Timedelta = pd.Timedelta(minutes=1)):
+        """
+        Args:
+            model: the trained LSTMED model.
+            max_gateways (int): gateways whose state is kept, the least recently updated are dropped.
+            step (pd.Timedelta): spacing of the points, consecutive updates must continue it.
+        """
+        self.model = model
+        self.length = scoring.sequence_length(model)
+        self.max_gateways = max_gateways
+        self.step = step
+        threshold = getattr(getattr(model, "config", None), "threshold", None)
+        self.alarm_context = pd.Timedelta(minutes=getattr(threshold, "alm_window_minutes", 60)
+                                          + getattr(threshold, "alm_suppress_minutes", 0))
+        self._states = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _state(self, gateway, dim):
+        with self._lock:
+            state = self._states.get(gateway)
+            if state is None:
+                state = self._states[gateway] = GatewayState(dim)
+                while len(self._states) > self.max_gateways:
+                    evicted, _ = self._states.popitem(last=False)
+                    logger.info(f"Dropped streaming state of gateway {evicted}")
+            self._states.move_to_end(gateway)
+            return state
+
+    def reset(self, gateway=None):
+        with self._lock:
+            if gateway is None:
+                self._states.clear()
+            else:
+                self._states.pop(gateway, None)
+
+    def update(self, gateway, frame: pd.DataFrame, include_provisional: bool = False) -> pd.DataFrame:
+        """
+        Score the points of `frame` that are newer than anything seen for `gateway`.
+
+        Args:
+            gateway: key of the stream, e.g. the gateway name.
+            frame (pd.DataFrame): model input columns indexed by timestamp. Points at or
+                before the last timestamp already seen for the gateway are ignored.
+            include_provisional (bool): also return the trailing, not yet final, points.
+
+        Returns:
+            pd.DataFrame: post-processed ``anom_score`` and a boolean ``final`` column, indexed by timestamp.
+        """
+        frame = frame.sort_index()
+        state = self._state(gateway, frame.shape[1])
+        with state.lock:
+            if state.last_timestamp is not None:
+                fresh = frame.index > state.last_timestamp
+                SKIPPED_POINTS.inc(int((~fresh).sum()))
+                frame = frame[fresh]
+                if len(frame) and frame.index[0] != state.last_timestamp + self.step:
+                    logger.info(f"Gateway {gateway} resumes at {frame.index[0]} after {state.last_timestamp}, "
+                                f"restarting its stream")
+                    RESETS.inc()
+                    state.clear()
+            result = self._empty()
+            if len(frame):
+                result = self._advance(state, frame)
+                NEW_POINTS.inc(len(frame))
+            if include_provisional and len(state.total):
+                provisional = pd.DataFrame(
+                    {"anom_score": state.total / np.maximum(state.count, 1), "final": False}, index=state.index)
+                provisional = provisional[state.count > 0]
+                provisional["anom_score"] = self._post_process(state, provisional["anom_score"], keep=False)
+                result = pd.concat([result, provisional])
+            return result
+
+    def _advance(self, state, frame):
+        """Append `frame` to the gateway context and return the points that became final."""
+        normalized = scoring.normalize(self.model, TimeSeries.from_pd(frame)).values.astype(np.float32)
+        values = np.concatenate([state.values, normalized])
+        index = state.index.append(frame.index)
+        total = np.concatenate([state.total, np.zeros(len(frame))])
+        count = np.concatenate([state.count, np.zeros(len(frame))])
+
+        n_windows = max(len(values) - self.length + 1, 0)
+        final = self._empty()
+        if n_windows:
+            # every window over the context contains at least one new point
+            windows = scoring.sliding_windows(values, self.length)
+            scoring.accumulate(scoring.window_scores(self.model, windows), len(values), total, count)
+            final = pd.DataFrame({"anom_score": total[:n_windows] / count[:n_windows], "final": True},
+                                 index=index[:n_windows])
+            final["anom_score"] = self._post_process(state, final["anom_score"])
+
+        state.values = values[n_windows:]
+        state.index = index[n_windows:]
+        state.total = total[n_windows:]
+        state.count = count[n_windows:]
+        state.last_timestamp = frame.index[-1]
+        return final
+
+    def _post_process(self, state, scores: pd.Series, keep: bool = True) -> np.ndarray:
+        """Calibrate and threshold `scores`, after the gateway's recent final scores; `keep` adds them to those."""
+        if not len(scores):
+            return scores.values
+        series = scoring.to_score_series(scores.values, scores.index)
+        calibrated = scoring.calibrate(self.model, series).to_pd().iloc[:, 0]
+        history = pd.concat([state.recent, calibrated]) if len(state.recent) else calibrated
+        alarms = scoring.threshold(self.model, scoring.to_score_series(history.values, history.index))
+        if keep:
+            state.recent = history[history.index > history.index[-1] - self.alarm_context]
+        return alarms.to_pd().values[-len(scores):, 0]
+
+    @staticmethod
+    def _empty():
+        return pd.DataFrame({"anom_score": pd.Series(dtype=float), "final": pd.Series(dtype=bool)},
+                            index=pd.DatetimeIndex([]))
@@ -0,0 +1,245 @@
+"""
+Read-through disk cache of raw Maio tag entries.
+
+Entries are stored per (gateway, tag, time bucket) as small columnar `.npz` files
+(int64 timestamps + float64 values) next to a manifest listing the tags fetched for
+the bucket:
+
+    <root>/<gateway>/<bucket start, epoch seconds>/manifest.json
+    <root>/<gateway>/<bucket start, epoch seconds>/<tag>.npz
+
+A request only fetches the buckets that are missing (adjacent ones in a single call)
+and stitches the result back into the wide frame returned by
+`get_tag_entries_for_gateway`. Buckets that end less than `open_grace` before now
+may still receive entries, so they are always refetched and never persisted.
+The cache is kept under `max_bytes` by dropping the least recently read buckets. Their
+sizes and order of use are kept in memory (seeded from the directory when the cache is
+created), so a miss does not walk the whole directory. Bucket writes and evictions are
+serialized by a lock; reads are not, and a bucket evicted while it is read counts as a miss.
+"""
+import json
+import logging
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from urllib.parse import quote
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+TIMESTAMP_COLUMN = "timestamps"
+MANIFEST = "manifest.json"
+
+
+def _utc(value) -> pd.Timestamp:
+    ts = pd.Timestamp(value)
+    return ts.tz_localize("UTC") if ts.tzinfo is None else ts.tz_convert("UTC")
+
+
+def _file_size(path) -> int:
+    # temporary files of concurrent writers may be renamed away while sizes are summed
+    try:
+        return os.path.getsize(path)
+    except FileNotFoundError:
+        return 0
+
+
+class TagEntryCache(object):
+    def __init__(self, root: str, fetch, bucket: timedelta = timedelta(hours=1),
+                 max_bytes: int = 512 * 1024 ** 2, open_grace: timedelta = timedelta(minutes=5), clock=None):
+        """
+        Args:
+            root (str): cache directory.
+            fetch (callable): ``fetch(gateway_id, start, end, tags)`` returning the wide entries frame
+                with a ``timestamps`` column and one column per tag. `tags` is None for all tags.
+            bucket (timedelta): width of a cached time bucket.
+            max_bytes (int): size bound of the cache directory.
+            open_grace (timedelta): buckets ending after ``now - open_grace`` are considered open.
+            clock (callable): returns the current time, for tests.
+        """
+        self.root = root
+        self.fetch = fetch
+        self.bucket_ns = int(bucket.total_seconds()) * 10 ** 9
+        self.max_bytes = max_bytes
+        self.open_grace = open_grace
+        self.clock = clock or (lambda: datetime.now(timezone.utc))
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        self._buckets, self._size = self._scan()
+
+    def _bucket_dir(self, gateway_id, bucket_start):
+        return os.path.join(self.root, quote(str(gateway_id), safe=""), str(bucket_start // 10 ** 9))
+
+    def _bucket_starts(self, start, end):
+        first = start.value // self.bucket_ns * self.bucket_ns
+        return list(range(first, end.value + 1, self.bucket_ns))
+
+    def _is_open(self, bucket_start):
+        return bucket_start + self.bucket_ns > (_utc(self.clock()) - self.open_grace).value
+
+    def _manifest(self, path):
+        try:
+            with open(os.path.join(path, MANIFEST)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _dir_size(path) -> int:
+        try:
+            return sum(_file_size(os.path.join(path, name)) for name in os.listdir(path))
+        except FileNotFoundError:
+            return 0
+
+    def _scan(self):
+        """Sizes of the buckets on disk, least recently read first, and their total."""
+        found = []
+        for gateway in os.listdir(self.root):
+            try:
+                bucket_names = os.listdir(os.path.join(self.root, gateway))
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+            for bucket in bucket_names:
+                path = os.path.join(self.root, gateway, bucket)
+                try:
+                    last_used = os.path.getmtime(os.path.join(path, MANIFEST))
+                except FileNotFoundError:
+                    last_used = 0
+                found.append((last_used, path, self._dir_size(path)))
+        buckets = OrderedDict((path, size) for _, path, size in sorted(found))
+        return buckets, sum(buckets.values())
+
+    def get(self, gateway_id, start, end, tags=None) -> pd.DataFrame:
+        """Return the entries of `gateway_id` in ``[start, end]`` for `tags` (all tags when None)."""
+        start, end = _utc(start), _utc(end)
+        buckets = self._bucket_starts(start, end)
+        cached = {}
+        for bucket_start in buckets:
+            parts = None if self._is_open(bucket_start) else self._read(gateway_id, bucket_start, tags)
+            if parts is not None:
+                cached[bucket_start] = parts
+        missing = [b for b in buckets if b not in cached]
+        self.hits += len(cached)
+        self.misses += len(missing)
+
+        for run_start, run_end in self._runs(missing):
+            frame = self.fetch(gateway_id, pd.Timestamp(run_start, tz="UTC").to_pydatetime(),
+                               pd.Timestamp(run_end, tz="UTC").to_pydatetime(), tags)
+            for bucket_start, parts in self._split(frame, run_start, run_end).items():
+                cached[bucket_start] = parts
+                if not self._is_open(bucket_start):
+                    self._write(gateway_id, bucket_start, parts, tags)
+
+        series = {}
+        for bucket_start in buckets:
+            for tag, (timestamps, values) in cached[bucket_start].items():
+                series.setdefault(tag, []).append((timestamps, values))
+
+        if missing:
+            self._evict()
+        return self._stitch(series, start, end, tags)
+
+    def _runs(self, buckets):
+        """Group sorted bucket starts into contiguous ``[start, end)`` ranges."""
+        runs = []
+        for b in buckets:
+            if runs and runs[-1][1] == b:
+                runs[-1][1] = b + self.bucket_ns
+            else:
+                runs.append([b, b + self.bucket_ns])
+        return runs
+
+    def _split(self, frame, run_start, run_end):
+        """Split a wide entries frame into ``{bucket: {tag: (timestamps, values)}}``."""
+        timestamps = pd.to_datetime(frame[TIMESTAMP_COLUMN], utc=True).to_numpy(dtype="datetime64[ns]").view(np.int64)
+        order = np.argsort(timestamps, kind="stable")
+        timestamps = timestamps[order]
+        starts = list(range(run_start, run_end, self.bucket_ns))
+        bounds = np.searchsorted(timestamps, starts + [run_end])
+
+        result = {b: {} for b in starts}
+        for tag in frame.columns:
+            if tag == TIMESTAMP_COLUMN:
+                continue
+            values = pd.to_numeric(frame[tag], errors="coerce").to_numpy(dtype=np.float64)[order]
+            for bucket_start, lo, hi in zip(starts, bounds[:-1], bounds[1:]):
+                present = ~np.isnan(values[lo:hi])
+                result[bucket_start][tag] = (timestamps[lo:hi][present], values[lo:hi][present])
+        return result
+
+    def _write(self, gateway_id, bucket_start, parts, tags):
+        path = self._bucket_dir(gateway_id, bucket_start)
+        with self._lock:
+            self._write_bucket(path, parts, tags)
+            size = self._dir_size(path)
+            self._size += size - self._buckets.pop(path, 0)
+            self._buckets[path] = size
+
+    def _write_bucket(self, path, parts, tags):
+        os.makedirs(path, exist_ok=True)
+        manifest = self._manifest(path) or {"tags": [], "all_tags": False}
+        for tag in (tags if tags is not None else []):
+            parts.setdefault(tag, (np.empty(0, dtype=np.int64), np.empty(0)))
+        # written under unique names and renamed, as concurrent fetches may fill the same bucket
+        suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+        for tag, (timestamps, values) in parts.items():
+            target = os.path.join(path, quote(tag, safe="") + ".npz")
+            with open(target + suffix, "wb") as f:
+                np.savez(f, timestamps=timestamps, values=values)
+            os.replace(target + suffix, target)
+        manifest["tags"] = sorted(set(manifest["tags"]) | set(parts))
+        manifest["all_tags"] = manifest["all_tags"] or tags is None
+        tmp = os.path.join(path, MANIFEST + suffix)
+        with open(tmp, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp, os.path.join(path, MANIFEST))
+
+    def _read(self, gateway_id, bucket_start, tags):
+        """The cached entries of a bucket, or None when it lacks some of `tags` or is evicted meanwhile."""
+        path = self._bucket_dir(gateway_id, bucket_start)
+        manifest = self._manifest(path)
+        if manifest is None or not (manifest["all_tags"] if tags is None else set(tags) <= set(manifest["tags"])):
+            return None
+        parts = {}
+        try:
+            for tag in (tags if tags is not None else manifest["tags"]):
+                with np.load(os.path.join(path, quote(tag, safe="") + ".npz")) as data:
+                    parts[tag] = (data["timestamps"], data["values"])
+            # the order of use survives restarts through the manifest's mtime
+            os.utime(os.path.join(path, MANIFEST))
+        except (OSError, ValueError):
+            return None
+        with self._lock:
+            if path in self._buckets:
+                self._buckets.move_to_end(path)
+        return parts
+
+    @staticmethod
+    def _stitch(series, start, end, tags):
+        columns = {}
+        for tag, chunks in series.items():
+            timestamps = np.concatenate([c[0] for c in chunks])
+            values = np.concatenate([c[1] for c in chunks])
+            keep = (timestamps >= start.value) & (timestamps <= end.value)
+            columns[tag] = pd.Series(values[keep], index=pd.DatetimeIndex(timestamps[keep].view("datetime64[ns]")))
+        for tag in (tags or []):
+            columns.setdefault(tag, pd.Series(dtype=np.float64, index=pd.DatetimeIndex([])))
+        if not columns:
+            return pd.DataFrame({TIMESTAMP_COLUMN: pd.DatetimeIndex([])})
+        frame = pd.concat(columns, axis=1).sort_index()
+        frame.index.name = TIMESTAMP_COLUMN
+        return frame.reset_index()
+
+    def _evict(self):
+        with self._lock:
+            while self._size > self.max_bytes and self._buckets:
+                path, size = self._buckets.popitem(last=False)
+                shutil.rmtree(path, ignore_errors=True)
+                self._size -= size
+                logger.info(f"Evicted cached bucket {path}")
@@ -0,0 +1,8 @@
+import os
+import sys
+
+SRC = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# the apps import `maio_ml...`, the SageMaker modules import their siblings directly as in their bundles
+sys.path.insert(0, SRC)
+sys.path.insert(0, os.path.join(SRC, "maio_ml", "deploy", "sagemaker"))
@@ -0,0 +1,31 @@
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("httpx")
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+
+from maio_ml.deploy.fastapi.admin import require_admin
+
+app = FastAPI()
+
+
+@app.post("/admin/reload", dependencies=[Depends(require_admin)])
+async def _reload():
+    return {}
+
+
+def test_admin_endpoints_need_the_token_when_one_is_set(monkeypatch):
+    monkeypatch.setenv("ADMIN_TOKEN", "secret")
+    client = TestClient(app, client=("127.0.0.1", 50000))
+
+    assert client.post("/admin/reload").status_code == 403
+    assert client.post("/admin/reload", headers={"X-Admin-Token": "guess"}).status_code == 403
+    assert client.post("/admin/reload", headers={"X-Admin-Token": "secret"}).status_code == 200
+
+
+def test_admin_endpoints_only_answer_local_callers_without_a_token(monkeypatch):
+    monkeypatch.delenv("ADMIN_TOKEN", raising=False)
+
+    assert TestClient(app, client=("10.0.0.7", 50000)).post("/admin/reload").status_code == 403
+    assert TestClient(app, client=("127.0.0.1", 50000)).post("/admin/reload").status_code == 200
@@ -0,0 +1,41 @@
+import io
+from datetime import timedelta
+
+import pandas as pd
+import pytest
+
+from backfill import Backfill, read_results, windows
+
+
+class FakeIngestor(object):
+    def fetch(self, gateway, start, end):
+        return pd.DataFrame({"BathTemp": [1.0, 2.0]})
+
+
+class FakeRuntime(object):
+    def __init__(self):
+        self.invoked = 0
+
+    def invoke_endpoint(self, **kwargs):
+        self.invoked += 1
+        return {"Body": io.BytesIO(b'{"columns": ["anom_score"], "data": [[1.0], [5.0]]}')}
+
+
+def test_resume_skips_written_windows_and_refuses_other_settings(tmp_path):
+    start, end = pd.Timestamp("2023-05-08T00:00", tz="UTC"), pd.Timestamp("2023-05-08T02:00", tz="UTC")
+    hourly = windows(["Aruba"], start, end, timedelta(hours=1), timedelta(hours=1))
+    runtime = FakeRuntime()
+
+    first = Backfill(FakeIngestor(), runtime, "anomaly", str(tmp_path), workers=2).run(hourly)
+    again = Backfill(FakeIngestor(), runtime, "anomaly", str(tmp_path), workers=2).run(hourly)
+    # another window length scores other windows
+    longer = windows(["Aruba"], start, end, timedelta(hours=1), timedelta(hours=2))
+    Backfill(FakeIngestor(), runtime, "anomaly", str(tmp_path), workers=2).run(longer)
+
+    assert (first["scored"], again["scored"], again["skipped"]) == (3, 0, 3)
+    assert runtime.invoked == 6
+    assert len(read_results(str(tmp_path))) == 6
+    with pytest.raises(ValueError):
+        Backfill(FakeIngestor(), runtime, "anomaly-v2", str(tmp_path)).run(hourly)
+    with pytest.raises(ValueError):
+        Backfill(FakeIngestor(), runtime, "anomaly", str(tmp_path), threshold=3.0).run(hourly)
@@ -0,0 +1,21 @@
+import types
+
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+
+pytest.importorskip("merlion")
+import batch_transform
+
+
+def test_history_shorter_than_a_window_is_skipped(tmp_path, monkeypatch):
+    monkeypatch.setattr(batch_transform, "load_artifact", lambda path: types.SimpleNamespace(sequence_length=10))
+    history = pd.DataFrame({"timestamp": pd.date_range("2023-01-01", periods=9, freq="1min"),
+                            **{column: [0.0] * 9 for column in batch_transform.COLUMNS}})
+    history.to_parquet(tmp_path / "history.parquet", index=False)
+    output = str(tmp_path / "scores.parquet")
+
+    result = batch_transform.run(str(tmp_path / "history.parquet"), "model.pth", output, workers=1, chunk_rows=100)
+
+    assert result["rows"] == 0 and "9 rows" in result["skipped"]
+    assert pq.read_table(output).num_rows == 0
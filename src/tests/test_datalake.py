@@ -0,0 +1,31 @@
+import numpy as np
+import pandas as pd
+
+from datalake import SensorDataLake
+
+
+def test_compaction_merges_parts_with_different_columns(tmp_path):
+    lake = SensorDataLake(str(tmp_path), compact_after=0)
+    timestamps = pd.date_range("2023-05-01", periods=10, freq="1min")
+    lake.append("Aruba", pd.DataFrame({"timestamp": timestamps, "bath_temp": np.arange(10.0)}))
+    lake.append("Aruba", pd.DataFrame({"timestamp": timestamps[5:], "bath_temp": np.arange(5.0) + 100,
+                                       "cooler_temp": 1.0}))
+
+    lake.compact()
+
+    partition = next(tmp_path.glob("gateway=Aruba/date=*"))
+    assert len(list(partition.glob("*.parquet"))) == 1
+    df = lake.read_gateway("Aruba")
+    assert df["bath_temp"].tolist() == [0.0, 1.0, 2.0, 3.0, 4.0, 100.0, 101.0, 102.0, 103.0, 104.0]
+    assert df["cooler_temp"].isna().sum() == 5
+    lake.close()
+
+
+def test_read_of_an_empty_lake_returns_an_empty_frame(tmp_path):
+    lake = SensorDataLake(str(tmp_path), compact_after=0)
+
+    df = lake.read_gateway("Aruba", "2023-05-01", "2023-05-02", ["bath_temp"])
+
+    assert df.empty
+    assert list(df.columns) == ["bath_temp"]
+    lake.close()
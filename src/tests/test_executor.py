@@ -0,0 +1,65 @@
+import asyncio
+import os
+
+import pytest
+
+pytest.importorskip("merlion")
+from maio_ml.deploy.fastapi import tracing
+from maio_ml.deploy.fastapi.executor import InferenceExecutor
+from maio_ml.deploy.fastapi.model_store import ModelStore
+
+# the store of a spawned process worker
+store = None
+
+
+def read(path):
+    return open(path).read()
+
+
+def load_store(path):
+    global store
+    store = ModelStore(path, loader=read, warmup=None)
+    store.load()
+
+
+def served_version():
+    return store.current()[1]
+
+
+def traced(rows):
+    with tracing.phase("preprocess"):
+        tracing.set_model_version("model.pth@7")
+    return rows
+
+
+def test_process_workers_serve_the_model_swapped_in_after_they_started(tmp_path):
+    artifact = tmp_path / "model.pth"
+    artifact.write_text("v1")
+    models = ModelStore(str(artifact), loader=read, warmup=None)
+    executor = InferenceExecutor(max_workers=1, kind="process", name="test",
+                                 initializer=load_store, initargs=(str(artifact),))
+    models.on_swap(lambda model, version: executor.restart())
+    try:
+        first = models.load()
+        assert asyncio.run(executor.run(served_version)) == first
+
+        artifact.write_text("version 2")
+        os.utime(artifact, ns=(0, os.stat(artifact).st_mtime_ns + 10 ** 9))
+        second = models.load()
+        assert second != first
+        assert asyncio.run(executor.run(served_version)) == second
+    finally:
+        executor.shutdown()
+
+
+def test_process_workers_report_the_phases_and_model_version_of_a_call():
+    executor = InferenceExecutor(max_workers=1, kind="process", name="test")
+    try:
+        with tracing.collecting() as trace:
+            tracing.set_model_version("latest")
+            assert asyncio.run(executor.run(traced, 3)) == 3
+    finally:
+        executor.shutdown()
+
+    assert trace["model_version"] == "model.pth@7"
+    assert set(trace["phases"]) == {"queue", "preprocess", "inference"}
@@ -0,0 +1,113 @@
+import io
+import threading
+
+import pandas as pd
+import pytest
+
+pytest.importorskip("boto3")
+import lambda_func
+import preprocess
+from prediction_cache import PredictionCache
+
+
+def test_jobs_running_at_the_deadline_are_collected_not_rescored(monkeypatch):
+    release = threading.Event()
+    calls = []
+
+    def score_gateway(base_url, token, job):
+        calls.append(job['gateway_name'])
+        if job['gateway_name'] == 'slow':
+            release.wait(5)
+        return {'anomaly_detected': 'False', 'count': 0}, {}, 1
+
+    monkeypatch.setattr(lambda_func, 'score_gateway', score_gateway)
+    monkeypatch.setattr(lambda_func, 'FAN_OUT_BUDGET_SECONDS', 0.2)
+    monkeypatch.setattr(lambda_func, '_in_flight', {})
+    defaults = dict(endpoint='anomaly', start_time=None, end_time=None, input_tags=['BathTemp'],
+                    incremental=False, model_id=None, model_version=None)
+
+    first = lambda_func.fan_out('url', 'token', {'gateways': ['fast', 'slow']}, defaults, None)
+    assert [r['gateway'] for r in first['results']] == ['fast']
+    assert [job['gateway_name'] for job in first['in_flight']] == ['slow']
+    assert first['pending'] == []
+
+    release.set()
+    second = lambda_func.fan_out('url', 'token', {'gateways': first['in_flight']}, defaults, None)
+    assert [r['gateway'] for r in second['results']] == ['slow']
+    assert calls == ['fast', 'slow']
+
+
+def test_ingestors_of_rotated_tokens_are_closed(monkeypatch):
+    monkeypatch.setattr(lambda_func, 'MAX_INGESTORS', 2)
+    monkeypatch.setattr(lambda_func, '_ingestors', lambda_func.OrderedDict())
+
+    first = lambda_func.get_ingestor('url', 'token-1')
+    second = lambda_func.get_ingestor('url', 'token-2')
+    assert lambda_func.get_ingestor('url', 'token-1') is first
+    lambda_func.get_ingestor('url', 'token-3')
+
+    assert [key[1] for key in lambda_func._ingestors] == ['token-1', 'token-3']
+    with pytest.raises(RuntimeError):
+        second._executor.submit(print)
+
+
+def test_comma_separated_gateways_and_checkpointed_jobs_are_queued_once(monkeypatch):
+    calls = []
+
+    def score_gateway(base_url, token, job):
+        calls.append(job['gateway_name'])
+        return {'anomaly_detected': 'False', 'count': 0}, {}, 1
+
+    defaults = dict(gateway_name='Aruba', endpoint='anomaly', start_time=None, end_time=None,
+                    input_tags=['BathTemp'], incremental=False, model_id=None, model_version=None)
+    checkpointed = dict(defaults, gateway_name='Curacao')
+    keys = []
+
+    def load_checkpoint(key):
+        keys.append(key)
+        return [checkpointed]
+
+    monkeypatch.setattr(lambda_func, 'score_gateway', score_gateway)
+    monkeypatch.setattr(lambda_func, 'load_checkpoint', load_checkpoint)
+    monkeypatch.setattr(lambda_func, '_in_flight', {})
+
+    result = lambda_func.fan_out('url', 'token', {'gateways': 'Aruba,Curacao', 'concurrency': 1},
+                                 defaults, None)
+
+    assert calls == ['Curacao', 'Aruba']
+    assert [r['gateway'] for r in result['results']] == ['Curacao', 'Aruba']
+    assert keys == [lambda_func.checkpoint_key({'gateways': ['Aruba', 'Curacao']}, defaults)]
+    assert keys[0] != lambda_func.checkpoint_key({'gateways': ['Bonaire']}, defaults)
+
+
+def test_cached_predictions_are_keyed_by_the_endpoint_deployment(monkeypatch):
+    deployments = ['config-1']
+    described, invoked = [], []
+
+    class Client(object):
+        def describe_endpoint(self, EndpointName):
+            described.append(EndpointName)
+            return {'EndpointConfigName': deployments[-1], 'LastModifiedTime': '2023-05-21'}
+
+        def invoke_endpoint(self, **kwargs):
+            invoked.append(kwargs['EndpointName'])
+            return {'Body': io.BytesIO(b'{"columns": ["anom_score"], "data": [[0.0]]}')}
+
+    frame = pd.DataFrame({'timestamp': ['2023-05-08T10:00:00'], 'BathTemp': [1.0]})
+    monkeypatch.setattr(lambda_func, '_runtime_client', Client())
+    monkeypatch.setattr(lambda_func, '_sagemaker_client', Client())
+    monkeypatch.setattr(lambda_func, '_endpoint_identities', {})
+    monkeypatch.setattr(lambda_func, 'ENDPOINT_IDENTITY_TTL_SECONDS', 0)
+    monkeypatch.setattr(lambda_func, '_prediction_cache', PredictionCache(max_entries=8, ttl=60))
+    monkeypatch.setattr(lambda_func, 'fetch_data_from_maio', lambda *args: frame)
+    monkeypatch.setattr(preprocess, 'clean_up_frame', lambda df, **kwargs: df)
+    job = dict(gateway_name='Aruba', endpoint='anomaly', start_time=None, end_time=None, input_tags=['BathTemp'],
+               incremental=False, model_id=None, model_version=None)
+
+    lambda_func.score_gateway('url', 'token', job)
+    lambda_func.score_gateway('url', 'token', job)
+    deployments.append('config-2')
+    lambda_func.score_gateway('url', 'token', job)
+
+    assert described == ['anomaly'] * 3
+    assert invoked == ['anomaly', 'anomaly']
@@ -0,0 +1,18 @@
+from gateway_cache import GatewayMetadataCache
+
+URL = "https://engine.example.maio.io"
+
+
+def test_invalidate_gateway_drops_its_id_and_tag_catalog():
+    cache = GatewayMetadataCache()
+    catalogs = iter([[{"label": "BathTemp", "id": 1}], [{"label": "BathTemp", "id": 1}, {"label": "Flow", "id": 2}]])
+    gateway_id = cache.gateway_id(URL, "Aruba", lambda name: "g-1")
+    assert cache.tag_catalog(URL, gateway_id, lambda _: next(catalogs)) == {"BathTemp": 1}
+    cache.tag_catalog(URL, cache.gateway_id(URL, "Curacao", lambda name: "g-2"), lambda _: [])
+
+    cache.invalidate_gateway(URL, "Aruba")
+
+    assert cache.gateway_id(URL, "Aruba", lambda name: "g-1b") == "g-1b"
+    assert cache.tag_catalog(URL, "g-1", lambda _: next(catalogs)) == {"BathTemp": 1, "Flow": 2}
+    # other gateways stay cached
+    assert cache.gateway_id(URL, "Curacao", lambda name: None) == "g-2"
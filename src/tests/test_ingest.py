@@ -0,0 +1,76 @@
+import threading
+from datetime import datetime, timedelta, timezone
+
+from benchmarks.fake_maio import MODEL_TAGS, FakeMaioClient, FakeMaioServer
+from gateway_cache import GatewayMetadataCache
+import ingest
+from ingest import MaioIngestor
+
+END = datetime(2023, 5, 8, 10, 0, 0, tzinfo=timezone.utc)
+START = END - timedelta(minutes=30)
+
+
+def tracking_factory(clients):
+    """Client factory recording every client with the threads that used it."""
+    def factory(base_url, token):
+        client = FakeMaioClient(base_url, token)
+        threads = clients[client] = set()
+        fetch = client.get_tag_entries_for_gateway
+
+        def get_tag_entries_for_gateway(*args):
+            threads.add(threading.get_ident())
+            return fetch(*args)
+
+        client.get_tag_entries_for_gateway = get_tag_entries_for_gateway
+        return client
+    return factory
+
+
+def test_fetch_many_caps_requests_in_flight_and_reuses_one_client_per_thread(monkeypatch):
+    clients, handed_off = {}, []
+
+    def clean_up_frame(df_maio, keep_timestamp=False, tags=None):
+        handed_off.append((list(df_maio.columns), keep_timestamp, tags))
+        return df_maio
+
+    monkeypatch.setattr(ingest, "clean_up_frame", clean_up_frame)
+    requests = [(f"gateway-{i}", START, END) for i in range(12)]
+
+    with FakeMaioServer(latency=0.05) as server:
+        with MaioIngestor(server.url, None, client_factory=tracking_factory(clients), max_concurrency=3,
+                          metadata=GatewayMetadataCache()) as ingestor:
+            frames = ingestor.fetch_many_sync(requests, keep_timestamp=True)
+
+    assert server.stats["max_in_flight"] == 3
+    assert not any(isinstance(frame, Exception) for frame in frames)
+    assert len(clients) <= 3
+    assert all(len(threads) == 1 for threads in clients.values())
+    # only the model's tags, in order, reach the resampling
+    assert handed_off == [(["timestamps"] + MODEL_TAGS, True, MODEL_TAGS)] * len(requests)
+
+
+def test_failed_requests_are_retried_with_exponential_backoff(monkeypatch):
+    delays = []
+    monkeypatch.setattr(ingest.random, "random", lambda: 0.5)
+
+    with FakeMaioServer(faults=2) as server:
+        with MaioIngestor(server.url, None, client_factory=FakeMaioClient, retries=2, backoff=0.01,
+                          metadata=GatewayMetadataCache()) as ingestor:
+            delay = ingestor._delay
+
+            def recorded_delay(attempt):
+                delays.append(delay(attempt))
+                return delays[-1]
+
+            monkeypatch.setattr(ingestor, "_delay", recorded_delay)
+            [frame] = ingestor.fetch_many_sync([("Aruba", START, END)])
+
+        assert len(frame) == 30
+        assert delays == [0.01, 0.02]
+
+        server.faults = 2
+        with MaioIngestor(server.url, None, client_factory=FakeMaioClient, retries=1, backoff=0.01,
+                          metadata=GatewayMetadataCache()) as ingestor:
+            [error] = ingestor.fetch_many_sync([("Aruba", START, END)])
+
+        assert isinstance(error, RuntimeError)
@@ -0,0 +1,15 @@
+from maio_ml.deploy.fastapi.jobs import JobQueue
+
+
+def test_only_the_dispatching_process_recovers_and_runs_jobs(tmp_path):
+    db = str(tmp_path / "jobs.sqlite3")
+    dispatcher = JobQueue(db, workers=0)
+    job_id = dispatcher.submit("maio_ml.deploy.sagemaker.serve:train", {})
+    # claimed by the dispatcher, its process not started yet
+    assert dispatcher._claim()["id"] == job_id
+
+    JobQueue(db, dispatch=False).start()
+    assert dispatcher.get(job_id)["status"] == "running"
+
+    dispatcher.start()
+    assert dispatcher.get(job_id)["status"] == "queued"
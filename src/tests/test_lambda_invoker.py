@@ -0,0 +1,69 @@
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("botocore.session")
+from benchmarks.stub_lambda import StubLambdaServer
+from maio_ml.deploy.aws_utils import lambda_invoker
+from maio_ml.deploy.aws_utils.lambda_invoker import LambdaInvoker
+
+PAYLOADS = [{"gateway_name": f"gateway-{i}", "token": "token", "base_url": "https://maio"} for i in range(6)]
+
+
+def test_invoke_async_returns_before_the_function_ran():
+    finished = threading.Event()
+
+    def handler(event):
+        time.sleep(0.3)
+        finished.set()
+
+    with StubLambdaServer(handler=handler) as server:
+        invoker = LambdaInvoker("score", endpoint_url=server.url)
+        started = time.perf_counter()
+        invoker.invoke_async({"gateway_name": "Aruba"})
+
+        assert time.perf_counter() - started < 0.3
+        assert finished.wait(5)
+        invoker.close()
+
+
+def test_invoke_many_batches_gateways_into_fan_out_events():
+    events = []
+
+    def handler(event):
+        events.append(event)
+        return {"results": [{"gateway": g["gateway_name"]} for g in event["gateways"]], "pending": []}
+
+    with StubLambdaServer(handler=handler) as server:
+        invoker = LambdaInvoker("score", endpoint_url=server.url)
+        results = invoker.invoke_many(PAYLOADS, batch_size=4)
+        invoker.close()
+
+    assert [len(result["results"]) for result in results] == [4, 2]
+    assert all(event["token"] == "token" and event["base_url"] == "https://maio" for event in events)
+    assert [g["gateway_name"] for event in events for g in event["gateways"]] == [p["gateway_name"]
+                                                                                  for p in PAYLOADS]
+
+
+def test_invoke_many_caps_invocations_in_flight():
+    with StubLambdaServer(invoke_latency=0.05, gateway_latency=0) as server:
+        invoker = LambdaInvoker("score", max_concurrency=2, endpoint_url=server.url)
+        results = invoker.invoke_many(PAYLOADS)
+        invoker.close()
+
+    assert len(results) == len(PAYLOADS)
+    assert server.stats["invocations"] == len(PAYLOADS)
+    assert server.stats["peak_running"] == 2
+
+
+def test_close_invokers_closes_the_shared_invokers(monkeypatch):
+    monkeypatch.setattr(lambda_invoker, "_invokers", {})
+    monkeypatch.setenv("LAMBDA_ENDPOINT_URL", "http://127.0.0.1:9")
+    invoker = lambda_invoker.get_invoker("score")
+
+    lambda_invoker.close_invokers()
+
+    assert lambda_invoker._invokers == {}
+    with pytest.raises(RuntimeError):
+        invoker._pool.submit(print)
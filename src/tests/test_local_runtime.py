@@ -0,0 +1,51 @@
+import importlib
+import json
+import os
+import shutil
+
+import pytest
+
+pytest.importorskip("sagemaker")
+from deploy_env import DeployEnv
+
+SRC = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class StandInHandlers(object):
+    """The four script.py handlers, answering with the number of rows of every request."""
+
+    def __init__(self):
+        self.model_dirs = []
+
+    def model_fn(self, model_dir):
+        self.model_dirs.append(model_dir)
+        return "stand-in"
+
+    def input_fn(self, request_body, request_content_type):
+        return json.loads(request_body)
+
+    def predict_fn(self, input_data, model):
+        return {"model": model, "rows": len(input_data["data"])}
+
+    def output_fn(self, prediction, accept):
+        return json.dumps(prediction)
+
+
+def test_deploy_inprocess_and_invoke_through_the_runtime_client(tmp_path, monkeypatch):
+    # deploy.py configures logging from the working directory on import
+    monkeypatch.chdir(tmp_path)
+    shutil.copy(os.path.join(SRC, "logging.json"), "logging.json")
+    os.makedirs("logs")
+    monkeypatch.setenv("DEPLOY_ENV", "inprocess")
+    deploy = importlib.import_module("deploy")
+    handlers = StandInHandlers()
+    env = DeployEnv(handlers=handlers)
+
+    deploy.deploy(env, "maio_ml/deploy/sagemaker")
+    response = env.runtime_client().invoke_endpoint(EndpointName=env.setting("model_name"),
+                                                    ContentType="application/json", Accept="application/json",
+                                                    Body=json.dumps({"columns": ["BathTemp"], "data": [[1.0], [2.0]]}))
+
+    assert json.loads(response["Body"].read()) == {"model": "stand-in", "rows": 2}
+    assert handlers.model_dirs == ["build/"]
+    assert env.isDeployed()
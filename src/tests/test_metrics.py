@@ -0,0 +1,48 @@
+import json
+import logging
+import time
+
+import metrics
+from metrics import Registry, log_periodically, counter
+
+
+def test_counter_family_and_samples_share_the_total_name():
+    registry = Registry()
+    registry.counter("lookups", "Cache lookups", ["result"]).inc(result="hit")
+    registry.counter("requests_total", "Requests").inc(2)
+
+    lines = registry.render().splitlines()
+
+    assert lines[:3] == ["# HELP lookups_total Cache lookups", "# TYPE lookups_total counter",
+                         'lookups_total{result="hit"} 1']
+    assert lines[3:] == ["# HELP requests_total Requests", "# TYPE requests_total counter", "requests_total 2"]
+
+
+def test_log_periodically_logs_the_rendered_metrics(caplog):
+    counter("test_metrics_logged", "Logged by the test").inc()
+    with caplog.at_level(logging.INFO, logger="test_metrics"):
+        stop = log_periodically(0.01, logging.getLogger("test_metrics"), prefix="test_metrics_")
+        time.sleep(0.1)
+        stop.set()
+    assert "test_metrics_logged_total 1" in caplog.text
+    assert "inference_" not in caplog.text
+
+
+def test_scrape_renders_the_metrics_of_every_worker_sharing_the_directory(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, "_shared", None)
+    other = Registry()
+    other.counter("test_shared_requests", "Requests").inc(3)
+    other.histogram("test_shared_seconds", "Latency", buckets=(1.0,)).observe(0.5)
+    (tmp_path / "1.json").write_text(json.dumps(other.snapshot()))
+
+    counter("test_shared_requests", "Requests").inc()
+    stop = metrics.share(str(tmp_path), 0, interval=60)
+    try:
+        lines = metrics.scrape(prefix="test_shared_").splitlines()
+    finally:
+        stop.set()
+
+    assert lines.count("# TYPE test_shared_requests_total counter") == 1
+    assert 'test_shared_requests_total{worker="0"} 1' in lines
+    assert 'test_shared_requests_total{worker="1"} 3' in lines
+    assert 'test_shared_seconds_bucket{worker="1",le="1"} 1' in lines
@@ -0,0 +1,25 @@
+import os
+
+import pytest
+
+pytest.importorskip("merlion")
+from model_manager import ModelManager
+
+
+def test_artifact_replaced_in_place_is_reloaded_under_a_new_version(tmp_path):
+    artifact = tmp_path / "model.pth"
+    artifact.write_text("v1")
+    evicted = []
+    manager = ModelManager(str(tmp_path), loader=lambda path: open(path).read(), on_evict=evicted.append)
+
+    model, version = manager.lookup()
+    assert (model, manager.lookup()) == ("v1", ("v1", version))
+
+    artifact.write_text("v2")
+    os.utime(artifact, ns=(0, os.stat(artifact).st_mtime_ns + 10 ** 9))
+    model, new_version = manager.lookup()
+
+    assert model == "v2" and new_version != version
+    assert evicted == ["v1"]
+    assert manager.loaded() == ["default"]
+    assert manager.get() == "v2"
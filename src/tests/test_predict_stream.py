@@ -0,0 +1,22 @@
+import json
+
+import pytest
+
+
+def test_predict_streams_ndjson(monkeypatch):
+    main = pytest.importorskip("main")
+    from fastapi.testclient import TestClient
+
+    monkeypatch.setattr(main, "predict_cached", lambda experiment_id, inputs: [float(len(inputs))] * len(inputs))
+    response = TestClient(main.app).post("/predict?stream=ndjson&chunk_rows=2", json={
+        "experiment_id": "latest",
+        "inputs": [[{"a": 1}, {"a": 2}, {"a": 3}], [{"a": 4}]],
+    })
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    assert [json.loads(line) for line in response.text.splitlines()] == [
+        {"series": 0, "offset": 0, "prediction": [3.0, 3.0]},
+        {"series": 0, "offset": 2, "prediction": [3.0]},
+        {"series": 1, "offset": 0, "prediction": [1.0]},
+    ]
@@ -0,0 +1,18 @@
+import pytest
+
+pytest.importorskip("merlion")
+from maio_ml.deploy.fastapi.model_store import ModelStore
+from maio_ml.deploy.fastapi.prefork import preload
+
+
+def test_a_failed_preload_leaves_the_model_to_the_workers(tmp_path):
+    artifact = tmp_path / "model.pth"
+    store = ModelStore(str(artifact), loader=lambda path: open(path).read(), warmup=None)
+
+    assert not preload(store)
+    assert store.current() == (None, None)
+
+    # a worker forked from the parent loads the artifact once it is there
+    artifact.write_text("model")
+    store.start()
+    assert store.current()[0] == "model"
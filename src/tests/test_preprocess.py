@@ -0,0 +1,17 @@
+import numpy as np
+import pandas as pd
+
+from preprocess import clean_up_frame
+
+
+def test_clean_up_frame_follows_the_requested_tags():
+    df_maio = pd.DataFrame({
+        "timestamps": pd.to_datetime(["2023-05-01 10:00:10", "2023-05-01 10:00:40", "2023-05-01 10:02:05"]),
+        "BathTemp": [4.0, 6.0, 8.0],
+        "Flow": [1.0, np.nan, 3.0],
+    })
+
+    df = clean_up_frame(df_maio, tags=["Flow", "BathTemp"])
+
+    assert list(df.columns) == ["Flow", "bath_temp"]
+    assert df.to_numpy().tolist() == [[1.0, 5.0], [1.0, 5.0], [3.0, 8.0]]
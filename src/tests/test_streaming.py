@@ -0,0 +1,48 @@
+import types
+
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("merlion")
+
+import scoring
+import streaming
+
+
+@pytest.fixture
+def scorer(monkeypatch):
+    # a stand-in for the network: the score of every step is the mean of its features
+    monkeypatch.setattr(scoring, "normalize", lambda model, time_series: time_series.to_pd())
+    monkeypatch.setattr(scoring, "window_scores", lambda model, windows, max_windows=None: windows.mean(axis=2))
+    monkeypatch.setattr(scoring, "calibrate", lambda model, scores: scores)
+    monkeypatch.setattr(scoring, "threshold", lambda model, scores: scores)
+    model = types.SimpleNamespace(sequence_length=4)
+    return lambda: streaming.StreamingScorer(model)
+
+
+def minutes(start, n, offset=0.0):
+    index = pd.date_range(start, periods=n, freq="1min")
+    return pd.DataFrame({"a": np.arange(n) + offset, "b": np.sin(np.arange(n) + offset)}, index=index)
+
+
+def test_contiguous_updates_match_full_window_scoring(scorer):
+    history = minutes("2023-05-01 10:00", 30)
+    incremental = scorer()
+
+    scores = pd.concat([incremental.update("Aruba", history.iloc[:12]),
+                        incremental.update("Aruba", history.iloc[8:30])])
+
+    pd.testing.assert_frame_equal(scores, scorer().update("Aruba", history))
+
+
+def test_gap_restarts_the_gateway_stream(scorer):
+    incremental = scorer()
+    incremental.update("Aruba", minutes("2023-05-01 10:00", 12))
+    after_gap = minutes("2023-05-01 11:00", 12, offset=100.0)
+
+    scores = incremental.update("Aruba", after_gap)
+
+    pd.testing.assert_frame_equal(scores, scorer().update("Aruba", after_gap))
+    assert scores.index[0] == after_gap.index[0]
@@ -0,0 +1,48 @@
+import shutil
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pandas as pd
+
+from tag_cache import TagEntryCache
+
+NOW = datetime(2023, 5, 10, tzinfo=timezone.utc)
+
+
+def fake_fetch(calls):
+    def fetch(gateway_id, start, end, tags):
+        calls.append((start, end))
+        timestamps = pd.date_range(start, end, freq="1min", inclusive="left")
+        return pd.DataFrame({"timestamps": timestamps, **{tag: np.arange(len(timestamps), dtype=float)
+                                                          for tag in tags}})
+    return fetch
+
+
+def test_bucket_evicted_after_its_manifest_was_read_is_refetched(tmp_path):
+    calls = []
+    cache = TagEntryCache(str(tmp_path), fake_fetch(calls), clock=lambda: NOW)
+    start, end = NOW - timedelta(hours=5), NOW - timedelta(hours=4, minutes=1)
+    first = cache.get("g-1", start, end, ["BathTemp"])
+
+    # the manifest is still there but the entries are gone, as in an eviction racing the read
+    for npz in tmp_path.glob("g-1/*/*.npz"):
+        npz.unlink()
+    second = cache.get("g-1", start, end, ["BathTemp"])
+
+    assert len(calls) == 2
+    assert second["BathTemp"].tolist() == first["BathTemp"].tolist()
+    assert cache.misses == 2
+
+
+def test_eviction_keeps_the_size_bound_with_buckets_removed_behind_its_back(tmp_path):
+    calls = []
+    cache = TagEntryCache(str(tmp_path), fake_fetch(calls), max_bytes=4096, clock=lambda: NOW)
+    for hours in range(24, 0, -2):
+        cache.get("g-1", NOW - timedelta(hours=hours), NOW - timedelta(hours=hours - 1), ["BathTemp"])
+        # another cache on the same directory may have evicted buckets already
+        shutil.rmtree(next(tmp_path.glob("g-1/*")), ignore_errors=True)
+
+    assert cache._size <= 4096
+    assert sum(f.stat().st_size for f in tmp_path.rglob("*") if f.is_file()) <= 4096
+    # a new cache picks up what is left on disk
+    assert TagEntryCache(str(tmp_path), fake_fetch(calls), max_bytes=4096)._size <= 4096